@@ -0,0 +1,87 @@
+# JSON codec benchmark
+# Compares the CPU time per message of the stdlib json path with the installed
+# codecs for the payloads the gateway handles most. Run from the repository root:
+#   python benchmarks/bench_codec.py [iterations]
+
+import importlib.util
+import json
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import codec  # noqa: E402
+
+COMMAND = json.dumps({
+    "action": "set_charging_profile",
+    "request_id": "req-42",
+    "args": {"connector_id": 1, "cs_charging_profiles": {
+        "charging_profile_id": 1, "stack_level": 0, "charging_profile_purpose": "TxDefaultProfile",
+        "charging_profile_kind": "Absolute", "charging_schedule": {
+            "charging_rate_unit": "A",
+            "charging_schedule_period": [{"start_period": i * 900, "limit": 16.0} for i in range(24)]}}},
+}).encode("utf-8")
+
+STATE_DOCUMENT = {
+    "connection_state": "CONNECTED", "status": "Charging", "transaction_id": 1234,
+    "meter_timestamp": "2026-01-27T10:00:00Z", "meter_context": "Sample.Periodic",
+    **{f"voltage_l{phase}_n": "231.4" for phase in (1, 2, 3)},
+    **{f"current_import_l{phase}": "15.9" for phase in (1, 2, 3)},
+    "power_active_import": "11000", "energy_active_import_register": "123456.7",
+}
+
+SPOOL_RECORD = {"topic": "ocpp/site1-cp1/state/power_active_import", "payload": "11000",
+                "qos": 0, "retain": True, "ts": 1769508000.123}
+
+
+def stdlib_decode():
+    return json.loads(COMMAND.decode("utf-8"))
+
+
+def stdlib_encode():
+    return json.dumps(STATE_DOCUMENT, separators=(',', ':'), default=str)
+
+
+def stdlib_record():
+    return json.loads(json.dumps(SPOOL_RECORD, separators=(',', ':'), default=str))
+
+
+def codec_decode():
+    return codec.loads(COMMAND)
+
+
+def codec_encode():
+    return codec.dumps(STATE_DOCUMENT)
+
+
+def codec_record():
+    return codec.loads(codec.dumps(SPOOL_RECORD))
+
+
+CASES = [
+    ("MQTT command decode", stdlib_decode, codec_decode),
+    ("state document encode", stdlib_encode, codec_encode),
+    ("spool record round trip", stdlib_record, codec_record),
+]
+
+
+def per_message_us(function, iterations):
+    return min(timeit.repeat(function, number=iterations, repeat=5)) / iterations * 1e6
+
+
+def main(iterations=20000):
+    print(f"{'case':<26}{'codec':<10}{'json µs':>10}{'codec µs':>10}{'saved':>8}")
+    for name in codec.CODECS[:-1]:
+        if importlib.util.find_spec(name) is None:
+            print(f"{'(all)':<26}{name:<10}{'not installed':>28}")
+            continue
+        codec.select(name)
+        for case, baseline, candidate in CASES:
+            before = per_message_us(baseline, iterations)
+            after = per_message_us(candidate, iterations)
+            print(f"{case:<26}{name:<10}{before:>10.2f}{after:>10.2f}{1 - after / before:>8.0%}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,71 @@
+# Fleet-wide commands
+# A command published on the broadcast topic runs on every charge point matched
+# by its station selector, a bounded number of stations at a time.
+
+import asyncio
+import fnmatch
+import logging
+import time
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+SELECT_ALL = ('all', '*')
+
+
+def select_stations(selector, station_ids):
+    """Return the station ids matched by selector, in a stable order.
+
+    ``selector`` is ``"all"`` (or missing), a glob such as ``"site1-*"``, or
+    a list of station ids. Listed ids are returned even when they are not
+    connected so they can be reported as such. Raises ValueError for any
+    other selector.
+    """
+    if selector is None or selector in SELECT_ALL:
+        return sorted(station_ids)
+    if isinstance(selector, str) and selector:
+        return sorted(station_id for station_id in station_ids if fnmatch.fnmatchcase(station_id, selector))
+    if isinstance(selector, list) and selector and all(isinstance(station_id, str) for station_id in selector):
+        return list(dict.fromkeys(selector))
+    raise ValueError("stations must be \"all\", a glob pattern or a list of station ids")
+
+
+async def fan_out(sessions, msg, parallelism, clock=time.monotonic):
+    """Run msg on every session and return {station_id: outcome}.
+
+    ``sessions`` maps station ids to their session, or to None for stations
+    that are not connected. At most ``parallelism`` stations run the command
+    at once; every outcome carries the station's latency in milliseconds.
+    """
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+
+    async def run(station_id, session):
+        if session is None:
+            return station_id, {'status': 'not_connected'}
+        async with semaphore:
+            started = clock()
+            try:
+                outcome = await session.execute_command(dict(msg))
+            except Exception as e:
+                logging.error("Broadcast %s failed for %s: %s", msg.get('action'), station_id, e)
+                outcome = {'status': 'error', 'error': str(e)}
+            outcome['latency_ms'] = round((clock() - started) * 1000, 1)
+        return station_id, outcome
+
+    results = await asyncio.gather(*(run(station_id, session) for station_id, session in sessions.items()))
+    return dict(results)
+
+
+def summarize(results, duration):
+    """Return the aggregated part of a broadcast result document."""
+    statuses = {}
+    for outcome in results.values():
+        status = str(outcome.get('status'))
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'status': 'completed',
+        'stations': len(results),
+        'statuses': statuses,
+        'duration_ms': round(duration * 1000, 1),
+        'results': results,
+    }
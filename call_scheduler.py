@@ -0,0 +1,147 @@
+# Priority scheduling of outbound OCPP calls
+# OCPP 1.6 allows one outstanding call per direction; when several are waiting
+# the most urgent class goes first, and waiting calls age so none starves.
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from mqtt_2_charge_point import REQUESTS
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+CALL_CLASSES = ('safety', 'transaction', 'configuration', 'diagnostics')
+
+DEFAULT_CALL_CLASS = 'configuration'
+
+# OCPP action -> priority class; actions not listed use DEFAULT_CALL_CLASS
+DEFAULT_CALL_PRIORITIES = {
+    'UnlockConnector': 'safety',
+    'ChangeAvailability': 'safety',
+    'Reset': 'safety',
+    'RemoteStartTransaction': 'transaction',
+    'RemoteStopTransaction': 'transaction',
+    'ReserveNow': 'transaction',
+    'CancelReservation': 'transaction',
+    'SetChargingProfile': 'transaction',
+    'ClearChargingProfile': 'transaction',
+    'GetDiagnostics': 'diagnostics',
+    'UpdateFirmware': 'diagnostics',
+}
+
+
+def load_priorities(raw_priorities):
+    """Parse the OCPP_CALL_PRIORITIES JSON string into {OCPP action: class}.
+
+    Keys may be MQTT action names (``get_configuration``) or OCPP action
+    names (``GetConfiguration``).
+    """
+    priorities = dict(DEFAULT_CALL_PRIORITIES)
+    if not raw_priorities:
+        return priorities
+    try:
+        overrides = json.loads(raw_priorities)
+    except json.JSONDecodeError:
+        logging.warning("Invalid OCPP_CALL_PRIORITIES JSON, ignoring value.")
+        return priorities
+    if not isinstance(overrides, dict):
+        logging.warning("OCPP_CALL_PRIORITIES should be a JSON object, ignoring value.")
+        return priorities
+
+    for action, call_class in overrides.items():
+        if call_class not in CALL_CLASSES:
+            logging.warning("Invalid OCPP_CALL_PRIORITIES class for '%s': %r", action, call_class)
+            continue
+        request = REQUESTS.get(action)
+        priorities[request.__name__ if request is not None else action] = call_class
+    return priorities
+
+
+class CallScheduler:
+    """Hands out the single outbound call slot of a charge point.
+
+    When the slot is released it goes to the waiting call with the best
+    effective rank: its class position in :data:`CALL_CLASSES`, improved by
+    one for every ``aging`` seconds spent waiting, so low-priority calls are
+    delayed but never starved. Calls of equal rank keep their arrival order.
+    Queue-wait times are recorded per class.
+    """
+
+    def __init__(self, priorities=None, aging=10.0, clock=time.monotonic):
+        self._priorities = DEFAULT_CALL_PRIORITIES if priorities is None else priorities
+        self._aging = aging
+        self._clock = clock
+        self._busy = False
+        self._waiters = []
+        self._order = itertools.count()
+        self._stats = {name: {'calls': 0, 'wait_total': 0.0, 'wait_max': 0.0} for name in CALL_CLASSES}
+
+    def class_for(self, action):
+        return self._priorities.get(action, DEFAULT_CALL_CLASS)
+
+    def _rank(self, waiter, now):
+        rank, order, enqueued, _future = waiter
+        if self._aging > 0:
+            rank -= (now - enqueued) / self._aging
+        return rank, order
+
+    @asynccontextmanager
+    async def slot(self, action):
+        """Wait for the call slot, then hold it for the duration of the block."""
+        call_class = self.class_for(action)
+        enqueued = self._clock()
+        if self._busy or self._waiters:
+            future = asyncio.get_running_loop().create_future()
+            waiter = (CALL_CLASSES.index(call_class), next(self._order), enqueued, future)
+            self._waiters.append(waiter)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not future.cancelled():
+                    # The slot was handed over just before the cancellation
+                    self._release()
+                raise
+        self._busy = True
+        self._record(call_class, self._clock() - enqueued)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        if not self._waiters:
+            self._busy = False
+            return
+        now = self._clock()
+        waiter = min(self._waiters, key=lambda candidate: self._rank(candidate, now))
+        self._waiters.remove(waiter)
+        # The slot stays busy and passes straight to the chosen call
+        waiter[3].set_result(None)
+
+    def _record(self, call_class, wait):
+        stats = self._stats[call_class]
+        stats['calls'] += 1
+        stats['wait_total'] += wait
+        stats['wait_max'] = max(stats['wait_max'], wait)
+
+    def stats(self):
+        """Return {class: {calls, waiting, wait_avg_ms, wait_max_ms}}."""
+        waiting = {name: 0 for name in CALL_CLASSES}
+        for waiter in self._waiters:
+            waiting[CALL_CLASSES[waiter[0]]] += 1
+        return {
+            name: {
+                'calls': stats['calls'],
+                'waiting': waiting[name],
+                'wait_avg_ms': round(stats['wait_total'] / stats['calls'] * 1000, 1) if stats['calls'] else 0.0,
+                'wait_max_ms': round(stats['wait_max'] * 1000, 1),
+            }
+            for name, stats in self._stats.items()
+        }
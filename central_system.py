@@ -30,7 +30,7 @@ except ModuleNotFoundError:
     logging.error(" $ pip install websockets")
     sys.exit(1)
 
-from charge_point import ChargePoint
+from charge_point import ChargePoint, get_mqtt_gateway
 from websockets.typing import Subprotocol
 
 load_dotenv(verbose=True)
@@ -129,6 +129,8 @@ async def on_connect(websocket: websockets.ServerConnection):
     async def run_session():
         disconnect_reason = "normal_closure"
         try:
+            # Routed first, so the announcement goes out over the shared MQTT connection
+            cpSession.attach_mqtt()
             # Announce connection established
             await cpSession.on_websocket_connected()
             await asyncio.gather(cpSession.mqtt_listen(), cpSession.start())
@@ -184,55 +186,77 @@ class SignalHandler:
 
 
 async def _publish_initial_disconnected_state():
-    """Publish DISCONNECTED state for all expected charge points on startup."""
+    """Publish DISCONNECTED state for all expected charge points on startup.
+
+    Runs in the background once the shared MQTT connection is up; all
+    publishes are issued together. Stations that connected in the meantime
+    are skipped so their CONNECTED state is not overwritten.
+    """
     if not EXPECTED_CHARGE_POINTS:
         logging.debug("No expected charge points configured, skipping initial state publication")
         return
     
     # Import here to avoid circular imports and get MQTT config
     from charge_point import (
-        MQTT_HOSTNAME, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, 
-        MQTT_BASEPATH, MQTT_USESTATIONNAME, MQTT_TRANSPORT,
-        MQTT_KEEPALIVE, MQTT_TIMEOUT
+        MQTT_BASEPATH, MQTT_USESTATIONNAME, MQTT_TIMEOUT, MQTT_STATE_FORMAT,
+        encode_state_document
     )
-    from aiomqtt import Client, MqttError
-    
-    try:
-        async with Client(
-            hostname=MQTT_HOSTNAME,
-            port=MQTT_PORT,
-            username=MQTT_USERNAME,
-            password=MQTT_PASSWORD,
-            identifier="ocpp2mqtt-startup",
-            transport=MQTT_TRANSPORT,
-            keepalive=MQTT_KEEPALIVE,
-            timeout=MQTT_TIMEOUT,
-        ) as client:
-            timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S") + "Z"
-            
-            for cp_id in EXPECTED_CHARGE_POINTS:
-                mqtt_path = MQTT_BASEPATH
-                if MQTT_USESTATIONNAME == "true":
-                    mqtt_path += cp_id
-                
-                await client.publish(f"{mqtt_path}/state/connection_state", payload="DISCONNECTED", retain=True)
-                await client.publish(f"{mqtt_path}/state/service_started", payload=timestamp, retain=True)
-                logging.info("Published initial DISCONNECTED state for %s", cp_id)
-                
-    except MqttError as e:
-        logging.warning("Failed to publish initial disconnected states: %s", e)
-    except Exception as e:
-        logging.error("Unexpected error publishing initial states: %s", e)
+    from aiomqtt import MqttError
+    from publish_policy import policy_for, message_properties
+
+    gateway = get_mqtt_gateway()
+    gateway.start()
+    if not await gateway.wait_connected(timeout=MQTT_TIMEOUT):
+        logging.warning("Failed to publish initial disconnected states: MQTT connection not ready")
+        return
+
+    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S") + "Z"
+
+    async def publish(cp_id, topic, payload):
+        # Checked right before publishing: a session announces itself after this point
+        if cp_id in _active_sessions:
+            return False
+        policy = policy_for(topic)
+        await gateway.publish(topic, payload=payload, qos=policy.qos, retain=policy.retain,
+                              properties=message_properties(policy))
+        return True
+
+    publishes = []
+    for cp_id in EXPECTED_CHARGE_POINTS:
+        mqtt_path = MQTT_BASEPATH
+        if MQTT_USESTATIONNAME == "true":
+            mqtt_path += cp_id
+
+        if MQTT_STATE_FORMAT in ('json', 'both'):
+            document = encode_state_document({'connection_state': 'DISCONNECTED', 'service_started': timestamp})
+            publishes.append(publish(cp_id, f"{mqtt_path}/state_json", document))
+        if MQTT_STATE_FORMAT in ('topics', 'both'):
+            publishes.append(publish(cp_id, f"{mqtt_path}/state/connection_state", "DISCONNECTED"))
+            publishes.append(publish(cp_id, f"{mqtt_path}/state/service_started", timestamp))
+
+    results = await asyncio.gather(*publishes, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors[:1]:
+        if isinstance(error, MqttError):
+            logging.warning("Failed to publish initial disconnected states: %s", error)
+        else:
+            logging.error("Unexpected error publishing initial states: %s", error)
+    logging.info("Published initial DISCONNECTED state for %d expected charge point(s) (%d publish(es), %d failed)",
+                 len(EXPECTED_CHARGE_POINTS), sum(1 for result in results if result is True), len(errors))
 
 
 async def main():
     # Display startup banner
     print(get_banner())
     logging.info("Starting ocpp2mqtt version %s", __version__)
-    
-    # Publish initial DISCONNECTED state for expected charge points
-    await _publish_initial_disconnected_state()
-    
+
+    # Open the shared MQTT connection used by every charge point session
+    get_mqtt_gateway().start()
+
+    # Publish initial DISCONNECTED state for expected charge points without
+    # holding up the OCPP listener
+    startup_announcement = asyncio.create_task(_publish_initial_disconnected_state())
+
     server = await websockets.serve(
         on_connect,
         LISTEN_ADDR,
@@ -241,7 +265,12 @@ async def main():
         ping_timeout=None,
     )
     logging.info("Server listening on %s:%s for OCPP connections...", LISTEN_ADDR, LISTEN_PORT)
-    await server.wait_closed()
+    try:
+        await server.wait_closed()
+    finally:
+        startup_announcement.cancel()
+        # Stops the MQTT connection and flushes the offline spool to disk
+        await get_mqtt_gateway().stop()
 
 signal_handler = SignalHandler()   
 
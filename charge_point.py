@@ -2,19 +2,37 @@ import asyncio
 import logging
 import os
 import re
+import time
 import json as JSON
 import mqtt_2_charge_point 
+import codec
+
+from mqtt_gateway import MqttGateway, UNROUTED_POLICIES, command_error, command_result_document, request_id_error, request_topic, response_target
+from publish_pipeline import PublishPipeline
+from last_value_cache import LastValueCache
+from publish_policy import policy_for, policy_for_class, message_properties
+from offline_spool import OfflineSpool
+from command_runner import CommandRunner, coalesce_key, command_deadline, load_coalesce_rules, load_limits, load_timeouts
+from command_validation import CommandValidationError, validate_command
+from command_queue import CommandQueue, load_actions
+import command_batch
+from meter_values import state_values
+from telemetry_aggregator import TelemetryAggregator, is_raw_station, load_deadbands
+from call_scheduler import CallScheduler, load_priorities
+from handler_stats import HandlerLatency
+from heartbeat_policy import HeartbeatPolicy, interval_for, load_intervals
 
 from dotenv import load_dotenv
 from datetime import datetime
 from aiomqtt import Client
 from aiomqtt import MqttError
+from aiomqtt import ProtocolVersion
 from websockets.protocol import State
 
 from ocpp.routing import on
 from ocpp.v16 import ChargePoint as cp
 from ocpp.v16.enums import AuthorizationStatus, Action, RegistrationStatus
-from ocpp.v16 import call_result
+from ocpp.v16 import call, call_result
 
 # Use logger from logging_config (configured by central_system.py)
 logger = logging.getLogger(__name__)
@@ -34,9 +52,109 @@ MQTT_CLIENT_ID=os.getenv('MQTT_CLIENT_ID', None)
 MQTT_WEBSOCKET_PATH=os.getenv('MQTT_WEBSOCKET_PATH', None)
 MQTT_USESTATIONNAME=os.getenv('MQTT_USESTATIONNAME', None)
 
-# OCPP command retry configuration
+# MQTT protocol version (3.1.1 or 5); topic aliases need MQTT 5
+MQTT_PROTOCOL=os.getenv('MQTT_PROTOCOL', '3.1.1')
+MQTT_TOPIC_ALIAS_MAXIMUM=int(os.getenv('MQTT_TOPIC_ALIAS_MAXIMUM', '0'))
+_MQTT_PROTOCOLS = {'3.1.1': ProtocolVersion.V311, '5': ProtocolVersion.V5}
+if MQTT_PROTOCOL not in _MQTT_PROTOCOLS:
+    logging.warning("Unsupported MQTT_PROTOCOL '%s'. Falling back to '3.1.1'", MQTT_PROTOCOL)
+    MQTT_PROTOCOL = '3.1.1'
+if MQTT_TOPIC_ALIAS_MAXIMUM and MQTT_PROTOCOL != '5':
+    logging.warning("MQTT_TOPIC_ALIAS_MAXIMUM requires MQTT_PROTOCOL=5, topic aliases disabled")
+    MQTT_TOPIC_ALIAS_MAXIMUM = 0
+
+# Commands for stations without an active session: reject, queue or error
+MQTT_UNKNOWN_STATION_POLICY=os.getenv('MQTT_UNKNOWN_STATION_POLICY', 'reject').lower()
+MQTT_UNKNOWN_STATION_QUEUE_SIZE=int(os.getenv('MQTT_UNKNOWN_STATION_QUEUE_SIZE', '100'))
+MQTT_UNKNOWN_STATION_QUEUE_TTL=float(os.getenv('MQTT_UNKNOWN_STATION_QUEUE_TTL', '300'))
+if MQTT_UNKNOWN_STATION_POLICY not in UNROUTED_POLICIES:
+    logging.warning("Unsupported MQTT_UNKNOWN_STATION_POLICY '%s'. Falling back to 'reject'", MQTT_UNKNOWN_STATION_POLICY)
+    MQTT_UNKNOWN_STATION_POLICY = 'reject'
+
+# JSON codec for MQTT payloads: auto (fastest installed), orjson, msgspec or json
+JSON_CODEC=codec.select(os.getenv('JSON_CODEC', 'auto').lower())
+
+# MQTT publish pipeline configuration
+MQTT_PUBLISH_PIPELINE=os.getenv('MQTT_PUBLISH_PIPELINE', 'false').lower() == 'true'
+MQTT_PUBLISH_QUEUE_SIZE=int(os.getenv('MQTT_PUBLISH_QUEUE_SIZE', '1000'))
+MQTT_PUBLISH_CONCURRENCY=int(os.getenv('MQTT_PUBLISH_CONCURRENCY', '4'))
+
+# Last-value cache for state topics (0 disables the cache)
+MQTT_STATE_CACHE_SIZE=int(os.getenv('MQTT_STATE_CACHE_SIZE', '256'))
+MQTT_STATE_REFRESH_INTERVAL=float(os.getenv('MQTT_STATE_REFRESH_INTERVAL', '300'))
+
+# Telemetry aggregation: window in seconds (0 publishes every reading), deadbands
+# per state key and stations (glob patterns) that always get raw readings
+MQTT_TELEMETRY_WINDOW=float(os.getenv('MQTT_TELEMETRY_WINDOW', '0'))
+MQTT_TELEMETRY_DEADBAND=load_deadbands(os.getenv('MQTT_TELEMETRY_DEADBAND', None))
+try:
+    MQTT_TELEMETRY_RAW_STATIONS=JSON.loads(os.getenv('MQTT_TELEMETRY_RAW_STATIONS', '[]'))
+    if not isinstance(MQTT_TELEMETRY_RAW_STATIONS, list):
+        logging.warning("MQTT_TELEMETRY_RAW_STATIONS should be a JSON array, ignoring")
+        MQTT_TELEMETRY_RAW_STATIONS = []
+except JSON.JSONDecodeError:
+    logging.warning("Invalid MQTT_TELEMETRY_RAW_STATIONS JSON, ignoring")
+    MQTT_TELEMETRY_RAW_STATIONS = []
+
+# Offline spool for publishes made while the broker is unavailable (disabled when no path is set)
+MQTT_SPOOL_PATH=os.getenv('MQTT_SPOOL_PATH', None)
+MQTT_SPOOL_MAX_BYTES=int(os.getenv('MQTT_SPOOL_MAX_BYTES', 10 * 1024 * 1024))
+MQTT_SPOOL_MAX_AGE=float(os.getenv('MQTT_SPOOL_MAX_AGE', 86400))
+MQTT_SPOOL_FSYNC_INTERVAL=float(os.getenv('MQTT_SPOOL_FSYNC_INTERVAL', 1.0))
+MQTT_SPOOL_REPLAY_BATCH=int(os.getenv('MQTT_SPOOL_REPLAY_BATCH', 100))
+
+# State publishing format: one topic per key, one JSON document per station, or both
+MQTT_STATE_FORMAT=os.getenv('MQTT_STATE_FORMAT', 'topics').lower()
+_MQTT_STATE_FORMATS = {'topics', 'json', 'both'}
+if MQTT_STATE_FORMAT not in _MQTT_STATE_FORMATS:
+    logging.warning("Unsupported MQTT_STATE_FORMAT '%s'. Falling back to 'topics'", MQTT_STATE_FORMAT)
+    MQTT_STATE_FORMAT = 'topics'
+
+# Concurrent MQTT commands per station: {"default": 1, "<action>": <limit>}
+MQTT_COMMAND_CONCURRENCY=load_limits(os.getenv('MQTT_COMMAND_CONCURRENCY', None))
+# Superseding commands: {"<action>": ["<arg path>", ...]}, see command_runner.DEFAULT_COALESCE_RULES
+MQTT_COMMAND_COALESCE=load_coalesce_rules(os.getenv('MQTT_COMMAND_COALESCE', None))
+
+# Per-action OCPP response timeouts in seconds: {"default": 30, "get_diagnostics": 120}
+OCPP_ACTION_TIMEOUTS=load_timeouts(os.getenv('OCPP_ACTION_TIMEOUTS', None))
+
+# Outbound call priorities: {"<action>": "safety" | "transaction" | "configuration" | "diagnostics"}
+OCPP_CALL_PRIORITIES=load_priorities(os.getenv('OCPP_CALL_PRIORITIES', None))
+# Seconds of waiting that promote a call by one priority class
+OCPP_CALL_AGING=float(os.getenv('OCPP_CALL_AGING', '10'))
+# Minimum seconds between call queue statistics publishes (0 disables them)
+OCPP_CALL_STATS_INTERVAL=float(os.getenv('OCPP_CALL_STATS_INTERVAL', '60'))
+
+# Heartbeat interval in seconds, per station: {"<station id or glob>": <seconds>}
+OCPP_HEARTBEAT_INTERVAL=int(os.getenv('OCPP_HEARTBEAT_INTERVAL', '10'))
+OCPP_HEARTBEAT_INTERVALS=load_intervals(os.getenv('OCPP_HEARTBEAT_INTERVALS', None))
+# Adaptive heartbeat: longest interval pushed while other traffic proves liveness (0 disables)
+OCPP_HEARTBEAT_MAX_INTERVAL=int(os.getenv('OCPP_HEARTBEAT_MAX_INTERVAL', '0'))
+
+# Respond-first mode: OCPP responses are sent before the MQTT publishes of their request
+OCPP_RESPOND_FIRST=os.getenv('OCPP_RESPOND_FIRST', 'false').lower() == 'true'
+# Minimum seconds between handler latency statistics publishes (0 disables them)
+OCPP_HANDLER_STATS_INTERVAL=float(os.getenv('OCPP_HANDLER_STATS_INTERVAL', '60'))
+
+# Retained connection and reconnect statistics of the gateway (disabled when empty)
+MQTT_GATEWAY_STATUS_TOPIC=os.getenv('MQTT_GATEWAY_STATUS_TOPIC', MQTT_BASEPATH.rstrip('/') + '/gateway_status')
+
+# Fleet broadcast commands on <MQTT_BROADCAST_PATH>/cmd (disabled when no path is set)
+MQTT_BROADCAST_PATH=os.getenv('MQTT_BROADCAST_PATH', None)
+MQTT_BROADCAST_PARALLELISM=int(os.getenv('MQTT_BROADCAST_PARALLELISM', '10'))
+
+# Durable queue for commands sent while a charge point is offline (disabled when no path is set)
+OCPP_COMMAND_QUEUE_PATH=os.getenv('OCPP_COMMAND_QUEUE_PATH', None)
+OCPP_COMMAND_QUEUE_TTL=float(os.getenv('OCPP_COMMAND_QUEUE_TTL', 3600))
+OCPP_COMMAND_QUEUE_MAX=int(os.getenv('OCPP_COMMAND_QUEUE_MAX', 100))
+OCPP_COMMAND_QUEUE_ACTIONS=load_actions(os.getenv('OCPP_COMMAND_QUEUE_ACTIONS', None))
+
+# How long a command waits for the charge point WebSocket to become ready.
+# Defaults to the total wait of the former retry schedule (attempts/base delay).
 OCPP_COMMAND_RETRY_ATTEMPTS=int(os.getenv('OCPP_COMMAND_RETRY_ATTEMPTS', '5'))
 OCPP_COMMAND_RETRY_BASE_DELAY=float(os.getenv('OCPP_COMMAND_RETRY_BASE_DELAY', '0.3'))
+OCPP_COMMAND_READY_TIMEOUT=float(os.getenv('OCPP_COMMAND_READY_TIMEOUT',
+                                           OCPP_COMMAND_RETRY_BASE_DELAY * (2 ** max(OCPP_COMMAND_RETRY_ATTEMPTS - 1, 0) - 1)))
 
 _MQTT_ALLOWED_TRANSPORTS = {'tcp', 'websockets', 'unix'}
 if MQTT_TRANSPORT not in _MQTT_ALLOWED_TRANSPORTS:
@@ -53,52 +171,172 @@ if _raw_ws_headers:
 else:
     MQTT_WEBSOCKET_HEADERS = None
 
+# MQTT command actions, each implemented by the function of the same name in mqtt_2_charge_point
+MQTT_ACTIONS = frozenset(mqtt_2_charge_point.REQUESTS)
+
 # specify the tag_ID which is authorized in the charge station. 
 # Remote server has to send to CP authorised ID in order to start charging
 AUTHORIZED_TAG_ID_LIST=JSON.loads(os.getenv('AUTHORIZED_TAG_ID_LIST', '[]'))
 # global variable for all charge points
 # charging_enabled = "OFF"
 
+def _mqtt_identifier(name):
+    base_identifier = MQTT_CLIENT_ID or f"ocpp2mqtt-{name}"
+    sanitized = re.sub(r"[^A-Za-z0-9_-]", "-", base_identifier)
+    # MQTT v3.1 limits client id length to 23 characters. Truncate while
+    # keeping most of the unique suffix for multi-CP deployments.
+    if len(sanitized) > 23:
+        sanitized = sanitized[:11] + sanitized[-12:]
+    return sanitized
+
+def _mqtt_client_options(identifier):
+    options = {
+        "identifier": identifier,
+        "transport": MQTT_TRANSPORT,
+        "keepalive": MQTT_KEEPALIVE,
+        "timeout": MQTT_TIMEOUT,
+        "protocol": _MQTT_PROTOCOLS[MQTT_PROTOCOL],
+    }
+    if MQTT_WEBSOCKET_PATH:
+        options["websocket_path"] = MQTT_WEBSOCKET_PATH
+    if MQTT_WEBSOCKET_HEADERS:
+        options["websocket_headers"] = MQTT_WEBSOCKET_HEADERS
+
+    return options
+
+def encode_state_document(values):
+    """Serialize a station state document as compact JSON."""
+    return codec.dumps(values)
+
+def create_mqtt_client():
+    """Build the client used by the shared gateway connection."""
+    return Client(hostname=MQTT_HOSTNAME,
+                  port=MQTT_PORT,
+                  username=MQTT_USERNAME,
+                  password=MQTT_PASSWORD,
+                  **_mqtt_client_options(_mqtt_identifier("gateway")))
+
+def command_wildcard():
+    """Return the wildcard covering every station's command topic, if any.
+
+    A single subscription is only possible when each station gets its own
+    topic level, i.e. station names are used and the base path ends with '/'.
+    """
+    if MQTT_USESTATIONNAME == "true" and MQTT_BASEPATH.endswith('/'):
+        return f"{MQTT_BASEPATH}+/cmd/#"
+    return None
+
+class ChargePointNotConnected(RuntimeError):
+    """Raised when a command cannot reach the charge point WebSocket in time."""
+
+
+class CommandExpired(RuntimeError):
+    """Raised when the deadline of a command passed before it was sent."""
+
+
+class CommandTimeout(TimeoutError):
+    """Raised when the charge point does not answer within the action timeout."""
+
+
+_mqtt_gateway = None
+
+def get_mqtt_gateway():
+    """Return the gateway-wide MQTT connection shared by all charge points."""
+    global _mqtt_gateway
+    if _mqtt_gateway is None:
+        spool = None
+        if MQTT_SPOOL_PATH:
+            spool = OfflineSpool(MQTT_SPOOL_PATH,
+                                 max_bytes=MQTT_SPOOL_MAX_BYTES,
+                                 max_age=MQTT_SPOOL_MAX_AGE,
+                                 fsync_interval=MQTT_SPOOL_FSYNC_INTERVAL)
+            logging.info("MQTT offline spool enabled: %s", MQTT_SPOOL_PATH)
+        command_queue = None
+        if OCPP_COMMAND_QUEUE_PATH:
+            command_queue = CommandQueue(OCPP_COMMAND_QUEUE_PATH,
+                                         default_ttl=OCPP_COMMAND_QUEUE_TTL,
+                                         max_per_station=OCPP_COMMAND_QUEUE_MAX,
+                                         actions=OCPP_COMMAND_QUEUE_ACTIONS,
+                                         coalesce_rules=MQTT_COMMAND_COALESCE)
+            logging.info("OCPP command queue enabled: %s (%d queued)", OCPP_COMMAND_QUEUE_PATH, len(command_queue))
+        _mqtt_gateway = MqttGateway(create_mqtt_client,
+                                    reconnect_base_delay=MQTT_RECONNECT_BASE_DELAY,
+                                    reconnect_max_delay=MQTT_RECONNECT_MAX_DELAY,
+                                    spool=spool,
+                                    replay_batch_size=MQTT_SPOOL_REPLAY_BATCH,
+                                    command_wildcard=command_wildcard(),
+                                    unrouted_policy=MQTT_UNKNOWN_STATION_POLICY,
+                                    unrouted_queue_size=MQTT_UNKNOWN_STATION_QUEUE_SIZE,
+                                    unrouted_queue_ttl=MQTT_UNKNOWN_STATION_QUEUE_TTL,
+                                    topic_alias_maximum=MQTT_TOPIC_ALIAS_MAXIMUM,
+                                    command_queue=command_queue,
+                                    broadcast_path=MQTT_BROADCAST_PATH or None,
+                                    broadcast_parallelism=MQTT_BROADCAST_PARALLELISM,
+                                    status_topic=MQTT_GATEWAY_STATUS_TOPIC or None)
+    return _mqtt_gateway
+
 class ChargePoint(cp):
 
     transaction_id = 1
     authorized_tag_id = ""
     status = "Unknown"
-    client = None
+    _client = None
     charging_enabled = "OFF"
     _shutdown = False
     _websocket_connected = False
     _connection_announced = False
 
     def __init__(self, id, connection, response_timeout=30):
-        super().__init__(id, connection, response_timeout)
+        self._action_timeouts = {'default': response_timeout, **OCPP_ACTION_TIMEOUTS}
+        # Per-action timeouts are enforced around each call, the library's must not fire first
+        super().__init__(id, connection, max(self._action_timeouts.values()))
         self.charging_enabled = "OFF"
         self._shutdown = False
         self._websocket_connected = False
         self._connection_announced = False
-        
-    def _mqtt_identifier(self):
-        base_identifier = MQTT_CLIENT_ID or f"ocpp2mqtt-{self.id}"
-        sanitized = re.sub(r"[^A-Za-z0-9_-]", "-", base_identifier)
-        # MQTT v3.1 limits client id length to 23 characters. Truncate while
-        # keeping most of the unique suffix for multi-CP deployments.
-        if len(sanitized) > 23:
-            sanitized = sanitized[:11] + sanitized[-12:]
-        return sanitized
-
-    def _mqtt_client_options(self):
-        options = {
-            "identifier": self._mqtt_identifier(),
-            "transport": MQTT_TRANSPORT,
-            "keepalive": MQTT_KEEPALIVE,
-            "timeout": MQTT_TIMEOUT,
-        }
-        if MQTT_WEBSOCKET_PATH:
-            options["websocket_path"] = MQTT_WEBSOCKET_PATH
-        if MQTT_WEBSOCKET_HEADERS:
-            options["websocket_headers"] = MQTT_WEBSOCKET_HEADERS
+        self._mqtt_route = None
+        # Set while the WebSocket session is up, see on_websocket_connected/disconnected
+        self._ready = asyncio.Event()
+        # Submitted MQTT commands still running: task -> {message, msg, expires, sent}
+        self._unfinished = {}
+        self._publisher = None
+        if MQTT_PUBLISH_PIPELINE:
+            self._publisher = PublishPipeline(self._mqtt_send,
+                                              max_size=MQTT_PUBLISH_QUEUE_SIZE,
+                                              concurrency=MQTT_PUBLISH_CONCURRENCY)
+        self._commands = CommandRunner(MQTT_COMMAND_CONCURRENCY)
+        self._calls = CallScheduler(OCPP_CALL_PRIORITIES, aging=OCPP_CALL_AGING)
+        # MQTT command task -> (action, deadline) bounding its OCPP call once the slot is granted
+        self._call_budgets = {}
+        self._call_stats_published = None
+        self._state_document = {}
+        # (handler task, deferred state values) while a request is handled in respond-first mode
+        self._deferring = None
+        self._side_effects = None
+        self._handler_latency = HandlerLatency()
+        self._handler_stats_published = None
+        self._heartbeat = HeartbeatPolicy(interval_for(id, OCPP_HEARTBEAT_INTERVAL, OCPP_HEARTBEAT_INTERVALS),
+                                          max_interval=OCPP_HEARTBEAT_MAX_INTERVAL)
+        self._telemetry = None
+        self._telemetry_flush = None
+        if (MQTT_TELEMETRY_WINDOW > 0 or MQTT_TELEMETRY_DEADBAND) and \
+                not is_raw_station(id, MQTT_TELEMETRY_RAW_STATIONS):
+            self._telemetry = TelemetryAggregator(MQTT_TELEMETRY_WINDOW, MQTT_TELEMETRY_DEADBAND)
+        self._state_cache = None
+        if MQTT_STATE_CACHE_SIZE > 0:
+            self._state_cache = LastValueCache(max_entries=MQTT_STATE_CACHE_SIZE,
+                                               refresh_interval=MQTT_STATE_REFRESH_INTERVAL)
 
-        return options
+    @property
+    def client(self):
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        # A new broker connection may have lost retained values: republish everything
+        if client is not None and client is not self._client and getattr(self, "_state_cache", None):
+            self._state_cache.clear()
+        self._client = client
 
     def _has_active_websocket(self):
         """Check if the OCPP WebSocket connection is active."""
@@ -194,14 +432,16 @@ class ChargePoint(cp):
     @on(Action.boot_notification)
     async def on_boot_notification(self, charge_point_vendor: str, charge_point_model: str, **kwargs):
         logging.info('---> Boot Notification')
-        await self.push_state_value_mqtt("charge_point_vendor", charge_point_vendor)
-        await self.push_state_value_mqtt("charge_point_model", charge_point_model)
-        await self.push_state_values_mqtt(**kwargs)
+        interval = self._heartbeat.booted()
+        await self.push_state_values_mqtt(charge_point_vendor=charge_point_vendor,
+                                          charge_point_model=charge_point_model,
+                                          heartbeat_interval=interval,
+                                          **kwargs)
 
                
         return call_result.BootNotification(
             current_time=datetime.utcnow().isoformat(),
-            interval=10,
+            interval=interval,
             status=RegistrationStatus.accepted,
         )
     
@@ -226,35 +466,131 @@ class ChargePoint(cp):
     @on(Action.heartbeat)
     async def on_heartbeat(self):
         logging.info("---> Heartbeat ")
-        await self.push_state_value_mqtt('heartbeat', 'ON')
-        await self.push_state_value_mqtt('last_seen', datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z")
+        await self.push_state_values_mqtt(heartbeat='ON',
+                                          last_seen=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z")
+        interval = self._heartbeat.on_heartbeat()
+        if interval is not None:
+            if self.is_websocket_connected():
+                self._commands.spawn(self._push_heartbeat_interval(interval))
+            else:
+                self._heartbeat.settle(interval, None)
             
         return call_result.Heartbeat(current_time=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z")
     
+    async def _handle_call(self, msg):
+        started = time.monotonic()
+        if msg.action != Action.heartbeat:
+            # Requests of the station prove liveness, see HeartbeatPolicy; the
+            # results of our own calls do not
+            self._heartbeat.observe()
+        if not OCPP_RESPOND_FIRST:
+            try:
+                return await super()._handle_call(msg)
+            finally:
+                # Publishes were awaited by the handler, before the response
+                elapsed = time.monotonic() - started
+                self._record_handler(msg.action, elapsed, elapsed)
+
+        deferred = []
+        self._deferring = (asyncio.current_task(), deferred)
+        try:
+            return await super()._handle_call(msg)
+        finally:
+            self._deferring = None
+            responded = time.monotonic() - started
+            if deferred:
+                self._side_effects = self._commands.spawn(
+                    self._publish_deferred(msg.action, deferred, self._side_effects, started, responded))
+            else:
+                self._record_handler(msg.action, responded, responded)
+
+    async def _publish_deferred(self, action, deferred, previous, started, responded):
+        """Make the publishes of a handled request, after those of the previous one."""
+        if previous is not None:
+            await asyncio.wait([previous])
+        for values in deferred:
+            try:
+                await self.push_state_values_mqtt(**values)
+            except Exception as e:
+                logging.error("Error publishing %s state to MQTT: %s", action, e)
+        self._record_handler(action, responded, time.monotonic() - started)
+
+    async def _drain_side_effects(self):
+        """Wait until the deferred publishes of every handled request were made."""
+        if self._side_effects is not None:
+            await asyncio.wait([self._side_effects])
+            self._side_effects = None
+
+    def _record_handler(self, action, response, published):
+        self._handler_latency.record(action, response, published)
+        now = time.monotonic()
+        if OCPP_HANDLER_STATS_INTERVAL <= 0 or (self._handler_stats_published is not None and
+                                                now - self._handler_stats_published < OCPP_HANDLER_STATS_INTERVAL):
+            return
+        self._handler_stats_published = now
+        self._commands.spawn(self._mqtt_publish(f"{self.get_mqttpath()}/handler_latency",
+                                                codec.dumps(self._handler_latency.stats())))
+
+    async def _push_heartbeat_interval(self, interval):
+        """Set the HeartbeatInterval of a station that did not boot with it."""
+        status = None
+        try:
+            async with asyncio.timeout(self._action_timeouts.get('change_configuration',
+                                                                 self._action_timeouts['default'])):
+                response = await self.call(call.ChangeConfiguration(key='HeartbeatInterval', value=str(interval)))
+            # None when the station answered with a CallError
+            status = response.status if response is not None else 'NotSupported'
+        except Exception as e:
+            logging.warning("Could not change the heartbeat interval of %s: %s", self.id, e)
+        self._heartbeat.settle(interval, status)
+        if status == 'Accepted':
+            logging.info("Heartbeat interval of %s set to %ds", self.id, interval)
+            await self.push_state_value_mqtt('heartbeat_interval', interval)
+        elif status is not None:
+            logging.info("%s answered %s to HeartbeatInterval=%d, keeping its interval", self.id, status, interval)
+
     @on(Action.meter_values)
     async def on_meter_values(self, **kwargs):
         logging.info('---> Meter values')
 
-        self.transaction_id = kwargs.get('transaction_id', self.transaction_id)        
-        await self.push_state_value_mqtt('transaction_id', self.transaction_id)
-        
-        for i in kwargs['meter_value'][0]['sampled_value']:
-            measure = (i['measurand']).replace('.','_').lower()
-            value = i['value']
-            await self.push_state_value_mqtt(measure, value)
+        self.transaction_id = kwargs.get('transaction_id', self.transaction_id)
+        # Every entry, phase and unit of the request in one publish set
+        values = {'transaction_id': self.transaction_id, **state_values(kwargs.get('meter_value'))}
+        logging.debug("Meter values for connector %s: %s", kwargs.get('connector_id'), values)
+        if self._telemetry is not None:
+            values = self._telemetry.add(values)
+            if self._telemetry.pending and self._telemetry_flush is None:
+                self._telemetry_flush = asyncio.get_running_loop().call_later(
+                    self._telemetry.window, self._on_telemetry_window)
+        if values:
+            await self.push_state_values_mqtt(**values)
 
-        for k,v in kwargs.items():
-            logging.info("%s: %s", k, v)
-        
         return call_result.MeterValues()
     
+    def _on_telemetry_window(self):
+        self._telemetry_flush = None
+        values = self._telemetry.flush()
+        if values:
+            self._commands.spawn(self.push_state_values_mqtt(**values))
+
+    async def flush_telemetry(self):
+        """Publish the readings of the current telemetry window right away."""
+        if self._telemetry_flush is not None:
+            self._telemetry_flush.cancel()
+            self._telemetry_flush = None
+        if self._telemetry is None:
+            return
+        values = self._telemetry.flush()
+        if values:
+            await self.push_state_values_mqtt(**values)
+
     @on(Action.start_transaction)
     async def on_start_transaction(self, connector_id: int, id_tag: str, meter_start: int, timestamp: str, **kwargs):
         logging.info('---> Start transaction')
 
-        await self.push_state_value_mqtt("meter_start_timestamp", timestamp)
-        await self.push_state_value_mqtt("meter_start", meter_start)
-        await self.push_state_values_mqtt(**kwargs)
+        await self.push_state_values_mqtt(meter_start_timestamp=timestamp,
+                                          meter_start=meter_start,
+                                          **kwargs)
         
         for k,v in kwargs.items():
             logging.info("%s: %s", k, v)
@@ -275,17 +611,22 @@ class ChargePoint(cp):
     @on(Action.status_notification)
     async def on_status_notification(self, connector_id: int, error_code: str, status: str, **kwargs):
         logging.info("---> Status Notification")
-        await self.push_state_value_mqtt('error_code', error_code)
-        await self.push_state_value_mqtt('status', status)
-        await self.push_state_value_mqtt('connector_id', connector_id)
-        await self.push_state_value_mqtt('connection_state', 'CONNECTED')
-        await self.push_state_value_mqtt('last_status_change', datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z")
-        await self.push_state_value_mqtt('last_seen', datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z")
-        await self.push_state_values_mqtt(**kwargs)
+        now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z"
+        values = dict(error_code=error_code,
+                      status=status,
+                      connector_id=connector_id,
+                      connection_state='CONNECTED',
+                      last_status_change=now,
+                      last_seen=now,
+                      **kwargs)
 
         if status != "Charging":
-            await self.push_state_value_mqtt('power_active_import', 0)
-            await self.push_state_value_mqtt('current_import', 0)
+            values['power_active_import'] = 0
+            values['current_import'] = 0
+            if self._telemetry is not None:
+                # Compare the next readings with the zeros, not the last metered values
+                self._telemetry.override({'power_active_import': 0, 'current_import': 0})
+        await self.push_state_values_mqtt(**values)
 
         # local persistence of the status
         self.status = status
@@ -296,9 +637,9 @@ class ChargePoint(cp):
     async def on_stop_transaction(self,  **kwargs):
         logging.info('---> Stopped transaction')
 
-        await self.push_state_value_mqtt("meter_stop_timestamp", kwargs['timestamp'])
-        await self.push_state_value_mqtt("meter_stop", kwargs['meter_stop'])
-        await self.push_state_value_mqtt("meter_stop_reason", kwargs['reason'])
+        await self.push_state_values_mqtt(meter_stop_timestamp=kwargs['timestamp'],
+                                          meter_stop=kwargs['meter_stop'],
+                                          meter_stop_reason=kwargs['reason'])
         
         for k,v in kwargs.items():
             logging.info("%s: %s", k, v)
@@ -311,166 +652,516 @@ class ChargePoint(cp):
     ## MQTT publish
 
     async def push_state_values_mqtt(self,**kwargs):
+        deferring = self._deferring
+        if deferring is not None and deferring[0] is asyncio.current_task():
+            # Respond-first mode: published once the OCPP response is sent
+            deferring[1].append(kwargs)
+            return
         mqtt_path = self.get_mqttpath()
-        for k,v in kwargs.items():
-            await self._mqtt_publish(f"{mqtt_path}/state/{k}", payload=v)
+        if MQTT_STATE_FORMAT in ('json', 'both'):
+            self._state_document.update(kwargs)
+            await self._publish_state(f"{mqtt_path}/state_json", encode_state_document(self._state_document))
+        if MQTT_STATE_FORMAT in ('topics', 'both'):
+            # Handed to the client together; publishes still go out in order
+            await asyncio.gather(*(self._publish_state(f"{mqtt_path}/state/{k}", v) for k, v in kwargs.items()))
 
     async def push_state_value_mqtt(self, key, value):
-        mqtt_path = self.get_mqttpath()
-        await self._mqtt_publish(f"{mqtt_path}/state/{key}", payload=value)
+        await self.push_state_values_mqtt(**{key: value})
+
+    async def _publish_state(self, topic, value):
+        # Retained state only needs a publish when the value actually changed
+        if self._state_cache is not None:
+            if self._state_cache.is_current(topic, value):
+                logging.debug("MQTT publish skipped, %s unchanged", topic)
+                return
+            # Remembered once queued: a value still in the pipeline is the one to compare with
+            self._state_cache.remember(topic, value)
+        await self._mqtt_publish(topic, payload=value)
 
     async def push_call_return_mqtt(self, result):
         mqtt_path = self.get_mqttpath()
         for k,v in result.items():
-            await self._mqtt_publish(f"{mqtt_path}/cmd_result/{k}", payload=v)
+            if isinstance(v, (dict, list, tuple)):
+                # e.g. configuration_key of GetConfiguration: MQTT payloads are scalars
+                v = codec.dumps(v)
+            await self._mqtt_publish(f"{mqtt_path}/cmd_result/{k}", payload=v, coalesce=False)
+
+    async def _mqtt_publish(self, topic, payload, coalesce=True):
+        if self._publisher is not None:
+            await self._publisher.put(topic, payload, coalesce=coalesce)
+            return
+        await self._mqtt_send(topic, payload)
+
+    async def call(self, payload, *args, **kwargs):
+        # Only one call may be outstanding: the most urgent waiting call goes first
+        try:
+            async with self._calls.slot(payload.__class__.__name__):
+                budget = self._call_budgets.get(asyncio.current_task())
+                if budget is None:
+                    return await super().call(payload, *args, **kwargs)
+                return await self._timed_call(budget, payload, *args, **kwargs)
+        finally:
+            self._publish_call_stats()
+
+    async def _timed_call(self, budget, payload, *args, **kwargs):
+        """Send the call of an MQTT command, bounded by the time left to its action."""
+        action, deadline = budget
+        timeout = self._remaining_time(action, deadline)
+        entry = self._unfinished.get(asyncio.current_task())
+        if entry is not None:
+            # From here on the charge point may have received it
+            entry['sent'] = True
+        try:
+            # Frees the single outstanding-call slot when the charge point does not answer
+            async with asyncio.timeout(timeout):
+                return await super().call(payload, *args, **kwargs)
+        except TimeoutError:
+            raise CommandTimeout(f"No response to {action} within {timeout:.1f}s") from None
+
+    def _publish_call_stats(self):
+        """Publish per-class call queue statistics, at most every OCPP_CALL_STATS_INTERVAL seconds."""
+        now = time.monotonic()
+        if OCPP_CALL_STATS_INTERVAL <= 0 or (self._call_stats_published is not None and
+                                             now - self._call_stats_published < OCPP_CALL_STATS_INTERVAL):
+            return
+        self._call_stats_published = now
+        self._commands.spawn(self._mqtt_publish(f"{self.get_mqttpath()}/call_queue",
+                                                codec.dumps(self._calls.stats())))
 
-    async def _mqtt_publish(self, topic, payload):
+    async def flush_mqtt(self):
+        """Wait until every queued MQTT publish has been sent."""
+        if self._publisher is not None:
+            await self._publisher.flush()
+
+    async def _mqtt_send(self, topic, payload):
         client = getattr(self, "client", None)
         if client is None:
+            # Not routed (yet or any more): the shared connection may still be up
+            client = get_mqtt_gateway().client
+        policy = policy_for(topic)
+        if client is None:
+            if self._spool_publish(topic, payload, policy):
+                logging.debug("MQTT client unavailable, spooled publish for topic %s", topic)
+                return
             logging.warning("MQTT publish skipped, client unavailable for topic %s", topic)
+            if self._state_cache is not None:
+                self._state_cache.forget(topic)
             return
+        publish_topic, properties = get_mqtt_gateway().publish_arguments(client, topic, message_properties(policy))
         try:
-            await client.publish(topic, payload=payload, retain=True)
+            await client.publish(publish_topic, payload=payload, qos=policy.qos, retain=policy.retain,
+                                 properties=properties)
         except MqttError as exc:
             logging.warning("MQTT publish to %s failed: %s", topic, exc)
+            if not self._spool_publish(topic, payload, policy) and self._state_cache is not None:
+                self._state_cache.forget(topic)
+
+    def _spool_publish(self, topic, payload, policy):
+        spool = get_mqtt_gateway().spool
+        if spool is None:
+            return False
+        return spool.append(topic, payload, qos=policy.qos, retain=policy.retain, expiry=policy.expiry)
 
     def shutdown(self):
         """Signal the MQTT loop to stop."""
         self._shutdown = True
         self._websocket_connected = False
+        self._ready.clear()
+        if self._mqtt_route is not None:
+            self._mqtt_route.close()
+        if self._publisher is not None:
+            self._publisher.close()
+        if self._telemetry_flush is not None:
+            self._telemetry_flush.cancel()
+            self._telemetry_flush = None
         logging.info("Shutdown requested for %s", self.id)
 
     async def on_websocket_connected(self):
         """Called when WebSocket connection is established."""
         self._websocket_connected = True
+        self._ready.set()
         logging.info("WebSocket connected for %s", self.id)
-        await self.push_state_value_mqtt('connection_state', 'CONNECTED')
-        await self.push_state_value_mqtt('last_connected', datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z")
+        await self.push_state_values_mqtt(connection_state='CONNECTED',
+                                          last_connected=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z")
         self._connection_announced = True
 
     async def on_websocket_disconnected(self, reason: str = "unknown"):
         """Called when WebSocket connection is lost."""
         was_connected = self._websocket_connected
         self._websocket_connected = False
+        self._ready.clear()
         logging.info("WebSocket disconnected for %s (reason: %s)", self.id, reason)
         
+        await self._drain_side_effects()
+        await self.flush_telemetry()
+        if self._telemetry is not None:
+            # Power is reset below: the next reading must be published whatever its value
+            self._telemetry.reset()
+
         # Only publish disconnection if we had announced a connection
         if was_connected or self._connection_announced:
-            await self.push_state_value_mqtt('connection_state', 'DISCONNECTED')
-            await self.push_state_value_mqtt('last_disconnected', datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z")
-            await self.push_state_value_mqtt('disconnect_reason', reason)
-            # Reset power values on disconnect
-            await self.push_state_value_mqtt('power_active_import', 0)
-            await self.push_state_value_mqtt('current_import', 0)
+            await self.push_state_values_mqtt(connection_state='DISCONNECTED',
+                                              last_disconnected=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z",
+                                              disconnect_reason=reason,
+                                              # Reset power values on disconnect
+                                              power_active_import=0,
+                                              current_import=0)
             self._connection_announced = False
+        await self.flush_mqtt()
 
     def is_websocket_connected(self) -> bool:
         """Check if WebSocket is currently connected."""
         return self._websocket_connected and self._has_active_websocket()
 
     ## received events from MQTT
+    def attach_mqtt(self):
+        """Register this session with the MQTT gateway, so it publishes over the shared connection.
+
+        Called before the connection is announced; mqtt_listen does it if it was not.
+        """
+        if self._mqtt_route is None:
+            gateway = get_mqtt_gateway()
+            gateway.start()
+            self._mqtt_route = gateway.register(self, self.get_mqttpath())
+
     async def mqtt_listen(self):
         logging.info("Starting MQTT loop for %s", self.id)
-        reconnect_delay = MQTT_RECONNECT_BASE_DELAY
-        while not self._shutdown:
-            try:
-                async with Client(hostname=MQTT_HOSTNAME,
-                                  port=MQTT_PORT,
-                                  username=MQTT_USERNAME,
-                                  password=MQTT_PASSWORD,
-                                  **self._mqtt_client_options()) as client:
-                    self.client=client
-                    reconnect_delay = MQTT_RECONNECT_BASE_DELAY
-                    mqtt_path = self.get_mqttpath()
-                    await client.subscribe(f"{mqtt_path}/cmd/#")
-                    async for message in client.messages:
-                        if self._shutdown:
-                            logging.info("MQTT loop shutdown requested for %s", self.id)
-                            break
-                        try:
-                            if isinstance(message.payload, bytes):
-                                payload = message.payload.decode("utf-8")
-                            else:
-                                payload = str(message.payload)
-                            logging.info("<-- MQTT msg received : %s", payload)
-                            msg = JSON.loads(payload)
-                        except (UnicodeDecodeError, JSON.JSONDecodeError) as decode_error:
-                            logging.warning("Invalid MQTT payload: %s", decode_error)
-                            continue
-
-                        try:
-                            result = await self._handle_mqtt_action(msg)
-                        except asyncio.CancelledError:
-                            logging.info("MQTT action cancelled for %s", self.id)
-                            self._shutdown = True
-                            raise
-                        except Exception as action_error:
-                            logging.error("MQTT action %s failed: %s", msg.get('action'), action_error)
-                            await self._publish_command_error(msg, action_error)
-                            continue
-
-                        if result:
-                            logging.info("--> MQTT result : %s", result)
-                            try:
-                                await self.push_call_return_mqtt(vars(result))
-                            except Exception as e:
-                                logging.error("Error publishing call result to MQTT : %s", e)
-            except asyncio.CancelledError:
-                logging.info("MQTT loop cancelled for %s", self.id)
-                self._shutdown = True
-                raise
-            except MqttError as e:
-                if self._shutdown:
-                    logging.info("MQTT disconnected during shutdown for %s", self.id)
+        gateway = get_mqtt_gateway()
+        self.attach_mqtt()
+        self._flush_command_queue(gateway)
+        try:
+            while not self._shutdown:
+                message = await self._mqtt_route.messages.get()
+                if message is None or self._shutdown:
+                    logging.info("MQTT loop shutdown requested for %s", self.id)
                     break
-                logging.warning("MQTT error (%s): %s", type(e).__name__, e)
+                msg = self._decode_mqtt_message(message)
+                if msg is None:
+                    continue
+                if str(message.topic).endswith('/cmd/cancel'):
+                    self._cancel_command(msg)
+                else:
+                    self._submit_command(message, msg)
+        except asyncio.CancelledError:
+            logging.info("MQTT loop cancelled for %s", self.id)
+            self._shutdown = True
+            raise
+        finally:
+            gateway.unregister(self._mqtt_route)
+            self._mqtt_route = None
+            self._release_unfinished(gateway)
+            await self._commands.close()
+
+        logging.info("MQTT loop stopped for %s", self.id)
+
+    def _flush_command_queue(self, gateway):
+        """Run the commands queued while this charge point was offline."""
+        if gateway.command_queue is None:
+            return
+        mqtt_path = self.get_mqttpath()
+        entries = gateway.command_queue.take(mqtt_path)
+        if not entries:
+            return
+        logging.info("Delivering %d queued command(s) to %s", len(entries), self.id)
+        for entry in entries:
+            msg = entry['command']
+            error = command_error(msg)
+            if error is not None:
+                self._commands.spawn(self._reject_command(None, msg, error))
+                continue
+            self._track(self._commands.submit(msg.get('action'),
+                                              self._run_mqtt_command(None, msg, expires=entry['expires']),
+                                              **self._cancellable(None, msg)),
+                        None, msg, entry['expires'])
+        gateway.queue_changed(mqtt_path)
+
+    def _submit_command(self, message, msg):
+        # Rejected before coalescing and the action limits: a malformed command
+        # answers at once and never replaces a valid waiting one
+        error = command_error(msg)
+        if error is not None:
+            self._commands.spawn(self._reject_command(message, msg, error))
+            return
+        if command_batch.is_batch(msg):
+            self._track(self._commands.submit('batch', self._run_batch(message, msg), **self._cancellable(message, msg)),
+                        message, msg)
+            return
+        # Run as a task so a slow OCPP call does not hold up later commands
+        superseded = {'status': 'superseded', 'action': msg.get('action')}
+        self._track(self._commands.submit(msg.get('action'), self._run_mqtt_command(message, msg),
+                                          key=coalesce_key(msg, MQTT_COMMAND_COALESCE),
+                                          on_superseded=lambda: self._commands.spawn(
+                                              self._publish_command_outcome(message, msg, superseded)),
+                                          **self._cancellable(message, msg)),
+                    message, msg)
+
+    def _track(self, task, message, msg, expires=None):
+        self._unfinished[task] = {'message': message, 'msg': msg, 'expires': expires, 'sent': False}
+        task.add_done_callback(lambda done: self._unfinished.pop(done, None))
+
+    def _release_unfinished(self, gateway):
+        """Settle the commands a closing session leaves unfinished.
+
+        Commands the durable queue accepts are queued for the next connection,
+        other commands not sent yet are handed to the station's next session,
+        and the rest are answered as cancelled.
+        """
+        mqtt_path = self.get_mqttpath()
+        for task, entry in list(self._unfinished.items()):
+            if task.cancelling():
+                # Superseded or cancelled through cmd/cancel: already answered
+                continue
+            del self._unfinished[task]
+            message, msg, expires = entry['message'], entry['msg'], entry['expires']
+            action = 'batch' if command_batch.is_batch(msg) else msg.get('action')
+            if self._queue_command(msg, expires):
+                if expires is None:
+                    gateway.report(mqtt_path, message, msg, {'status': 'queued', 'action': action})
+            elif not entry['sent'] and message is not None and action != 'batch':
+                logging.info("Handing %s over to the next session of %s", action, self.id)
+                gateway.hand_over(mqtt_path, message, OCPP_COMMAND_READY_TIMEOUT)
+            else:
+                logging.warning("MQTT action %s dropped: session of %s closed", action, self.id)
+                gateway.report(mqtt_path, message, msg, {'status': 'cancelled', 'action': action,
+                                                         'error': 'Charge point session closed'})
+
+    def _cancellable(self, message, msg):
+        """Return the submit() arguments that let cmd/cancel abort msg."""
+        request_id = msg.get('request_id')
+        if request_id is None or request_id_error(request_id) is not None:
+            return {}
+        cancelled = {'status': 'cancelled', 'action': msg.get('action')}
+        return {'request_id': request_id,
+                'on_cancelled': lambda: self._commands.spawn(self._publish_command_outcome(message, msg, cancelled))}
+
+    def _cancel_command(self, msg):
+        """Abort the waiting, running or queued command named by a cmd/cancel message."""
+        request_id = msg.get('request_id')
+        if request_id is None or request_id_error(request_id) is not None:
+            logging.warning("Ignored cancel request for %s without a valid request_id", self.id)
+            return
+        if self._commands.cancel(request_id):
+            logging.info("Cancelled command %s for %s", request_id, self.id)
+            return
+        gateway = get_mqtt_gateway()
+        queued = gateway.command_queue.remove(self.get_mqttpath(), request_id) if gateway.command_queue else None
+        if queued is None:
+            logging.warning("No command %s to cancel for %s", request_id, self.id)
+            return
+        logging.info("Cancelled queued command %s for %s", request_id, self.id)
+        self._commands.spawn(self._publish_command_outcome(
+            None, queued, {'status': 'cancelled', 'action': queued.get('action')}))
+        gateway.queue_changed(self.get_mqttpath())
+
+    def _queue_command(self, msg, expires=None):
+        """Put msg in the durable command queue. Returns False if it cannot be queued."""
+        gateway = get_mqtt_gateway()
+        if gateway.command_queue is None:
+            return False
+
+        def report_superseded(old):
+            # Published by the gateway: this session may be closing
+            gateway.report(self.get_mqttpath(), None, old, {'status': 'superseded', 'action': old.get('action')})
+
+        if not gateway.command_queue.put(self.get_mqttpath(), msg, expires, on_superseded=report_superseded):
+            return False
+        gateway.queue_changed(self.get_mqttpath())
+        return True
+
+    def _decode_mqtt_message(self, message):
+        payload = message.payload
+        if not isinstance(payload, (bytes, str)):
+            payload = str(payload)
+        try:
+            # Bytes are decoded directly, without an intermediate str
+            msg = codec.loads(payload)
+        except ValueError as decode_error:
+            logging.warning("Invalid MQTT payload: %s", decode_error)
+            return None
+        logging.info("<-- MQTT msg received : %s", msg)
+        if not isinstance(msg, dict):
+            logging.warning("Invalid MQTT payload: expected a JSON object")
+            return None
+        return msg
+
+    async def _reject_command(self, message, msg, error):
+        action = 'batch' if command_batch.is_batch(msg) else msg.get('action')
+        logging.warning("Rejected MQTT command %s: %s", action, getattr(error, 'errors', error))
+        request_id = msg.get('request_id')
+        if request_id is not None and request_id_error(request_id):
+            # The request_id cannot name a response topic
+            msg = {'action': action}
+        await self._publish_command_error(msg, error, message)
+
+    async def _run_mqtt_command(self, message, msg, expires=None):
+        """Run a command that passed command_error and publish its result."""
+        action = msg.get('action')
+        request_id = msg.get('request_id')
+        try:
+            result = await self._handle_mqtt_action(msg)
+        except asyncio.CancelledError:
+            # A closing session settles its unfinished commands, see _release_unfinished
+            logging.info("MQTT action %s cancelled for %s", action, self.id)
+            raise
+        except CommandExpired as expired:
+            logging.warning("MQTT action %s expired: %s", action, expired)
+            await self._publish_command_outcome(message, msg, {'status': 'expired', 'action': action,
+                                                               'error': str(expired)})
+            return
+        except ChargePointNotConnected as action_error:
+            if not self._queue_command(msg, expires):
+                logging.error("MQTT action %s failed: %s", action, action_error)
+                await self._publish_command_error(msg, action_error, message)
+                return
+            await self._publish_command_outcome(message, msg, {'status': 'queued', 'action': action})
+            return
+        except Exception as action_error:
+            logging.error("MQTT action %s failed: %s", action, action_error)
+            await self._publish_command_error(msg, action_error, message)
+            return
+
+        if result:
+            logging.info("--> MQTT result : %s", result)
+            try:
+                await self.push_call_return_mqtt(vars(result))
             except Exception as e:
-                if self._shutdown:
-                    break
-                logging.error("Unexpected MQTT loop error (%s): %s", type(e).__name__, e)
-            finally:
-                self.client = None
+                logging.error("Error publishing call result to MQTT : %s", e)
+            # Published on its own: a requester waiting for its answer always gets one
+            try:
+                await self._publish_command_document(message, msg, vars(result))
+            except Exception as e:
+                logging.error("Error publishing call result to MQTT : %s", e)
+        elif request_id is not None or response_target(message) is not None:
+            # A requester waiting for its answer always gets one
+            await self._publish_command_document(message, msg, self._empty_result_outcome(action))
 
-            if self._shutdown:
-                break
+    def _empty_result_outcome(self, action):
+        if action == 'charging_enabled':
+            return {'status': 'completed', 'charging_enabled': self.charging_enabled}
+        if action not in MQTT_ACTIONS:
+            return {'status': 'error', 'error': f"Unknown action '{action}'"}
+        return {'status': 'error', 'error': 'Charge point returned an error'}
 
-            wait_time = reconnect_delay
-            reconnect_delay = min(reconnect_delay * 2, MQTT_RECONNECT_MAX_DELAY)
-            logging.info("Reconnecting to MQTT in %s seconds...", wait_time)
-            await asyncio.sleep(wait_time)
-        
-        logging.info("MQTT loop stopped for %s", self.id)
+    async def execute_command(self, msg):
+        """Run a broadcast command and return its outcome instead of publishing it."""
+        if command_batch.is_batch(msg):
+            task = self._commands.submit('batch', self._execute_batch(msg))
+        else:
+            task = self._commands.submit(msg.get('action'), self._execute(msg))
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            return {'status': 'cancelled'}
+
+    async def _execute(self, msg):
+        """Run one command and return its outcome."""
+        action = msg.get('action')
+        try:
+            validate_command(action, self.get_args(msg))
+            command_deadline(msg)
+        except ValueError as validation_error:
+            outcome = {'status': 'error', 'error': str(validation_error)}
+            if getattr(validation_error, 'errors', None):
+                outcome['errors'] = validation_error.errors
+            return outcome
+        try:
+            result = await self._handle_mqtt_action(msg)
+        except ChargePointNotConnected:
+            return {'status': 'not_connected'}
+        except CommandExpired as expired:
+            return {'status': 'expired', 'error': str(expired)}
+        except Exception as action_error:
+            logging.error("MQTT action %s failed: %s", action, action_error)
+            return {'status': 'error', 'error': str(action_error)}
+        if result:
+            return dict(vars(result))
+        return self._empty_result_outcome(action)
+
+    async def _execute_batch(self, msg):
+        """Run the steps of a batch command and return the aggregated outcome."""
+        try:
+            steps, on_error = command_batch.parse_batch(msg)
+        except CommandValidationError as validation_error:
+            return {'action': 'batch', 'status': 'error', 'error': str(validation_error),
+                    'errors': validation_error.errors}
+        started = time.monotonic()
+        results = await command_batch.run_batch(steps, on_error, self._execute)
+        return command_batch.summarize(results, time.monotonic() - started)
+
+    async def _run_batch(self, message, msg):
+        outcome = await self._execute_batch(msg)
+        logging.info("--> MQTT batch result : %s (%s step(s))", outcome['status'], outcome.get('steps', 0))
+        try:
+            await self.push_call_return_mqtt({'status': outcome['status'], 'action': 'batch'})
+            if 'errors' in outcome:
+                await self.push_call_return_mqtt({'error': outcome['error'], 'errors': codec.dumps(outcome['errors'])})
+            document = command_result_document(msg, outcome)
+            await self._mqtt_publish(f"{self.get_mqttpath()}/cmd_result/json",
+                                     payload=codec.dumps(document), coalesce=False)
+            await self._publish_command_document(message, msg, outcome)
+        except Exception as e:
+            logging.error("Error publishing call result to MQTT : %s", e)
+
+    async def _publish_command_outcome(self, message, msg, outcome):
+        """Report what happened to a command that did not reach the charge point (yet)."""
+        try:
+            await self.push_call_return_mqtt(outcome)
+            await self._publish_command_document(message, msg, outcome)
+        except Exception as e:
+            logging.error("Error publishing call result to MQTT : %s", e)
+
+    async def _publish_command_document(self, message, msg, result):
+        """Publish the JSON result of a command to its request topic and MQTT v5 response topic."""
+        document = command_result_document(msg, result)
+        request_id = msg.get('request_id')
+        if request_id is not None:
+            await self._mqtt_publish(request_topic(self.get_mqttpath(), request_id),
+                                     payload=codec.dumps(document), coalesce=False)
+        await self._publish_response(message, document)
+
+    async def _publish_response(self, message, result):
+        """Answer an MQTT v5 request on its response topic, if it asked for one."""
+        target = response_target(message)
+        client = getattr(self, "client", None)
+        if target is None or client is None:
+            return
+        response_topic, properties = target
+        response_topic, properties = get_mqtt_gateway().publish_arguments(client, response_topic, properties)
+        try:
+            await client.publish(response_topic, payload=codec.dumps(result),
+                                 qos=policy_for_class('cmd_response').qos, retain=False, properties=properties)
+        except MqttError as exc:
+            logging.warning("MQTT response to %s failed: %s", target[0], exc)
 
     async def _wait_for_websocket_connection(self, action: str) -> bool:
         """
-        Wait for WebSocket connection to become available with exponential backoff.
-        Returns True if connection is available, False otherwise.
+        Wait until the WebSocket connection is ready, at most OCPP_COMMAND_READY_TIMEOUT seconds.
+        Returns True as soon as the connection is available, False once the deadline has passed.
         """
-        for attempt in range(OCPP_COMMAND_RETRY_ATTEMPTS):
+        if self._has_active_websocket():
+            return True
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + OCPP_COMMAND_READY_TIMEOUT
+        logging.info("WebSocket not ready for '%s', waiting up to %.2fs", action, OCPP_COMMAND_READY_TIMEOUT)
+        while True:
+            if self._ready.is_set():
+                # Session still marked ready but the socket is gone: wait for the next change
+                self._ready.clear()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
             if self._has_active_websocket():
-                if attempt > 0:
-                    logging.info("WebSocket reconnected after %d attempt(s) for action '%s'", attempt, action)
+                logging.info("WebSocket ready for action '%s'", action)
                 return True
-            
-            # Log connection state for debugging
-            connection = getattr(self, "_connection", None)
-            state_info = "None"
-            if connection:
-                if hasattr(connection, 'state'):
-                    state_info = f"state={connection.state}"
-                elif hasattr(connection, 'open'):
-                    state_info = f"open={connection.open}"
-                elif hasattr(connection, 'closed'):
-                    state_info = f"closed={connection.closed}"
-            
-            if attempt < OCPP_COMMAND_RETRY_ATTEMPTS - 1:
-                delay = OCPP_COMMAND_RETRY_BASE_DELAY * (2 ** attempt)
-                logging.info("WebSocket not ready for '%s' (%s), retry %d/%d in %.2fs", 
-                            action, state_info, attempt + 1, OCPP_COMMAND_RETRY_ATTEMPTS, delay)
-                await asyncio.sleep(delay)
-            else:
-                logging.warning("WebSocket check failed for '%s' (%s), no more retries", action, state_info)
-        
+
+        logging.warning("WebSocket not ready for '%s' after %.2fs", action, OCPP_COMMAND_READY_TIMEOUT)
         return False
 
     async def _handle_mqtt_action(self, msg):
@@ -482,48 +1173,52 @@ class ChargePoint(cp):
             logging.info("<-- Charging enabled : %s", self.charging_enabled)
             return None
 
-        # Wait for WebSocket with retry mechanism to handle brief reconnections
+        deadline = command_deadline(msg)
+        self._remaining_time(action, deadline)
+
+        # Wait for the WebSocket to become ready to handle brief reconnections
         if not await self._wait_for_websocket_connection(action):
-            logging.warning("WebSocket not available after %d retries for action '%s'", 
-                          OCPP_COMMAND_RETRY_ATTEMPTS, action)
-            raise RuntimeError('Charge point websocket is not connected')
-
-        action_map = {
-            'cancel_reservation': mqtt_2_charge_point.cancel_reservation,
-            'change_availability': mqtt_2_charge_point.change_availability,
-            'change_configuration': mqtt_2_charge_point.change_configuration,
-            'clear_cache': mqtt_2_charge_point.clear_cache,
-            'clear_charging_profile': mqtt_2_charge_point.clear_charging_profile,
-            'data_transfer': mqtt_2_charge_point.data_transfer,
-            'get_composite_schedule': mqtt_2_charge_point.get_composite_schedule,
-            'get_configuration': mqtt_2_charge_point.get_configuration,
-            'get_diagnostics': mqtt_2_charge_point.get_diagnostics,
-            'get_local_version': mqtt_2_charge_point.get_local_version,
-            'remote_start_transaction': mqtt_2_charge_point.remote_start_transaction,
-            'remote_stop_transaction': mqtt_2_charge_point.remote_stop_transaction,
-            'reserve_now': mqtt_2_charge_point.reserve_now,
-            'reset': mqtt_2_charge_point.reset,
-            'send_local_list': mqtt_2_charge_point.send_local_list,
-            'set_charging_profile': mqtt_2_charge_point.set_charging_profile,
-            'trigger_message': mqtt_2_charge_point.trigger_message,
-            'unlock_connector': mqtt_2_charge_point.unlock_connector,
-            'update_firmware': mqtt_2_charge_point.update_firmware,
-        }
+            raise ChargePointNotConnected('Charge point websocket is not connected')
 
-        handler = action_map.get(action)
-        if not handler:
+        if action not in MQTT_ACTIONS:
             logging.warning("Action not found: %s", action)
             return None
 
-        return await handler(self, args)
+        # Looked up at call time so the OCPP helpers can be replaced
+        handler = getattr(mqtt_2_charge_point, action)
+        task = asyncio.current_task()
+        # The response timeout starts once the call slot is granted, see _timed_call
+        self._call_budgets[task] = (action, deadline)
+        try:
+            return await handler(self, args)
+        finally:
+            self._call_budgets.pop(task, None)
+
+    def _remaining_time(self, action, deadline):
+        """Return how long the OCPP call of action may take, or raise CommandExpired."""
+        timeout = self._action_timeouts.get(action, self._action_timeouts['default'])
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise CommandExpired(f"Deadline of {action} passed before it was sent")
+        return min(timeout, remaining)
 
-    async def _publish_command_error(self, msg, error):
+    async def _publish_command_error(self, msg, error, message=None):
+        result = {
+            'status': 'error',
+            'action': msg.get('action'),
+            'error': str(error)
+        }
+        errors = getattr(error, 'errors', None)
         try:
-            await self.push_call_return_mqtt({
-                'status': 'error',
-                'action': msg.get('action'),
-                'error': str(error)
-            })
+            if errors:
+                await self.push_call_return_mqtt(dict(result, errors=codec.dumps(errors)))
+                result['errors'] = errors
+            else:
+                await self.push_call_return_mqtt(result)
+            if message is not None:
+                await self._publish_command_document(message, msg, result)
         except Exception as publish_error:
             logging.error("Failed to publish command error: %s", publish_error)
         
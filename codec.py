@@ -0,0 +1,99 @@
+# JSON codec for MQTT payloads and gateway files
+# Uses orjson or msgspec when installed and falls back to the standard library.
+# Payloads are decoded straight from bytes and encoded compactly.
+
+import json
+import logging
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+# Preference order of the automatic selection
+CODECS = ('orjson', 'msgspec', 'json')
+
+
+def _stdlib_codec():
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'), default=str)
+
+    return loads, dumps
+
+
+def _orjson_codec():
+    import orjson
+
+    options = orjson.OPT_NON_STR_KEYS
+
+    def loads(data):
+        # orjson.JSONDecodeError is a ValueError
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=str, option=options).decode('utf-8')
+
+    return loads, dumps
+
+
+def _msgspec_codec():
+    import msgspec
+
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder(enc_hook=str)
+
+    def loads(data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from None
+
+    def dumps(obj):
+        return encoder.encode(obj).decode('utf-8')
+
+    return loads, dumps
+
+
+_FACTORIES = {'orjson': _orjson_codec, 'msgspec': _msgspec_codec, 'json': _stdlib_codec}
+
+name = 'json'
+_loads, _dumps = _stdlib_codec()
+
+
+def select(codec='auto'):
+    """Switch to codec (``auto`` picks the fastest installed one) and return its name.
+
+    An unknown or missing codec falls back to the standard library.
+    """
+    global name, _loads, _dumps
+    candidates = CODECS if codec == 'auto' else (codec,)
+    for candidate in candidates:
+        factory = _FACTORIES.get(candidate)
+        if factory is None:
+            logging.warning("Unsupported JSON codec '%s'. Falling back to 'json'", candidate)
+            break
+        try:
+            _loads, _dumps = factory()
+        except ImportError:
+            if codec != 'auto':
+                logging.warning("JSON codec '%s' is not installed. Falling back to 'json'", candidate)
+            continue
+        name = candidate
+        return name
+    _loads, _dumps = _stdlib_codec()
+    name = 'json'
+    return name
+
+
+def loads(data):
+    """Decode JSON from str or bytes; raises ValueError on invalid input."""
+    return _loads(data)
+
+
+def dumps(obj):
+    """Encode obj as compact JSON text; values JSON does not know are encoded with str()."""
+    return _dumps(obj)
+
+
+select()
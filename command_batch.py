@@ -0,0 +1,114 @@
+# Batched multi-step commands
+# A cmd payload with a "batch" list runs its steps in order against one station
+# and reports them together in a single aggregated result document.
+
+import logging
+import time
+
+from command_runner import command_deadline
+from command_validation import CommandValidationError, validate_command
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+BATCH_ERROR_POLICIES = ('stop', 'continue')
+
+MAX_BATCH_STEPS = 100
+
+# Step outcomes that count as a failure (OCPP statuses included)
+FAILED_STATUSES = frozenset({
+    'error', 'not_connected', 'expired', 'cancelled',
+    'Rejected', 'NotSupported', 'UnlockFailed', 'Failed', 'VersionMismatch',
+})
+
+
+def is_batch(msg):
+    return 'batch' in msg
+
+
+def parse_batch(msg):
+    """Return the (steps, on_error) of a batch command.
+
+    Every step is checked up front, so a malformed batch is rejected before
+    anything is sent. Steps inherit the batch ``deadline``. Raises
+    CommandValidationError listing the problems of every step.
+    """
+    steps = msg.get('batch')
+    on_error = msg.get('on_error', 'stop')
+    if on_error not in BATCH_ERROR_POLICIES:
+        raise CommandValidationError("Invalid batch", [{'path': 'on_error', 'message': "must be 'stop' or 'continue'"}])
+    if not isinstance(steps, list) or not steps or len(steps) > MAX_BATCH_STEPS:
+        raise CommandValidationError("Invalid batch", [{
+            'path': 'batch', 'message': f"must be a list of 1 to {MAX_BATCH_STEPS} commands"}])
+    try:
+        command_deadline(msg)
+    except ValueError as e:
+        raise CommandValidationError("Invalid batch", [{'path': 'deadline', 'message': str(e)}]) from None
+
+    errors = []
+    parsed = []
+    for index, step in enumerate(steps):
+        prefix = f"batch.{index}"
+        if not isinstance(step, dict) or not isinstance(step.get('action'), str):
+            errors.append({'path': prefix, 'message': 'must be a JSON object with an action'})
+            continue
+        if is_batch(step):
+            errors.append({'path': prefix, 'message': 'batches cannot be nested'})
+            continue
+        try:
+            validate_command(step['action'], step.get('args'))
+            command_deadline(step)
+        except CommandValidationError as e:
+            errors.extend({'path': f"{prefix}.{error['path']}".rstrip('.'), 'message': error['message']}
+                          for error in e.errors)
+            continue
+        except ValueError as e:
+            errors.append({'path': f"{prefix}.deadline", 'message': str(e)})
+            continue
+        if 'deadline' in msg and 'deadline' not in step:
+            step = dict(step, deadline=msg['deadline'])
+        parsed.append(step)
+    if errors:
+        raise CommandValidationError("Invalid batch", errors)
+    return parsed, on_error
+
+
+def step_failed(outcome):
+    return outcome.get('status') in FAILED_STATUSES
+
+
+async def run_batch(steps, on_error, execute, clock=time.monotonic):
+    """Run steps one after the other through ``execute`` and return their outcomes.
+
+    With ``on_error='stop'`` the steps after the first failure are skipped.
+    """
+    results = []
+    stopped = False
+    for step in steps:
+        if stopped:
+            results.append({'action': step['action'], 'status': 'skipped'})
+            continue
+        started = clock()
+        outcome = await execute(step)
+        results.append({'action': step['action'], **outcome,
+                        'latency_ms': round((clock() - started) * 1000, 1)})
+        if step_failed(outcome) and on_error == 'stop':
+            logging.info("Batch stopped at %s: %s", step['action'], outcome.get('error', outcome.get('status')))
+            stopped = True
+    return results
+
+
+def summarize(results, duration):
+    """Return the aggregated result of a batch."""
+    failed = sum(1 for outcome in results if step_failed(outcome))
+    skipped = sum(1 for outcome in results if outcome['status'] == 'skipped')
+    return {
+        'action': 'batch',
+        'status': 'failed' if failed else 'completed',
+        'steps': len(results),
+        'succeeded': len(results) - failed - skipped,
+        'failed': failed,
+        'skipped': skipped,
+        'duration_ms': round(duration * 1000, 1),
+        'results': results,
+    }
@@ -0,0 +1,220 @@
+# Durable per-station queue for commands sent to offline charge points
+# Queued commands are kept in a JSON file so they survive restarts, expire
+# after their TTL and are handed back when the station reconnects.
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from command_runner import coalesce_key, command_deadline
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+# Commands that are still meaningful when delivered late
+DEFAULT_QUEUED_ACTIONS = frozenset({
+    'change_availability',
+    'change_configuration',
+    'clear_cache',
+    'clear_charging_profile',
+    'send_local_list',
+    'set_charging_profile',
+})
+
+
+def load_actions(raw_actions):
+    """Parse the OCPP_COMMAND_QUEUE_ACTIONS JSON array."""
+    if not raw_actions:
+        return DEFAULT_QUEUED_ACTIONS
+    try:
+        actions = json.loads(raw_actions)
+    except json.JSONDecodeError:
+        logging.warning("Invalid OCPP_COMMAND_QUEUE_ACTIONS JSON, using defaults.")
+        return DEFAULT_QUEUED_ACTIONS
+    if not isinstance(actions, list) or not all(isinstance(action, str) for action in actions):
+        logging.warning("OCPP_COMMAND_QUEUE_ACTIONS should be a JSON array of action names, using defaults.")
+        return DEFAULT_QUEUED_ACTIONS
+    return frozenset(actions)
+
+
+class CommandQueue:
+    """Commands waiting for their charge point, persisted to ``path``.
+
+    Only commands whose action is in ``actions`` are accepted. Each command
+    expires ``default_ttl`` seconds after it was queued unless it carries
+    its own ``ttl``; at most ``max_per_station`` commands are kept per
+    station, the oldest being dropped first. A command matching one of the
+    ``coalesce_rules`` replaces the queued commands it supersedes. The file
+    is rewritten atomically after every change; inside an event loop the
+    write runs in the default executor, changes made meanwhile being
+    coalesced into the next write, and :meth:`flush` waits for it.
+    """
+
+    def __init__(self, path, default_ttl=3600, max_per_station=100,
+                 actions=DEFAULT_QUEUED_ACTIONS, clock=time.time, coalesce_rules=None):
+        self.path = path
+        self._coalesce_rules = coalesce_rules or {}
+        self.superseded = 0
+        self._default_ttl = default_ttl
+        self._max_per_station = max(1, max_per_station)
+        self._actions = frozenset(actions)
+        self._clock = clock
+        self.dropped = 0
+        self.expired = 0
+        self._dirty = False
+        self._writer = None
+
+        queue_dir = os.path.dirname(path)
+        if queue_dir and not os.path.exists(queue_dir):
+            os.makedirs(queue_dir, exist_ok=True)
+        self._stations = self._load()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._stations.values())
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stations = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning("Could not read command queue %s, starting empty: %s", self.path, e)
+            return {}
+        if not isinstance(stations, dict):
+            return {}
+        return {station: entries for station, entries in stations.items() if isinstance(entries, list) and entries}
+
+    def _snapshot(self):
+        return json.dumps(self._stations, separators=(',', ':'), default=str)
+
+    def _write(self, data):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _save(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._snapshot())
+            return
+        self._dirty = True
+        if self._writer is None or self._writer.done():
+            self._writer = loop.create_task(self._write_behind())
+
+    async def _write_behind(self):
+        loop = asyncio.get_running_loop()
+        while self._dirty:
+            self._dirty = False
+            # Serialized on the loop so the executor never sees a queue being changed
+            data = self._snapshot()
+            try:
+                await loop.run_in_executor(None, self._write, data)
+            except OSError as e:
+                logging.warning("Could not write command queue %s: %s", self.path, e)
+
+    async def flush(self):
+        """Wait until the last change is written to disk."""
+        if self._writer is not None:
+            await asyncio.shield(self._writer)
+
+    def accepts(self, msg) -> bool:
+        return isinstance(msg, dict) and msg.get('action') in self._actions
+
+    def put(self, station, msg, expires=None, on_superseded=None) -> bool:
+        """Queue msg for station. Returns False if msg cannot be queued.
+
+        ``expires`` keeps the original deadline of a command that is queued
+        again after a failed delivery; a ``deadline`` in msg shortens it.
+        ``on_superseded`` is called with every queued command that msg
+        replaces.
+        """
+        if not self.accepts(msg):
+            return False
+        try:
+            deadline = command_deadline(msg)
+        except ValueError:
+            return False
+        now = self._clock()
+        if expires is None:
+            ttl = msg.get('ttl', self._default_ttl)
+            if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0:
+                ttl = self._default_ttl
+            expires = now + ttl
+        if deadline is not None:
+            expires = min(expires, deadline)
+        if expires <= now:
+            self.expired += 1
+            return False
+
+        entries = self._stations.setdefault(station, [])
+        key = coalesce_key(msg, self._coalesce_rules)
+        if key is not None:
+            replaced = [entry for entry in entries if coalesce_key(entry['command'], self._coalesce_rules) == key]
+            for entry in replaced:
+                entries.remove(entry)
+                self.superseded += 1
+                if on_superseded is not None:
+                    on_superseded(entry['command'])
+        entries.append({'queued_at': now, 'expires': expires, 'command': msg})
+        if len(entries) > self._max_per_station:
+            entries.pop(0)
+            self.dropped += 1
+            logging.warning("Command queue for %s is full, dropping oldest command", station)
+        self._save()
+        logging.info("Queued %s for %s until it reconnects (%d queued)", msg.get('action'), station, len(entries))
+        return True
+
+    def _purge(self, station):
+        entries = self._stations.get(station)
+        if not entries:
+            return []
+        now = self._clock()
+        live = [entry for entry in entries if entry['expires'] > now]
+        if len(live) != len(entries):
+            self.expired += len(entries) - len(live)
+            logging.info("Discarded %d expired queued command(s) for %s", len(entries) - len(live), station)
+        return live
+
+    def take(self, station):
+        """Remove and return the live queued entries of station, oldest first."""
+        live = self._purge(station)
+        if station in self._stations:
+            del self._stations[station]
+            self._save()
+        return live
+
+    def remove(self, station, request_id):
+        """Remove and return the queued command of station with request_id, or None."""
+        entries = self._stations.get(station, [])
+        for entry in entries:
+            if entry['command'].get('request_id') == request_id:
+                entries.remove(entry)
+                if not entries:
+                    del self._stations[station]
+                self._save()
+                return entry['command']
+        return None
+
+    def stats(self, station):
+        """Return queue depth and age information for station."""
+        entries = self._purge(station)
+        if len(entries) != len(self._stations.get(station, [])):
+            if entries:
+                self._stations[station] = entries
+            else:
+                self._stations.pop(station, None)
+            self._save()
+        oldest = entries[0]['queued_at'] if entries else None
+        return {
+            'depth': len(entries),
+            'oldest_queued_at': oldest,
+            'oldest_age': round(self._clock() - oldest, 3) if oldest is not None else None,
+            'next_expiry': min(entry['expires'] for entry in entries) if entries else None,
+        }
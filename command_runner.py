@@ -0,0 +1,256 @@
+# Concurrent execution of MQTT commands for one charge point
+# Every command runs as its own task so a slow OCPP call does not hold up
+# later commands; per-action limits bound how many run at the same time and
+# superseding commands replace older ones that are still waiting.
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACTION_LIMIT = 1
+
+
+def load_limits(raw_limits):
+    """Parse the MQTT_COMMAND_CONCURRENCY JSON string into {action: limit}.
+
+    The ``default`` key sets the limit of actions that are not listed.
+    """
+    limits = {'default': DEFAULT_ACTION_LIMIT}
+    if not raw_limits:
+        return limits
+    try:
+        overrides = json.loads(raw_limits)
+    except json.JSONDecodeError:
+        logging.warning("Invalid MQTT_COMMAND_CONCURRENCY JSON, ignoring value.")
+        return limits
+    if not isinstance(overrides, dict):
+        logging.warning("MQTT_COMMAND_CONCURRENCY should be a JSON object, ignoring value.")
+        return limits
+
+    for action, limit in overrides.items():
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            logging.warning("Invalid MQTT_COMMAND_CONCURRENCY limit for '%s': %r", action, limit)
+            continue
+        limits[action] = limit
+    return limits
+
+
+def load_timeouts(raw_timeouts):
+    """Parse the OCPP_ACTION_TIMEOUTS JSON string into {action: seconds}.
+
+    The ``default`` key sets the timeout of actions that are not listed.
+    """
+    timeouts = {}
+    if not raw_timeouts:
+        return timeouts
+    try:
+        overrides = json.loads(raw_timeouts)
+    except json.JSONDecodeError:
+        logging.warning("Invalid OCPP_ACTION_TIMEOUTS JSON, ignoring value.")
+        return timeouts
+    if not isinstance(overrides, dict):
+        logging.warning("OCPP_ACTION_TIMEOUTS should be a JSON object, ignoring value.")
+        return timeouts
+
+    for action, timeout in overrides.items():
+        if not isinstance(timeout, (int, float)) or isinstance(timeout, bool) or timeout <= 0:
+            logging.warning("Invalid OCPP_ACTION_TIMEOUTS timeout for '%s': %r", action, timeout)
+            continue
+        timeouts[action] = float(timeout)
+    return timeouts
+
+
+def command_deadline(msg):
+    """Return the ``deadline`` of msg as a Unix timestamp, or None.
+
+    Accepts a Unix timestamp or an ISO 8601 date (UTC unless it has an
+    offset). Raises ValueError for anything else.
+    """
+    deadline = msg.get('deadline')
+    if deadline is None:
+        return None
+    if isinstance(deadline, (int, float)) and not isinstance(deadline, bool):
+        return float(deadline)
+    if isinstance(deadline, str):
+        try:
+            parsed = datetime.fromisoformat(deadline)
+        except ValueError:
+            pass
+        else:
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            return parsed.timestamp()
+    raise ValueError("deadline must be a Unix timestamp or an ISO 8601 date")
+
+
+# Superseding actions and the arguments identifying what they act on: a newer
+# command with the same values replaces an older one that has not been sent.
+DEFAULT_COALESCE_RULES = {
+    'change_availability': ('connector_id',),
+    'change_configuration': ('key',),
+    'set_charging_profile': ('connector_id',
+                             'cs_charging_profiles.charging_profile_purpose',
+                             'cs_charging_profiles.stack_level'),
+}
+
+
+def load_coalesce_rules(raw_rules):
+    """Parse the MQTT_COMMAND_COALESCE JSON string into {action: (arg paths)}.
+
+    Listed actions replace the defaults; an action mapped to ``null`` is
+    never coalesced.
+    """
+    rules = dict(DEFAULT_COALESCE_RULES)
+    if not raw_rules:
+        return rules
+    try:
+        overrides = json.loads(raw_rules)
+    except json.JSONDecodeError:
+        logging.warning("Invalid MQTT_COMMAND_COALESCE JSON, ignoring value.")
+        return rules
+    if not isinstance(overrides, dict):
+        logging.warning("MQTT_COMMAND_COALESCE should be a JSON object, ignoring value.")
+        return rules
+
+    for action, paths in overrides.items():
+        if paths is None:
+            rules.pop(action, None)
+        elif isinstance(paths, list) and all(isinstance(path, str) for path in paths):
+            rules[action] = tuple(paths)
+        else:
+            logging.warning("Invalid MQTT_COMMAND_COALESCE rule for '%s': %r", action, paths)
+    return rules
+
+
+def _arg_value(args, path):
+    value = args
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def coalesce_key(msg, rules):
+    """Return the key under which msg supersedes older commands, or None."""
+    action = msg.get('action')
+    paths = rules.get(action)
+    if paths is None:
+        return None
+    args = msg.get('args') if isinstance(msg.get('args'), dict) else {}
+    return (action,) + tuple(json.dumps(_arg_value(args, path), sort_keys=True) for path in paths)
+
+
+class CommandRunner:
+    """Runs commands as supervised tasks with a concurrency limit per action.
+
+    Commands of the same action start in arrival order; with a limit of 1
+    (the default) they also complete in that order, while commands of other
+    actions proceed independently. A command submitted with a ``key``
+    replaces a waiting command with the same key, whose ``on_superseded``
+    callback is then called. Commands submitted with a ``request_id`` can
+    be cancelled through :meth:`cancel`, which calls their ``on_cancelled``
+    callback. Failures are logged, never propagated, and :meth:`close`
+    cancels whatever is still running.
+    """
+
+    def __init__(self, limits=None):
+        self._limits = dict(limits or {'default': DEFAULT_ACTION_LIMIT})
+        self._semaphores = {}
+        self._tasks = set()
+        self._waiting = {}
+        self._requests = {}
+        self.superseded = 0
+        self.cancelled = 0
+
+    @property
+    def in_flight(self):
+        return len(self._tasks)
+
+    def limit_for(self, action):
+        return self._limits.get(action, self._limits.get('default', DEFAULT_ACTION_LIMIT))
+
+    def _semaphore(self, action):
+        semaphore = self._semaphores.get(action)
+        if semaphore is None:
+            semaphore = self._semaphores[action] = asyncio.Semaphore(self.limit_for(action))
+        return semaphore
+
+    def submit(self, action, coro, key=None, on_superseded=None, request_id=None, on_cancelled=None):
+        """Schedule coro under the limit of action and return its task."""
+        if key is not None:
+            previous = self._waiting.pop(key, None)
+            if previous is not None:
+                previous_task, previous_callback = previous
+                previous_task.cancel()
+                self.superseded += 1
+                logging.info("Command %s superseded by a newer one", action)
+                if previous_callback is not None:
+                    previous_callback()
+        task = self.spawn(self._run(action, coro, key))
+        task.add_done_callback(lambda done: self._release(done, coro, key, request_id))
+        if key is not None:
+            self._waiting[key] = (task, on_superseded)
+        if request_id is not None:
+            self._requests[request_id] = (task, on_cancelled)
+        return task
+
+    def cancel(self, request_id):
+        """Cancel the waiting or running command with request_id. Returns False if there is none."""
+        entry = self._requests.pop(request_id, None)
+        if entry is None:
+            return False
+        task, on_cancelled = entry
+        task.cancel()
+        self.cancelled += 1
+        if on_cancelled is not None:
+            on_cancelled()
+        return True
+
+    def spawn(self, coro):
+        """Run coro as a supervised task outside of any action limit."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    async def _run(self, action, coro, key):
+        async with self._semaphore(action):
+            if key is not None and self._waiting.get(key, (None,))[0] is asyncio.current_task():
+                # Started: newer commands no longer replace this one
+                del self._waiting[key]
+            return await coro
+
+    def _release(self, task, coro, key, request_id=None):
+        if key is not None and self._waiting.get(key, (None,))[0] is task:
+            del self._waiting[key]
+        if request_id is not None and self._requests.get(request_id, (None,))[0] is task:
+            del self._requests[request_id]
+        if task.cancelled():
+            # Release the coroutine in case it was cancelled before starting
+            coro.close()
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logging.error("MQTT command task failed (%s): %s", type(error).__name__, error)
+
+    async def join(self):
+        """Wait until every submitted command has finished."""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    async def close(self):
+        """Cancel running commands and wait for them to unwind."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
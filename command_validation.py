@@ -0,0 +1,60 @@
+# Local validation of MQTT command arguments
+# Arguments are checked against the OCPP 1.6 JSON schemas before a command is
+# sent, so malformed commands are rejected without a round trip to the charger.
+
+import logging
+from functools import lru_cache
+
+from ocpp.charge_point import remove_nones, serialize_as_dict, snake_to_camel_case
+from ocpp.messages import MessageType, get_validator
+
+from mqtt_2_charge_point import REQUESTS
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+
+class CommandValidationError(ValueError):
+    """Command arguments rejected before sending; ``errors`` lists each problem."""
+
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)
+
+
+@lru_cache(maxsize=None)
+def validator_for(action):
+    """Return the compiled schema validator of the OCPP request sent by action."""
+    return get_validator(MessageType.Call, REQUESTS[action].__name__, '1.6')
+
+
+def _error(path, message):
+    return {'path': path, 'message': message}
+
+
+def validate_command(action, args):
+    """Check the arguments of an MQTT command against its OCPP request schema.
+
+    Actions that do not send an OCPP request are not checked. Raises
+    CommandValidationError with one entry per problem, each giving the
+    camelCase path of the offending field in the OCPP payload.
+    """
+    request_class = REQUESTS.get(action)
+    if request_class is None:
+        return
+    if args is None:
+        args = {}
+    if not isinstance(args, dict):
+        raise CommandValidationError("Invalid arguments", [_error('', 'args must be a JSON object')])
+    try:
+        request = request_class(**args)
+    except TypeError as e:
+        # Unknown or missing keyword arguments
+        message = str(e).split('.__init__() ', 1)[-1]
+        raise CommandValidationError("Invalid arguments", [_error('', message)]) from None
+
+    payload = remove_nones(snake_to_camel_case(serialize_as_dict(request)))
+    errors = [_error('.'.join(str(part) for part in error.absolute_path), error.message)
+              for error in validator_for(action).iter_errors(payload)]
+    if errors:
+        raise CommandValidationError("Invalid arguments", sorted(errors, key=lambda error: error['path']))
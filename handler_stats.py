@@ -0,0 +1,39 @@
+# Latency of the OCPP request handlers
+# Per action, how long the charge point waited for its response and how long
+# until the MQTT publishes of the request were made.
+
+
+class HandlerLatency:
+    """Response and MQTT publish latencies per OCPP action.
+
+    Both are measured from the moment the request is handled: ``response``
+    until the OCPP response is sent, ``published`` until the last MQTT
+    publish of the handler completed.
+    """
+
+    def __init__(self):
+        self._stats = {}
+
+    def record(self, action, response, published):
+        stats = self._stats.get(action)
+        if stats is None:
+            stats = self._stats[action] = {'count': 0, 'response_total': 0.0, 'response_max': 0.0,
+                                           'mqtt_total': 0.0, 'mqtt_max': 0.0}
+        stats['count'] += 1
+        stats['response_total'] += response
+        stats['response_max'] = max(stats['response_max'], response)
+        stats['mqtt_total'] += published
+        stats['mqtt_max'] = max(stats['mqtt_max'], published)
+
+    def stats(self):
+        """Return {action: {count, response_avg_ms, response_max_ms, mqtt_avg_ms, mqtt_max_ms}}."""
+        return {
+            action: {
+                'count': stats['count'],
+                'response_avg_ms': round(stats['response_total'] / stats['count'] * 1000, 1),
+                'response_max_ms': round(stats['response_max'] * 1000, 1),
+                'mqtt_avg_ms': round(stats['mqtt_total'] / stats['count'] * 1000, 1),
+                'mqtt_max_ms': round(stats['mqtt_max'] * 1000, 1),
+            }
+            for action, stats in self._stats.items()
+        }
@@ -0,0 +1,110 @@
+# Heartbeat interval of the charge points
+# The interval given in BootNotification can be set globally or per station, and
+# in adaptive mode it is lengthened while other OCPP traffic proves liveness.
+
+import fnmatch
+import json
+import logging
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+
+def load_intervals(raw_intervals):
+    """Parse the OCPP_HEARTBEAT_INTERVALS JSON string into {station id or glob: seconds}."""
+    if not raw_intervals:
+        return {}
+    try:
+        intervals = json.loads(raw_intervals)
+    except json.JSONDecodeError:
+        logging.warning("Invalid OCPP_HEARTBEAT_INTERVALS JSON, ignoring value.")
+        return {}
+    if not isinstance(intervals, dict):
+        logging.warning("OCPP_HEARTBEAT_INTERVALS should be a JSON object, ignoring value.")
+        return {}
+
+    parsed = {}
+    for station, interval in intervals.items():
+        if not isinstance(interval, int) or isinstance(interval, bool) or interval <= 0:
+            logging.warning("Invalid OCPP_HEARTBEAT_INTERVALS interval for '%s': %r", station, interval)
+            continue
+        parsed[station] = interval
+    return parsed
+
+
+def interval_for(station_id, default, intervals):
+    """Return the heartbeat interval of a station.
+
+    An exact station id wins over glob patterns, which are tried in order.
+    """
+    if station_id in intervals:
+        return intervals[station_id]
+    for pattern, interval in intervals.items():
+        if fnmatch.fnmatchcase(station_id, pattern):
+            return interval
+    return default
+
+
+class HeartbeatPolicy:
+    """Tracks the heartbeat interval configured on one charge point.
+
+    :meth:`on_heartbeat` returns the interval to push with
+    ``ChangeConfiguration(HeartbeatInterval)``, if any: the base interval
+    when the station did not boot during this session, and in adaptive mode
+    (``max_interval`` above ``interval``) twice the current interval when
+    the station sent other requests since the previous heartbeat, or the
+    base interval again once it only sends heartbeats. Results of calls
+    made to the station are not counted: they do not prove it is alive on
+    its own.
+    """
+
+    def __init__(self, interval, max_interval=0):
+        self.base = interval
+        self.max_interval = max_interval
+        # Interval the station is known to use, None until booted or pushed
+        self.interval = None
+        self.enabled = True
+        self._pending = None
+        self._messages = 0
+
+    @property
+    def adaptive(self):
+        return self.max_interval > self.base
+
+    def booted(self):
+        """Return the interval for a BootNotification response."""
+        self.interval = self.base
+        self._messages = 0
+        return self.base
+
+    def observe(self):
+        """Count a request of the station other than a heartbeat."""
+        self._messages += 1
+
+    def on_heartbeat(self):
+        """Return the interval to push after this heartbeat, or None."""
+        traffic = self._messages > 0
+        self._messages = 0
+        if not self.enabled or self._pending is not None:
+            return None
+        if self.interval is None:
+            target = self.base
+        elif not self.adaptive:
+            return None
+        elif traffic:
+            target = min(self.interval * 2, self.max_interval)
+        else:
+            target = self.base
+        if target == self.interval:
+            return None
+        self._pending = target
+        return target
+
+    def settle(self, interval, status):
+        """Record the station's answer to a push; status is None if the call failed."""
+        self._pending = None
+        if status == 'Accepted':
+            self.interval = interval
+        elif status is not None:
+            # Rejected, NotSupported or RebootRequired: stop pushing for this session
+            self.enabled = False
@@ -0,0 +1,56 @@
+# Last-value cache for retained MQTT state topics
+# Remembers the last payload published per topic so unchanged values can be
+# skipped, while still refreshing them periodically.
+
+import logging
+import time
+from collections import OrderedDict
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+
+class LastValueCache:
+    """Bounded per-topic cache of the last published payload.
+
+    Entries are evicted least-recently-used first once ``max_entries`` is
+    reached. A cached value stops suppressing publishes after
+    ``refresh_interval`` seconds so retained values are rewritten from time
+    to time; ``0`` disables the forced refresh.
+    """
+
+    def __init__(self, max_entries=256, refresh_interval=300, clock=time.monotonic):
+        self._max_entries = max(1, max_entries)
+        self._refresh_interval = refresh_interval
+        self._clock = clock
+        self._entries = OrderedDict()
+        self.suppressed = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_current(self, topic, payload) -> bool:
+        """Return True if payload was already published on topic recently."""
+        entry = self._entries.get(topic)
+        if entry is None:
+            return False
+        last_payload, published_at = entry
+        if last_payload != payload or type(last_payload) is not type(payload):
+            return False
+        if self._refresh_interval and self._clock() - published_at >= self._refresh_interval:
+            return False
+        self._entries.move_to_end(topic)
+        self.suppressed += 1
+        return True
+
+    def remember(self, topic, payload):
+        self._entries[topic] = (payload, self._clock())
+        self._entries.move_to_end(topic)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(self, topic):
+        self._entries.pop(topic, None)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,114 @@
+# MeterValues to MQTT state values
+# Every sampled value of every meter_value entry is mapped through a
+# precomputed measurand/phase -> state key table, with kilo units scaled
+# down to their base unit (kW -> W, kWh -> Wh, ...).
+
+import logging
+from functools import lru_cache
+
+from ocpp.v16.enums import Measurand, Phase
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+# Measurand of a sampled value that does not name one (OCPP 1.6 default)
+DEFAULT_MEASURAND = Measurand.energy_active_import_register.value
+
+# Unit -> (base unit, factor)
+UNIT_SCALES = {
+    'kW': ('W', 1000),
+    'kWh': ('Wh', 1000),
+    'kvar': ('var', 1000),
+    'kvarh': ('varh', 1000),
+    'kVA': ('VA', 1000),
+}
+
+
+def _state_key(measurand, phase=None):
+    key = measurand.replace('.', '_').lower()
+    if phase:
+        key += '_' + phase.replace('-', '_').lower()
+    return key
+
+
+# (measurand, phase) -> state key for every measurand and phase of OCPP 1.6
+STATE_KEYS = {
+    (measurand.value, phase): _state_key(measurand.value, phase)
+    for measurand in Measurand
+    for phase in [None] + [p.value for p in Phase]
+}
+
+# Keys added by telemetry aggregation to the state key of a reading
+AGGREGATE_SUFFIXES = ('_min', '_max', '_mean')
+
+TELEMETRY_KEYS = frozenset(
+    [key + suffix for key in STATE_KEYS.values() for suffix in ('',) + AGGREGATE_SUFFIXES]
+    + ['meter_timestamp', 'meter_context'])
+
+
+@lru_cache(maxsize=256)
+def _vendor_state_key(measurand, phase):
+    return _state_key(measurand, phase)
+
+
+def state_key(measurand, phase=None):
+    """Return the state key of a measurand, suffixed with its phase if any."""
+    key = STATE_KEYS.get((measurand, phase))
+    if key is None:
+        # Vendor-specific measurand
+        key = _vendor_state_key(measurand, phase)
+    return key
+
+
+def format_number(number):
+    if number == int(number):
+        return str(int(number))
+    return repr(round(number, 6))
+
+
+def normalize_value(value, unit):
+    """Return value expressed in the base unit of unit."""
+    scale = UNIT_SCALES.get(unit)
+    if scale is None:
+        return value
+    try:
+        return format_number(float(value) * scale[1])
+    except (TypeError, ValueError):
+        logging.warning("Invalid %s meter value: %r", unit, value)
+        return value
+
+
+def state_values(meter_value):
+    """Flatten the meter_value entries of a MeterValues request into state values.
+
+    Entries are taken in order, so the latest reading of a measurand and
+    phase wins. A phased reading also sets the unphased key of its
+    measurand, as it did before per-phase keys existed, unless the
+    request has an unphased reading of that measurand. Signed readings
+    are skipped. The timestamp and reading context of the last entry are
+    included as ``meter_timestamp`` and ``meter_context``.
+    """
+    values = {}
+    measured = set()
+    for entry in meter_value or ():
+        context = None
+        for sampled in entry.get('sampled_value') or ():
+            if sampled.get('format') == 'SignedData':
+                continue
+            measurand = sampled.get('measurand') or DEFAULT_MEASURAND
+            phase = sampled.get('phase')
+            value = normalize_value(sampled.get('value'), sampled.get('unit'))
+            key = state_key(measurand)
+            if phase:
+                values[state_key(measurand, phase)] = value
+                if key not in measured:
+                    values[key] = value
+            else:
+                values[key] = value
+                measured.add(key)
+            context = sampled.get('context') or context
+        if entry.get('timestamp') is not None:
+            values['meter_timestamp'] = entry['timestamp']
+        if context is not None:
+            values['meter_context'] = context
+    return values
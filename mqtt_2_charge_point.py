@@ -63,4 +63,28 @@ def update_firmware(cp, payload):
     return cp.call(call.UpdateFirmware(**payload))
 
 
-    
\ No newline at end of file
+    
+
+
+# OCPP request sent by every MQTT action, used for dispatch and validation
+REQUESTS = {
+    'cancel_reservation': call.CancelReservation,
+    'change_availability': call.ChangeAvailability,
+    'change_configuration': call.ChangeConfiguration,
+    'clear_cache': call.ClearCache,
+    'clear_charging_profile': call.ClearChargingProfile,
+    'data_transfer': call.DataTransfer,
+    'get_composite_schedule': call.GetCompositeSchedule,
+    'get_configuration': call.GetConfiguration,
+    'get_diagnostics': call.GetDiagnostics,
+    'get_local_version': call.GetLocalListVersion,
+    'remote_start_transaction': call.RemoteStartTransaction,
+    'remote_stop_transaction': call.RemoteStopTransaction,
+    'reserve_now': call.ReserveNow,
+    'reset': call.Reset,
+    'send_local_list': call.SendLocalList,
+    'set_charging_profile': call.SetChargingProfile,
+    'trigger_message': call.TriggerMessage,
+    'unlock_connector': call.UnlockConnector,
+    'update_firmware': call.UpdateFirmware,
+}
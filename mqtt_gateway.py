@@ -0,0 +1,614 @@
+# Shared MQTT connection for all charge point sessions
+# One broker connection is opened for the whole gateway; inbound messages are
+# routed in-process to the ChargePoint sessions that registered a topic filter.
+
+import asyncio
+import codec
+import logging
+import time
+from collections import deque
+from contextlib import AsyncExitStack
+
+from aiomqtt import MqttError
+from aiomqtt.topic import Topic
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from broadcast import fan_out, select_stations, summarize
+from command_batch import is_batch
+from command_runner import command_deadline
+from command_validation import validate_command
+from publish_policy import policy_for, policy_for_class, message_properties
+from reconnect import ReconnectCoordinator
+from topic_alias import TopicAliasMap
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+
+UNROUTED_POLICIES = ('reject', 'queue', 'error')
+
+MAX_REQUEST_ID_LENGTH = 128
+
+
+def message_expiry(message):
+    """Return the MQTT v5 message expiry interval of an inbound message, if any."""
+    properties = getattr(message, 'properties', None)
+    return getattr(properties, 'MessageExpiryInterval', None)
+
+
+def request_id_error(request_id):
+    """Return why request_id cannot be used in a topic, or None if it can."""
+    if isinstance(request_id, bool) or not isinstance(request_id, (str, int)):
+        return "request_id must be a string or an integer"
+    request_id = str(request_id)
+    if not request_id or len(request_id) > MAX_REQUEST_ID_LENGTH:
+        return f"request_id must be 1 to {MAX_REQUEST_ID_LENGTH} characters long"
+    if any(char in request_id for char in '/+#\0'):
+        return "request_id must not contain '/', '+', '#' or NUL"
+    return None
+
+
+def command_error(msg):
+    """Return the ValueError a malformed command is rejected with, or None.
+
+    Batch steps are checked when the batch runs, see command_batch.parse_batch.
+    """
+    request_id = msg.get('request_id')
+    if request_id is not None and request_id_error(request_id):
+        return ValueError(request_id_error(request_id))
+    if is_batch(msg):
+        return None
+    try:
+        validate_command(msg.get('action'), msg.get('args'))
+        command_deadline(msg)
+    except ValueError as validation_error:
+        return validation_error
+    return None
+
+
+def request_topic(mqtt_path, request_id):
+    """Return the per-request result topic of a command."""
+    return f"{mqtt_path}/cmd_response/{request_id}"
+
+
+def decode_command(payload):
+    """Decode a command payload into a dict, or None if it is not a JSON object."""
+    try:
+        msg = codec.loads(payload)
+    except (ValueError, TypeError):
+        return None
+    return msg if isinstance(msg, dict) else None
+
+
+def command_result_document(msg, result):
+    """Build the JSON result document answering the command msg."""
+    document = {'action': msg.get('action')}
+    if msg.get('request_id') is not None:
+        document['request_id'] = msg['request_id']
+    document.update(result)
+    return document
+
+
+def response_target(message):
+    """Return (response_topic, properties) for an MQTT v5 request, or None.
+
+    The properties echo the request's correlation data and carry the
+    ``cmd_response`` expiry, so the requester can match the reply.
+    """
+    properties = getattr(message, 'properties', None)
+    response_topic = getattr(properties, 'ResponseTopic', None)
+    if not response_topic:
+        return None
+    reply = Properties(PacketTypes.PUBLISH)
+    correlation_data = getattr(properties, 'CorrelationData', None)
+    if correlation_data is not None:
+        reply.CorrelationData = correlation_data
+    expiry = policy_for_class('cmd_response').expiry
+    if expiry is not None:
+        reply.MessageExpiryInterval = expiry
+    return response_topic, reply
+
+
+def station_path(topic):
+    """Return the station path of a command topic (the part before /cmd)."""
+    index = topic.find('/cmd')
+    while index != -1:
+        end = index + 4
+        if end == len(topic) or topic[end] == '/':
+            return topic[:index]
+        index = topic.find('/cmd', index + 1)
+    return None
+
+
+class MqttRoute:
+    """Inbound command queue for one session."""
+
+    def __init__(self, session, mqtt_path):
+        self.session = session
+        self.mqtt_path = mqtt_path
+        self.topic_filter = f"{mqtt_path}/cmd/#"
+        self.messages = asyncio.Queue()
+
+    def deliver(self, message):
+        self.messages.put_nowait(message)
+
+    def close(self):
+        """Wake up the consumer so it can observe a shutdown request."""
+        self.messages.put_nowait(None)
+
+
+class MqttGateway:
+    """Owns the single MQTT connection and routes inbound messages.
+
+    Sessions register their MQTT path and receive their command messages on
+    their route queue. When ``command_wildcard`` is set (e.g.
+    ``ocpp/+/cmd/#``) the gateway subscribes to it once and looks stations up
+    in an index keyed by path; paths it does not cover get their own
+    subscription. While the broker connection is up, the shared client is
+    exposed to every registered session through its ``client`` attribute, so
+    publishing keeps working exactly as with a dedicated connection.
+
+    Commands for stations without a session are handled according to
+    ``unrouted_policy``: ``reject`` drops them, ``queue`` holds up to
+    ``unrouted_queue_size`` of them per station for ``unrouted_queue_ttl``
+    seconds and hands them over when the station registers, and ``error``
+    publishes an error result on the station's ``cmd_result`` topics. Held
+    and durably queued commands can be dropped through ``cmd/cancel``. Held
+    commands never outlive their own MQTT v5 message expiry. Actions accepted
+    by the optional durable ``command_queue`` are queued there instead,
+    whatever the policy, and reported as ``queued``.
+
+    Reconnects are paced by a :class:`ReconnectCoordinator`. With a
+    ``status_topic``, :meth:`reconnect_state` is published there (retained)
+    every time the connection is established.
+
+    With ``topic_alias_maximum`` set (MQTT v5 only), every connection gets a
+    fresh :class:`TopicAliasMap` that sessions use through
+    :meth:`publish_arguments`.
+
+    Commands published on ``{broadcast_path}/cmd`` run on every session
+    matched by their ``stations`` selector, ``broadcast_parallelism`` at a
+    time, and get one aggregated result on ``{broadcast_path}/cmd_result/json``.
+    """
+
+    def __init__(self, client_factory, reconnect_base_delay=5, reconnect_max_delay=60,
+                 spool=None, replay_batch_size=100, command_wildcard=None,
+                 unrouted_policy='reject', unrouted_queue_size=100, unrouted_queue_ttl=300,
+                 topic_alias_maximum=0, reconnect=None, command_queue=None,
+                 broadcast_path=None, broadcast_parallelism=10, status_topic=None):
+        self._client_factory = client_factory
+        self._status_topic = status_topic
+        self._broadcast_path = broadcast_path
+        self._broadcast_parallelism = broadcast_parallelism
+        self.command_queue = command_queue
+        self._topic_alias_maximum = topic_alias_maximum
+        self.topic_aliases = None
+        self._command_wildcard = command_wildcard
+        self._unrouted_policy = unrouted_policy
+        self._unrouted_queue_size = unrouted_queue_size
+        self._unrouted_queue_ttl = unrouted_queue_ttl
+        self._unrouted = {}
+        if reconnect is None:
+            reconnect = ReconnectCoordinator(reconnect_base_delay, reconnect_max_delay)
+        self.reconnect = reconnect
+        self.client = None
+        self.spool = spool
+        self._replay_batch_size = replay_batch_size
+        self._stations = {}
+        self._subscriptions = {}
+        self._pending = set()
+        self._connected = asyncio.Event()
+        self._shutdown = False
+        self._task = None
+
+    def start(self):
+        """Start the connection loop if it is not already running."""
+        if self._task is None or self._task.done():
+            self._shutdown = False
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        self._shutdown = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self.command_queue is not None:
+            await self.command_queue.flush()
+        if self.spool is not None:
+            # Final fsync of the spool, off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.spool.close)
+
+    def is_connected(self) -> bool:
+        return self.client is not None
+
+    async def wait_connected(self, timeout=None) -> bool:
+        """Wait until the broker connection is up. Returns False on timeout."""
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _needs_subscription(self, route):
+        if self._command_wildcard is None:
+            return True
+        return not Topic(f"{route.mqtt_path}/cmd").matches(self._command_wildcard)
+
+    def _subscription_filters(self):
+        filters = list(self._subscriptions)
+        if self._broadcast_path is not None:
+            broadcast_filter = f"{self._broadcast_path}/cmd"
+            if self._command_wildcard is None or not Topic(broadcast_filter).matches(self._command_wildcard):
+                filters.insert(0, broadcast_filter)
+        if self._command_wildcard is not None:
+            filters.insert(0, self._command_wildcard)
+        return filters
+
+    def register(self, session, mqtt_path) -> MqttRoute:
+        """Route command messages published under mqtt_path to the given session."""
+        route = MqttRoute(session, mqtt_path)
+        self._stations.setdefault(mqtt_path, []).append(route)
+        if self._needs_subscription(route):
+            count = self._subscriptions.get(route.topic_filter, 0)
+            self._subscriptions[route.topic_filter] = count + 1
+            if count == 0 and self.client is not None:
+                self._spawn(self._subscribe(self.client, route.topic_filter))
+        session.client = self.client
+        logging.debug("Registered MQTT route %s for %s", mqtt_path, getattr(session, "id", session))
+
+        held = self._unrouted.pop(mqtt_path, None)
+        if held:
+            now = time.monotonic()
+            messages = [message for deadline, message in held if now <= deadline]
+            logging.info("Delivering %d queued command(s) to %s", len(messages), mqtt_path)
+            for message in messages:
+                route.deliver(message)
+        return route
+
+    def unregister(self, route: MqttRoute):
+        routes = self._stations.get(route.mqtt_path)
+        if not routes or route not in routes:
+            return
+        routes.remove(route)
+        if not routes:
+            del self._stations[route.mqtt_path]
+        route.session.client = None
+        if route.topic_filter not in self._subscriptions:
+            return
+        count = self._subscriptions[route.topic_filter] - 1
+        if count > 0:
+            self._subscriptions[route.topic_filter] = count
+            return
+        del self._subscriptions[route.topic_filter]
+        if self.client is not None:
+            self._spawn(self._unsubscribe(self.client, route.topic_filter))
+
+    def sessions(self):
+        """Return every registered session."""
+        return [route.session for routes in self._stations.values() for route in routes]
+
+    def publish_arguments(self, client, topic, properties=None):
+        """Return the topic and properties to publish with on client.
+
+        Substitutes a topic alias when aliases are enabled and client is the
+        current shared connection.
+        """
+        if self.topic_aliases is None or client is not self.client:
+            return topic, properties
+        return self.topic_aliases.apply(topic, properties)
+
+    async def publish(self, topic, payload, qos=0, retain=True, properties=None):
+        client = self.client
+        if client is None:
+            raise MqttError("MQTT gateway is not connected")
+        topic, properties = self.publish_arguments(client, topic, properties)
+        await client.publish(topic, payload=payload, qos=qos, retain=retain, properties=properties)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    def reconnect_state(self):
+        """Return aggregate connection and reconnect state."""
+        state = self.reconnect.snapshot()
+        state['stations'] = len(self._stations)
+        state['spooled'] = len(self.spool) if self.spool is not None else 0
+        return state
+
+    async def _publish_status(self):
+        state = self.reconnect_state()
+        logging.info("MQTT connection state: %d attempt(s), %d failure(s), %d reconnect(s)",
+                     state['attempts'], state['failures'], state['reconnects'])
+        if not self._status_topic:
+            return
+        policy = policy_for_class('connection')
+        try:
+            await self.publish(self._status_topic, codec.dumps(state), qos=policy.qos, retain=True,
+                               properties=message_properties(policy))
+        except MqttError as exc:
+            logging.warning("Failed to publish gateway status: %s", exc)
+
+    async def _subscribe_all(self, client):
+        filters = self._subscription_filters()
+        if len(filters) == 1:
+            await client.subscribe(filters[0])
+        elif filters:
+            # One SUBSCRIBE packet for every filter
+            await client.subscribe([(topic_filter, 0) for topic_filter in filters])
+
+    async def _subscribe(self, client, topic_filter):
+        try:
+            await client.subscribe(topic_filter)
+        except MqttError as exc:
+            logging.warning("MQTT subscribe to %s failed: %s", topic_filter, exc)
+
+    async def _unsubscribe(self, client, topic_filter):
+        try:
+            await client.unsubscribe(topic_filter)
+        except MqttError as exc:
+            logging.debug("MQTT unsubscribe from %s failed: %s", topic_filter, exc)
+
+    def _attach(self, client):
+        self.client = client
+        for session in self.sessions():
+            session.client = client
+
+    def dispatch(self, message):
+        """Hand an inbound command to the session(s) registered for its station."""
+        mqtt_path = station_path(str(message.topic))
+        if mqtt_path is not None and mqtt_path == self._broadcast_path:
+            self._spawn(self._broadcast(message))
+            return True
+        routes = self._stations.get(mqtt_path)
+        if routes:
+            for route in routes:
+                route.deliver(message)
+            return True
+        self._handle_unrouted(mqtt_path, message)
+        return False
+
+    def _handle_unrouted(self, mqtt_path, message):
+        if mqtt_path is not None and str(message.topic).endswith('/cmd/cancel'):
+            self._cancel_held(mqtt_path, message)
+            return
+        if mqtt_path is not None and self.command_queue is not None:
+            msg = decode_command(message.payload)
+            if msg is not None and self.command_queue.accepts(msg):
+                error = command_error(msg)
+                if error is not None:
+                    # Checked before put: a malformed command must not replace a valid queued one
+                    self._reject(mqtt_path, message, msg, error)
+                    return
+                if self.command_queue.put(mqtt_path, msg,
+                                          on_superseded=lambda old: self._report_superseded(mqtt_path, old)):
+                    self._spawn(self._publish_unrouted_result(mqtt_path, message, msg, {
+                        'status': 'queued', 'action': msg.get('action')}))
+                    self.queue_changed(mqtt_path)
+                    return
+        if mqtt_path is None or self._unrouted_policy == 'reject':
+            logging.warning("Rejected MQTT command on %s: charge point not connected", message.topic)
+            return
+        if self._unrouted_policy == 'queue':
+            held = self._unrouted.setdefault(mqtt_path, deque(maxlen=self._unrouted_queue_size))
+            if len(held) == held.maxlen:
+                logging.warning("Command queue for %s is full, dropping oldest command", mqtt_path)
+            ttl = self._unrouted_queue_ttl
+            expiry = message_expiry(message)
+            if expiry is not None:
+                ttl = min(ttl, expiry)
+            held.append((time.monotonic() + ttl, message))
+            logging.info("Queued MQTT command for %s until the charge point connects", mqtt_path)
+            return
+        msg = decode_command(message.payload) or {}
+        self._spawn(self._publish_unrouted_result(mqtt_path, message, msg, {
+            'status': 'error', 'action': msg.get('action'), 'error': 'Charge point not connected'}))
+
+    def _cancel_held(self, mqtt_path, message):
+        """Drop the command named by a cmd/cancel message while its station is offline."""
+        request_id = (decode_command(message.payload) or {}).get('request_id')
+        if request_id is None or request_id_error(request_id) is not None:
+            logging.warning("Ignored cancel request on %s without a valid request_id", message.topic)
+            return
+        held = self._unrouted.get(mqtt_path, ())
+        for entry in list(held):
+            msg = decode_command(entry[1].payload)
+            if msg is not None and msg.get('request_id') == request_id:
+                held.remove(entry)
+                self._spawn(self._publish_unrouted_result(mqtt_path, entry[1], msg, {
+                    'status': 'cancelled', 'action': msg.get('action')}))
+                return
+        msg = self.command_queue.remove(mqtt_path, request_id) if self.command_queue is not None else None
+        if msg is None:
+            logging.warning("No command %s to cancel for %s", request_id, mqtt_path)
+            return
+        self._spawn(self._publish_unrouted_result(mqtt_path, None, msg, {
+            'status': 'cancelled', 'action': msg.get('action')}))
+        self.queue_changed(mqtt_path)
+
+    def hand_over(self, mqtt_path, message, timeout):
+        """Pass a command left unsent by a closing session to the station's next session.
+
+        The held command is delivered by :meth:`register` like a fresh one,
+        so it resumes as soon as the station is connected again. If no
+        session registers within timeout seconds it fails as not connected.
+        """
+        routes = self._stations.get(mqtt_path)
+        if routes:
+            # The next session is already up
+            for route in routes:
+                route.deliver(message)
+            return
+        entry = (time.monotonic() + timeout, message)
+        self._unrouted.setdefault(mqtt_path, deque(maxlen=self._unrouted_queue_size)).append(entry)
+        asyncio.get_running_loop().call_later(timeout, self._expire_handed_over, mqtt_path, entry)
+
+    def _expire_handed_over(self, mqtt_path, entry):
+        held = self._unrouted.get(mqtt_path)
+        if not held or entry not in held:
+            return
+        held.remove(entry)
+        msg = decode_command(entry[1].payload) or {}
+        logging.warning("Charge point %s did not reconnect in time for %s", mqtt_path, msg.get('action'))
+        self.report(mqtt_path, entry[1], msg, {'status': 'error', 'action': msg.get('action'),
+                                               'error': 'Charge point websocket is not connected'})
+
+    def report(self, mqtt_path, message, msg, result):
+        """Publish the result of a command that no session can answer."""
+        self._spawn(self._publish_unrouted_result(mqtt_path, message, msg, result))
+
+    def _reject(self, mqtt_path, message, msg, error):
+        action = msg.get('action')
+        errors = getattr(error, 'errors', None)
+        logging.warning("Rejected MQTT command %s for %s: %s", action, mqtt_path, errors or error)
+        result = {'status': 'error', 'action': action, 'error': str(error)}
+        if errors:
+            result['errors'] = errors
+        if msg.get('request_id') is not None and request_id_error(msg['request_id']):
+            # The request_id cannot name a response topic
+            msg = {'action': action}
+        self.report(mqtt_path, message, msg, result)
+
+    def _report_superseded(self, mqtt_path, msg):
+        self.report(mqtt_path, None, msg, {'status': 'superseded', 'action': msg.get('action')})
+
+    def queue_changed(self, mqtt_path):
+        """Publish the durable command queue state of a station."""
+        if self.command_queue is None or self.client is None:
+            return
+        self._spawn(self._publish_queue_state(mqtt_path))
+
+    async def _publish_queue_state(self, mqtt_path):
+        topic = f"{mqtt_path}/cmd_queue"
+        policy = policy_for(topic)
+        try:
+            await self.publish(topic, codec.dumps(self.command_queue.stats(mqtt_path)), qos=policy.qos,
+                               retain=policy.retain, properties=message_properties(policy))
+        except MqttError as exc:
+            logging.warning("Failed to publish command queue state for %s: %s", mqtt_path, exc)
+
+    async def _broadcast(self, message):
+        msg = decode_command(message.payload)
+        if msg is not None and 'batch' in msg:
+            msg['action'] = 'batch'
+        if msg is None or not isinstance(msg.get('action'), str):
+            logging.warning("Rejected broadcast command: payload must be a JSON object with an action")
+            await self._publish_broadcast_result(message, msg or {}, {
+                'status': 'error', 'error': 'Payload must be a JSON object with an action'})
+            return
+        error = request_id_error(msg['request_id']) if msg.get('request_id') is not None else None
+        sessions = {route.session.id: route.session for routes in self._stations.values() for route in routes}
+        if error is None:
+            try:
+                station_ids = select_stations(msg.get('stations'), sessions)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            logging.warning("Rejected broadcast command %s: %s", msg['action'], error)
+            await self._publish_broadcast_result(message, {'action': msg['action']}, {'status': 'error', 'error': error})
+            return
+
+        command = {key: value for key, value in msg.items() if key != 'stations'}
+        logging.info("Broadcasting %s to %d station(s)", msg['action'], len(station_ids))
+        started = time.monotonic()
+        results = await fan_out({station_id: sessions.get(station_id) for station_id in station_ids},
+                                command, self._broadcast_parallelism)
+        summary = summarize(results, time.monotonic() - started)
+        logging.info("Broadcast %s done in %.0f ms: %s", msg['action'], summary['duration_ms'], summary['statuses'])
+        await self._publish_broadcast_result(message, msg, summary)
+
+    async def _publish_broadcast_result(self, message, msg, result):
+        document = codec.dumps(command_result_document(msg, result))
+        topic = f"{self._broadcast_path}/cmd_result/json"
+        policy = policy_for(topic)
+        try:
+            await self.publish(topic, document, qos=policy.qos, retain=policy.retain,
+                               properties=message_properties(policy))
+            await self._publish_document(self._broadcast_path, message, msg, document)
+        except MqttError as exc:
+            logging.warning("Failed to publish broadcast result: %s", exc)
+
+    async def _publish_unrouted_result(self, mqtt_path, message, msg, result):
+        document = codec.dumps(command_result_document(msg, result))
+        try:
+            for key, value in result.items():
+                topic = f"{mqtt_path}/cmd_result/{key}"
+                if isinstance(value, (dict, list, tuple)):
+                    value = codec.dumps(value)
+                policy = policy_for(topic)
+                await self.publish(topic, value, qos=policy.qos, retain=policy.retain,
+                                   properties=message_properties(policy))
+            await self._publish_document(mqtt_path, message, msg, document)
+        except MqttError as exc:
+            logging.warning("Failed to publish command result for %s: %s", mqtt_path, exc)
+
+    async def _publish_document(self, mqtt_path, message, msg, document):
+        """Publish a JSON result document to the request topic and MQTT v5 response topic."""
+        request_id = msg.get('request_id')
+        if request_id is not None and request_id_error(request_id) is None:
+            topic = request_topic(mqtt_path, request_id)
+            policy = policy_for(topic)
+            await self.publish(topic, document, qos=policy.qos, retain=policy.retain,
+                               properties=message_properties(policy))
+        target = response_target(message)
+        if target is not None:
+            response_topic, properties = target
+            await self.publish(response_topic, document, qos=policy_for_class('cmd_response').qos,
+                               retain=False, properties=properties)
+
+    async def run(self):
+        logging.info("Starting shared MQTT connection")
+        while not self._shutdown:
+            connected = False
+            error = None
+            try:
+                async with AsyncExitStack() as stack:
+                    async with self.reconnect.attempt():
+                        client = await stack.enter_async_context(self._client_factory())
+                        await self._subscribe_all(client)
+                    connected = True
+                    # Sessions keep spooling until the backlog has been replayed
+                    if self.spool is not None:
+                        await self.spool.replay(client, batch_size=self._replay_batch_size)
+                    if self._topic_alias_maximum > 0:
+                        self.topic_aliases = TopicAliasMap(self._topic_alias_maximum)
+                    self._attach(client)
+                    self._connected.set()
+                    logging.info("Shared MQTT connection established (%d station(s))", len(self._stations))
+                    await self._publish_status()
+                    async for message in client.messages:
+                        self.dispatch(message)
+            except asyncio.CancelledError:
+                logging.info("Shared MQTT connection cancelled")
+                self._shutdown = True
+                raise
+            except MqttError as e:
+                error = e
+                if self._shutdown:
+                    logging.info("MQTT disconnected during shutdown")
+                    break
+                logging.warning("MQTT error (%s): %s", type(e).__name__, e)
+            except Exception as e:
+                error = e
+                if self._shutdown:
+                    break
+                logging.error("Unexpected MQTT loop error (%s): %s", type(e).__name__, e)
+            finally:
+                self._connected.clear()
+                self._attach(None)
+                self.topic_aliases = None
+                if connected:
+                    self.reconnect.disconnected(error)
+
+            if self._shutdown:
+                break
+            await self.reconnect.wait()
+
+        logging.info("Shared MQTT connection stopped")
@@ -0,0 +1,191 @@
+# Disk-backed spool for MQTT publishes made while the broker is unavailable
+# Publishes are appended to a JSON lines file and replayed in order, in
+# batches, once the shared MQTT connection is back.
+
+import asyncio
+import logging
+import os
+import time
+
+from aiomqtt import MqttError
+
+import codec
+from publish_policy import PublishPolicy, message_properties
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+
+class OfflineSpool:
+    """Append-only on-disk queue of publishes, bounded by size and age.
+
+    Every append is written to the OS immediately; ``fsync`` is batched and
+    runs in the default executor at most once per ``fsync_interval`` so the
+    event loop never blocks on the disk. When the file would grow beyond
+    ``max_bytes`` new publishes are dropped, and records older than
+    ``max_age`` seconds are discarded on replay.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, max_age=86400,
+                 fsync_interval=1.0, clock=time.time):
+        self.path = path
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._fsync_interval = fsync_interval
+        self._clock = clock
+        self._fsync_handle = None
+        self._full_warned = False
+        self.dropped = 0
+
+        spool_dir = os.path.dirname(path)
+        if spool_dir and not os.path.exists(spool_dir):
+            os.makedirs(spool_dir, exist_ok=True)
+        self._replay_path = path + '.replay'
+        self._file = open(path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+        self._count = self._count_records(path)
+
+    def __len__(self):
+        return self._count + self._count_records(self._replay_path)
+
+    @property
+    def size(self):
+        return self._size
+
+    def _count_records(self, path):
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r', encoding='utf-8') as f:
+            return sum(1 for line in f if line.strip())
+
+    def append(self, topic, payload, qos=0, retain=True, expiry=None) -> bool:
+        """Spool a publish. Returns False when the spool is full."""
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.decode('utf-8', errors='replace')
+        record = {'ts': self._clock(), 'topic': topic, 'payload': payload, 'qos': qos, 'retain': retain}
+        if expiry is not None:
+            record['expiry'] = expiry
+        line = codec.dumps(record) + '\n'
+        line_size = len(line.encode('utf-8'))
+
+        if self._size + line_size > self._max_bytes:
+            self.dropped += 1
+            if not self._full_warned:
+                logging.warning("MQTT offline spool %s is full (%d bytes), dropping publishes", self.path, self._size)
+                self._full_warned = True
+            return False
+
+        self._file.write(line)
+        self._file.flush()
+        self._size += line_size
+        self._count += 1
+        self._schedule_fsync()
+        return True
+
+    def _schedule_fsync(self):
+        if self._fsync_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            os.fsync(self._file.fileno())
+            return
+        self._fsync_handle = loop.call_later(self._fsync_interval, self._fsync, loop)
+
+    def _fsync(self, loop):
+        self._fsync_handle = None
+        if self._file.closed:
+            return
+        loop.run_in_executor(None, os.fsync, self._file.fileno())
+
+    def _rotate(self):
+        """Move the current spool aside so new publishes go to a fresh file."""
+        self._file.close()
+        os.replace(self.path, self._replay_path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = 0
+        self._count = 0
+        self._full_warned = False
+
+    def _read_records(self, path):
+        now = self._clock()
+        records = []
+        expired = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = codec.loads(line)
+                except ValueError:
+                    logging.warning("Skipping corrupt MQTT spool record in %s", path)
+                    continue
+                age = now - record.get('ts', now)
+                expiry = record.get('expiry')
+                if (self._max_age and age > self._max_age) or (expiry is not None and age >= expiry):
+                    expired += 1
+                    continue
+                records.append(record)
+        if expired:
+            logging.info("Discarded %d expired MQTT spool record(s)", expired)
+        return records
+
+    def _write_records(self, path, records):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(codec.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    async def replay(self, client, batch_size=100):
+        """Publish every spooled record in order. Returns the number replayed.
+
+        The spool file is moved aside before replaying and only removed once
+        every record was handed to the broker, so a crash or a failed publish
+        never loses data; the remaining records are replayed first next time.
+        Publishes of a batch are issued together so they reach the client in
+        order without waiting for each acknowledgement. Records appended
+        while a replay is running are replayed as well.
+        """
+        # Reading and rewriting the spool can take a while: keep it off the event loop
+        loop = asyncio.get_running_loop()
+        replayed = 0
+        while True:
+            if not os.path.exists(self._replay_path):
+                if self._count == 0:
+                    break
+                self._file.flush()
+                self._rotate()
+            records = await loop.run_in_executor(None, self._read_records, self._replay_path)
+            if records:
+                logging.info("Replaying %d spooled MQTT publish(es)", len(records))
+            for start in range(0, len(records), batch_size):
+                batch = records[start:start + batch_size]
+                try:
+                    await asyncio.gather(*(self._publish(client, record) for record in batch))
+                except (MqttError, asyncio.CancelledError):
+                    # The executor finishes the rewrite even if the wait is cancelled again
+                    await loop.run_in_executor(None, self._write_records, self._replay_path, records[start:])
+                    raise
+                replayed += len(batch)
+            os.remove(self._replay_path)
+        return replayed
+
+    async def _publish(self, client, record):
+        properties = None
+        if 'expiry' in record:
+            remaining = max(1, int(record['expiry'] - (self._clock() - record['ts'])))
+            properties = message_properties(PublishPolicy(qos=record['qos'], retain=record['retain'], expiry=remaining))
+        await client.publish(record['topic'], payload=record['payload'], qos=record['qos'],
+                             retain=record['retain'], properties=properties)
+
+    def close(self):
+        if self._fsync_handle is not None:
+            self._fsync_handle.cancel()
+            self._fsync_handle = None
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
@@ -0,0 +1,96 @@
+# Per-session MQTT publish pipeline
+# Handlers enqueue publishes and return immediately; a fixed number of workers
+# drain the queue so several publishes can be in flight at once.
+
+import asyncio
+import logging
+from collections import OrderedDict
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+
+class PublishPipeline:
+    """Bounded, coalescing publish queue drained by concurrent workers.
+
+    Pending publishes are keyed by topic: a newer payload for a topic that
+    is still waiting in the queue replaces the older one in place, so bursts
+    collapse into a single publish. When the queue is full, ``put`` waits for
+    room, which applies back-pressure to the producer.
+    """
+
+    def __init__(self, send, max_size=1000, concurrency=4):
+        self._send = send
+        self._max_size = max(1, max_size)
+        self._concurrency = max(1, concurrency)
+        self._pending = OrderedDict()
+        self._sequence = 0
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+        self._workers = []
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    async def put(self, topic, payload, coalesce=True):
+        """Queue a publish. Returns once the publish has been accepted."""
+        self._ensure_workers()
+        async with self._condition:
+            while True:
+                if coalesce and topic in self._pending:
+                    self._pending[topic] = payload
+                    self.coalesced += 1
+                    return
+                if len(self._pending) < self._max_size:
+                    break
+                await self._condition.wait()
+            key = topic
+            if not coalesce:
+                # Keep every non-coalescing publish as its own entry
+                self._sequence += 1
+                key = (topic, self._sequence)
+            self._pending[key] = payload
+            self._condition.notify_all()
+
+    async def flush(self):
+        """Wait until every queued publish has been sent."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._pending and self._in_flight == 0)
+
+    def close(self):
+        """Stop the workers. Publishes still queued are dropped."""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        if self._pending:
+            logging.warning("Dropping %d queued MQTT publish(es) on close", len(self._pending))
+            self._pending.clear()
+
+    def _ensure_workers(self):
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self._concurrency:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._pending)
+                key, payload = self._pending.popitem(last=False)
+                self._in_flight += 1
+                self._condition.notify_all()
+            topic = key[0] if isinstance(key, tuple) else key
+            try:
+                await self._send(topic, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("Queued MQTT publish to %s failed: %s", topic, e)
+            finally:
+                async with self._condition:
+                    self._in_flight -= 1
+                    self._condition.notify_all()
@@ -0,0 +1,129 @@
+# QoS, retain and expiry policy per MQTT topic class
+# Topics are grouped in classes (state, telemetry, cmd_result, cmd_response,
+# connection) and
+# every class can be given its own publish options through MQTT_PUBLISH_POLICY.
+
+import json
+import logging
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from meter_values import TELEMETRY_KEYS
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+load_dotenv(verbose=True)
+
+PublishPolicy = namedtuple('PublishPolicy', ['qos', 'retain', 'expiry'])
+
+TOPIC_CLASSES = ('state', 'telemetry', 'cmd_result', 'cmd_response', 'connection')
+
+# Current behaviour for every class: QoS 0 and retained
+DEFAULT_POLICY = PublishPolicy(qos=0, retain=True, expiry=None)
+
+# Per-request results are only meant for the requester waiting for them
+CLASS_DEFAULTS = {
+    'cmd_response': PublishPolicy(qos=0, retain=False, expiry=None),
+}
+
+CONNECTION_KEYS = frozenset({
+    'connection_state',
+    'last_connected',
+    'last_disconnected',
+    'disconnect_reason',
+    'service_started',
+})
+
+
+def _parse_policy(topic_class, raw):
+    if not isinstance(raw, dict):
+        raise ValueError(f"policy for '{topic_class}' must be a JSON object")
+    default = CLASS_DEFAULTS.get(topic_class, DEFAULT_POLICY)
+    qos = int(raw.get('qos', default.qos))
+    if qos not in (0, 1, 2):
+        raise ValueError(f"invalid qos {qos} for '{topic_class}'")
+    retain = raw.get('retain', default.retain)
+    if not isinstance(retain, bool):
+        raise ValueError(f"retain for '{topic_class}' must be true or false")
+    expiry = raw.get('expiry', default.expiry)
+    if expiry is not None:
+        expiry = int(expiry)
+        if expiry <= 0:
+            raise ValueError(f"expiry for '{topic_class}' must be a positive number of seconds")
+    return PublishPolicy(qos=qos, retain=retain, expiry=expiry)
+
+
+def load_policies(raw_policies):
+    """Build the policy table from the MQTT_PUBLISH_POLICY JSON string."""
+    policies = {topic_class: CLASS_DEFAULTS.get(topic_class, DEFAULT_POLICY) for topic_class in TOPIC_CLASSES}
+    if not raw_policies:
+        return policies
+    try:
+        overrides = json.loads(raw_policies)
+    except json.JSONDecodeError:
+        logging.warning("Invalid MQTT_PUBLISH_POLICY JSON, ignoring value.")
+        return policies
+    if not isinstance(overrides, dict):
+        logging.warning("MQTT_PUBLISH_POLICY should be a JSON object, ignoring value.")
+        return policies
+
+    for topic_class, raw in overrides.items():
+        if topic_class not in policies:
+            logging.warning("Unknown MQTT_PUBLISH_POLICY topic class '%s', ignoring", topic_class)
+            continue
+        try:
+            policies[topic_class] = _parse_policy(topic_class, raw)
+        except (TypeError, ValueError) as e:
+            logging.warning("Invalid MQTT_PUBLISH_POLICY entry: %s", e)
+    return policies
+
+
+MQTT_PUBLISH_POLICY = load_policies(os.getenv('MQTT_PUBLISH_POLICY', None))
+
+
+@lru_cache(maxsize=4096)
+def topic_class(topic):
+    """Return the topic class of a publish topic."""
+    prefix, _, key = topic.rpartition('/')
+    if prefix.endswith('/cmd_response'):
+        return 'cmd_response'
+    if prefix.endswith('/cmd_result') or '/cmd_result/' in topic:
+        return 'cmd_result'
+    if prefix.endswith('/state'):
+        if key in CONNECTION_KEYS:
+            return 'connection'
+        if key in TELEMETRY_KEYS:
+            return 'telemetry'
+    return 'state'
+
+
+def policy_for_class(name):
+    return MQTT_PUBLISH_POLICY[name]
+
+
+def policy_for(topic):
+    return policy_for_class(topic_class(topic))
+
+
+@lru_cache(maxsize=64)
+def _expiry_properties(expiry):
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.MessageExpiryInterval = expiry
+    return properties
+
+
+def message_properties(policy):
+    """Return the MQTT v5 publish properties for a policy, or None.
+
+    Properties are only put on the wire by MQTT v5 connections; MQTT 3.1.1
+    clients ignore them.
+    """
+    if policy.expiry is None:
+        return None
+    return _expiry_properties(policy.expiry)
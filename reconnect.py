@@ -0,0 +1,108 @@
+# Reconnect coordination for broker connections
+# Spreads reconnect attempts with decorrelated jitter and keeps aggregate
+# reconnect statistics.
+
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+
+class ReconnectCoordinator:
+    """Backoff and statistics of a broker connection loop.
+
+    Delays follow the "decorrelated jitter" schedule: each wait is drawn
+    uniformly between ``base_delay`` and three times the previous wait,
+    capped at ``max_delay``, and falls back to ``base_delay`` after a
+    successful connection. Gateways restarting together therefore spread
+    their CONNECT and SUBSCRIBE packets instead of retrying in lockstep.
+    """
+
+    def __init__(self, base_delay=5, max_delay=60, rng=random.uniform, clock=time.time):
+        self._base_delay = base_delay
+        self._max_delay = max(base_delay, max_delay)
+        self._rng = rng
+        self._clock = clock
+        self._delay = base_delay
+        self._connected = 0
+        self._established = 0
+        self._in_flight = 0
+        self.attempts = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.last_delay = None
+        self.connected_since = None
+
+    def next_delay(self):
+        """Return the next jittered delay and advance the schedule."""
+        self._delay = min(self._max_delay, self._rng(self._base_delay, self._delay * 3))
+        self.last_delay = self._delay
+        return self._delay
+
+    async def wait(self):
+        delay = self.next_delay()
+        logging.info("Reconnecting to MQTT in %.1f seconds...", delay)
+        await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def attempt(self):
+        """Record the outcome of one connection attempt."""
+        self.attempts += 1
+        self._in_flight += 1
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            self._in_flight -= 1
+        if self._established:
+            self.reconnects += 1
+            logging.info("MQTT reconnected after %d failed attempt(s)", self.consecutive_failures)
+        self._established += 1
+        self.consecutive_failures = 0
+        self._delay = self._base_delay
+        self._connected += 1
+        self.connected_since = self._clock()
+
+    def disconnected(self, error=None):
+        """Record the loss of a connection established through attempt()."""
+        if self._connected:
+            self._connected -= 1
+        if not self._connected:
+            self.connected_since = None
+        if error is not None:
+            self.last_error = f"{type(error).__name__}: {error}"
+
+    def snapshot(self):
+        """Return aggregate reconnect state as a plain dict."""
+        if self._connected:
+            state = 'connected'
+        elif self._in_flight:
+            state = 'connecting'
+        elif self.attempts:
+            state = 'disconnected'
+        else:
+            state = 'idle'
+        return {
+            'state': state,
+            'connections': self._connected,
+            'attempts_in_flight': self._in_flight,
+            'attempts': self.attempts,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'reconnects': self.reconnects,
+            'last_error': self.last_error,
+            'last_delay': self.last_delay,
+            'connected_since': self.connected_since,
+        }
@@ -0,0 +1,184 @@
+# Telemetry aggregation before MQTT publish
+# Meter readings of a station can be summarised over a time window (min, max,
+# mean and last value) and/or filtered with a deadband so chargers sampling
+# every few seconds do not flood the broker.
+
+import fnmatch
+import json
+import logging
+
+from meter_values import AGGREGATE_SUFFIXES, TELEMETRY_KEYS, format_number
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+# Reading metadata held back with the window instead of published per sample
+WINDOW_METADATA_KEYS = frozenset({'meter_timestamp', 'meter_context'})
+
+
+def load_deadbands(raw_deadbands):
+    """Parse the MQTT_TELEMETRY_DEADBAND JSON string into {state key: threshold}.
+
+    A key also applies to its per-phase variants (``voltage`` covers
+    ``voltage_l1_n``); ``default`` applies to every other key.
+    """
+    if not raw_deadbands:
+        return {}
+    try:
+        deadbands = json.loads(raw_deadbands)
+    except json.JSONDecodeError:
+        logging.warning("Invalid MQTT_TELEMETRY_DEADBAND JSON, ignoring value.")
+        return {}
+    if isinstance(deadbands, (int, float)) and not isinstance(deadbands, bool):
+        deadbands = {'default': deadbands}
+    if not isinstance(deadbands, dict):
+        logging.warning("MQTT_TELEMETRY_DEADBAND should be a JSON object or a number, ignoring value.")
+        return {}
+
+    parsed = {}
+    for key, threshold in deadbands.items():
+        if not isinstance(threshold, (int, float)) or isinstance(threshold, bool) or threshold < 0:
+            logging.warning("Invalid MQTT_TELEMETRY_DEADBAND threshold for '%s': %r", key, threshold)
+            continue
+        parsed[key] = float(threshold)
+    return parsed
+
+
+def is_raw_station(station_id, patterns):
+    """Return True if station_id matches one of the raw passthrough glob patterns."""
+    return any(fnmatch.fnmatchcase(station_id, pattern) for pattern in patterns)
+
+
+class TelemetryAggregator:
+    """Per-station aggregation and deadband filter for meter readings.
+
+    With a ``window`` (seconds), numeric readings are accumulated and
+    :meth:`flush` returns, per state key, the last value plus ``_min``,
+    ``_max`` and ``_mean`` over the window; the caller schedules the flush
+    ``window`` seconds after :meth:`add` first reports pending readings.
+    Without a window every reading is passed on as it arrives. In both
+    modes a reading within its deadband of the last published value is
+    dropped; a window is dropped only if its minimum and maximum stayed
+    within the deadband as well. Values other than numeric readings pass through untouched.
+    """
+
+    def __init__(self, window=0, deadbands=None):
+        self.window = window
+        self._deadbands = deadbands or {}
+        self._thresholds = {}
+        self._published = {}
+        self._readings = {}
+        self._metadata = {}
+        self.samples = 0
+        self.suppressed = 0
+
+    @property
+    def pending(self):
+        return bool(self._readings)
+
+    def _threshold(self, key):
+        threshold = self._thresholds.get(key)
+        if threshold is None:
+            threshold = self._deadbands.get('default', 0.0)
+            # Longest configured prefix wins: "voltage_l1" before "voltage"
+            for name in sorted(self._deadbands, key=len, reverse=True):
+                if key == name or key.startswith(name + '_'):
+                    threshold = self._deadbands[name]
+                    break
+            self._thresholds[key] = threshold
+        return threshold
+
+    def _outside_deadband(self, key, number, low=None, high=None):
+        """Return True and make number the baseline if the readings left the deadband.
+
+        ``low`` and ``high`` are the extremes of a window; it is dropped
+        only if they stayed within the deadband too.
+        """
+        previous = self._published.get(key)
+        if previous is not None:
+            low = number if low is None else low
+            high = number if high is None else high
+            if max(abs(number - previous), abs(low - previous), abs(high - previous)) <= self._threshold(key):
+                self.suppressed += 1
+                return False
+        self._published[key] = number
+        return True
+
+    def add(self, values):
+        """Take the state values of one MeterValues request.
+
+        Returns the values to publish right away.
+        """
+        publish = {}
+        metadata = {}
+        suppressed = passed = False
+        for key, value in values.items():
+            if key in WINDOW_METADATA_KEYS:
+                metadata[key] = value
+                continue
+            if key not in TELEMETRY_KEYS:
+                publish[key] = value
+                continue
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                publish[key] = value
+                continue
+            self.samples += 1
+            if self.window <= 0:
+                if self._outside_deadband(key, number):
+                    publish[key] = value
+                    passed = True
+                else:
+                    suppressed = True
+                continue
+            reading = self._readings.get(key)
+            if reading is None:
+                self._readings[key] = [number, number, number, 1, value]
+            else:
+                reading[0] = min(reading[0], number)
+                reading[1] = max(reading[1], number)
+                reading[2] += number
+                reading[3] += 1
+                reading[4] = value
+        if self.window > 0:
+            self._metadata.update(metadata)
+        elif passed or not suppressed:
+            # Timestamps only go out with a reading, not for fully filtered samples
+            publish.update(metadata)
+        return publish
+
+    def flush(self):
+        """Return the aggregated values of the current window and start a new one."""
+        readings, self._readings = self._readings, {}
+        publish = {}
+        for key, (low, high, total, count, last) in readings.items():
+            if not self._outside_deadband(key, float(last), low, high):
+                continue
+            publish[key] = last
+            publish[key + AGGREGATE_SUFFIXES[0]] = format_number(low)
+            publish[key + AGGREGATE_SUFFIXES[1]] = format_number(high)
+            publish[key + AGGREGATE_SUFFIXES[2]] = format_number(total / count)
+        if publish:
+            publish.update(self._metadata)
+        self._metadata = {}
+        return publish
+
+    def override(self, values):
+        """Take values published without going through :meth:`add`.
+
+        They become the deadband baseline of their keys, and pending
+        readings of those keys are dropped so a flush cannot undo them.
+        """
+        for key, value in values.items():
+            self._readings.pop(key, None)
+            try:
+                self._published[key] = float(value)
+            except (TypeError, ValueError):
+                self._published.pop(key, None)
+
+    def reset(self):
+        """Forget pending readings and published values, e.g. after a disconnect."""
+        self._readings = {}
+        self._metadata = {}
+        self._published = {}
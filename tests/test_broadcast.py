@@ -0,0 +1,79 @@
+"""Tests for broadcast module - fleet-wide command fan-out."""
+
+import asyncio
+
+import pytest
+
+from broadcast import fan_out, select_stations, summarize
+
+
+def test_select_all_and_glob():
+    stations = ["site1-a", "site2-a", "site1-b"]
+
+    assert select_stations(None, stations) == ["site1-a", "site1-b", "site2-a"]
+    assert select_stations("all", stations) == ["site1-a", "site1-b", "site2-a"]
+    assert select_stations("site1-*", stations) == ["site1-a", "site1-b"]
+
+
+def test_select_list_keeps_unknown_stations():
+    assert select_stations(["b", "x", "b"], ["a", "b"]) == ["b", "x"]
+
+
+@pytest.mark.parametrize("selector", [[], [1], "", 3, {"a": 1}])
+def test_select_invalid(selector):
+    with pytest.raises(ValueError):
+        select_stations(selector, ["a"])
+
+
+class FakeSession:
+    def __init__(self, outcome, release=None):
+        self.outcome = outcome
+        self.release = release
+        self.commands = []
+
+    async def execute_command(self, msg):
+        self.commands.append(msg)
+        if self.release is not None:
+            await self.release.wait()
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return dict(self.outcome)
+
+
+@pytest.mark.asyncio
+async def test_fan_out_reports_every_station():
+    sessions = {
+        "a": FakeSession({"status": "Accepted"}),
+        "b": FakeSession(RuntimeError("boom")),
+        "c": None,
+    }
+
+    results = await fan_out(sessions, {"action": "clear_cache"}, parallelism=4)
+
+    assert results["a"]["status"] == "Accepted"
+    assert results["b"] == {"status": "error", "error": "boom", "latency_ms": results["b"]["latency_ms"]}
+    assert results["c"] == {"status": "not_connected"}
+    assert sessions["a"].commands == [{"action": "clear_cache"}]
+
+
+@pytest.mark.asyncio
+async def test_fan_out_bounds_parallelism():
+    release = asyncio.Event()
+    sessions = {str(i): FakeSession({"status": "Accepted"}, release) for i in range(5)}
+
+    task = asyncio.create_task(fan_out(sessions, {"action": "clear_cache"}, parallelism=2))
+    await asyncio.sleep(0.01)
+    started = sum(len(session.commands) for session in sessions.values())
+    release.set()
+    results = await task
+
+    assert started == 2
+    assert len(results) == 5
+
+
+def test_summarize_counts_statuses():
+    summary = summarize({"a": {"status": "Accepted"}, "b": {"status": "Accepted"}, "c": {"status": "error"}}, 0.25)
+
+    assert summary["stations"] == 3
+    assert summary["statuses"] == {"Accepted": 2, "error": 1}
+    assert summary["duration_ms"] == 250.0
@@ -0,0 +1,114 @@
+"""Tests for call_scheduler module - priority scheduling of outbound calls."""
+
+import asyncio
+
+import pytest
+
+from call_scheduler import CallScheduler, DEFAULT_CALL_PRIORITIES, load_priorities
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_load_priorities(caplog):
+    priorities = load_priorities('{"get_configuration": "transaction", "DataTransfer": "safety", "reset": "urgent"}')
+
+    assert priorities["GetConfiguration"] == "transaction"
+    assert priorities["DataTransfer"] == "safety"
+    assert priorities["Reset"] == DEFAULT_CALL_PRIORITIES["Reset"]
+    assert "OCPP_CALL_PRIORITIES class for 'reset'" in caplog.text
+
+
+async def _run_calls(scheduler, actions, order, hold):
+    async def make_call(action):
+        async with scheduler.slot(action):
+            order.append(action)
+            if action == "first":
+                await hold.wait()
+
+    first = asyncio.create_task(make_call("first"))
+    await asyncio.sleep(0)
+    tasks = []
+    for action in actions:
+        tasks.append(asyncio.create_task(make_call(action)))
+        await asyncio.sleep(0)
+    return [first] + tasks
+
+
+@pytest.mark.asyncio
+async def test_urgent_calls_go_first():
+    scheduler = CallScheduler()
+    order = []
+    hold = asyncio.Event()
+
+    tasks = await _run_calls(scheduler, ["GetDiagnostics", "GetConfiguration", "RemoteStopTransaction",
+                                         "UnlockConnector"], order, hold)
+    hold.set()
+    await asyncio.gather(*tasks)
+
+    assert order == ["first", "UnlockConnector", "RemoteStopTransaction", "GetConfiguration", "GetDiagnostics"]
+
+
+@pytest.mark.asyncio
+async def test_waiting_calls_age_past_newer_urgent_ones():
+    clock = FakeClock()
+    scheduler = CallScheduler(aging=10, clock=clock)
+    order = []
+
+    async def make_call(action):
+        async with scheduler.slot(action):
+            order.append(action)
+
+    async with scheduler.slot("Reset"):
+        old = asyncio.create_task(make_call("GetDiagnostics"))
+        await asyncio.sleep(0)
+        # 40s of waiting lifts diagnostics above a transaction call that just arrived
+        clock.now = 40
+        new = asyncio.create_task(make_call("RemoteStopTransaction"))
+        await asyncio.sleep(0)
+    await asyncio.gather(old, new)
+
+    assert order == ["GetDiagnostics", "RemoteStopTransaction"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_block_the_slot():
+    scheduler = CallScheduler()
+    order = []
+    hold = asyncio.Event()
+
+    tasks = await _run_calls(scheduler, ["Reset", "GetConfiguration"], order, hold)
+    tasks[1].cancel()
+    hold.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    assert order == ["first", "GetConfiguration"]
+    async with scheduler.slot("ClearCache"):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_stats_record_wait_per_class():
+    clock = FakeClock()
+    scheduler = CallScheduler(clock=clock)
+
+    async with scheduler.slot("Reset"):
+        waiter = asyncio.create_task(_hold_slot(scheduler, "GetDiagnostics"))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["diagnostics"]["waiting"] == 1
+        clock.now = 0.5
+    await waiter
+
+    stats = scheduler.stats()
+    assert stats["safety"] == {"calls": 1, "waiting": 0, "wait_avg_ms": 0.0, "wait_max_ms": 0.0}
+    assert stats["diagnostics"] == {"calls": 1, "waiting": 0, "wait_avg_ms": 500.0, "wait_max_ms": 500.0}
+
+
+async def _hold_slot(scheduler, action):
+    async with scheduler.slot(action):
+        pass
@@ -28,11 +28,15 @@ class FakeChargePoint:
         self._shutdown = False
         self._websocket_connected = False
         self._connection_announced = False
+        self.events = []
         FakeChargePoint.instances.append(self)
 
     async def start(self):
         self.started = True
 
+    def attach_mqtt(self):
+        self.events.append("attach_mqtt")
+
     async def mqtt_listen(self):
         self.listened = True
 
@@ -40,6 +44,7 @@ class FakeChargePoint:
         self._shutdown = True
 
     async def on_websocket_connected(self):
+        self.events.append("on_websocket_connected")
         self._websocket_connected = True
         self._connection_announced = True
 
@@ -60,6 +65,7 @@ async def test_on_connect_missing_station(monkeypatch):
     cp_instance = FakeChargePoint.instances[0]
     assert cp_instance.started and cp_instance.listened
     assert cp_instance.id.startswith("cp_")
+    assert cp_instance.events == ["attach_mqtt", "on_websocket_connected"]
     assert not ws._closed
 
 
@@ -76,3 +82,93 @@ async def test_on_connect_without_subprotocol_header(monkeypatch):
     cp_instance = FakeChargePoint.instances[0]
     assert cp_instance.id == "demo"
     assert not ws._closed
+
+
+class FakeGateway:
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.published = []
+        self.stopped = False
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        self.stopped = True
+
+    async def wait_connected(self, timeout=None):
+        return self.connected
+
+    async def publish(self, topic, payload, qos=0, retain=True, properties=None):
+        self.published.append((topic, payload))
+
+
+@pytest.mark.asyncio
+async def test_initial_state_published_for_expected_charge_points(monkeypatch):
+    import charge_point
+
+    gateway = FakeGateway()
+    monkeypatch.setattr(central_system, "get_mqtt_gateway", lambda: gateway)
+    monkeypatch.setattr(central_system, "EXPECTED_CHARGE_POINTS", ["cp1", "cp2"])
+    monkeypatch.setattr(charge_point, "MQTT_BASEPATH", "ocpp/")
+    monkeypatch.setattr(charge_point, "MQTT_USESTATIONNAME", "true")
+    monkeypatch.setattr(charge_point, "MQTT_STATE_FORMAT", "topics")
+
+    await central_system._publish_initial_disconnected_state()
+
+    topics = [topic for topic, _ in gateway.published]
+    assert sorted(topics) == ["ocpp/cp1/state/connection_state", "ocpp/cp1/state/service_started",
+                              "ocpp/cp2/state/connection_state", "ocpp/cp2/state/service_started"]
+
+
+@pytest.mark.asyncio
+async def test_initial_state_skips_connected_charge_points(monkeypatch):
+    import charge_point
+
+    gateway = FakeGateway()
+    monkeypatch.setattr(central_system, "get_mqtt_gateway", lambda: gateway)
+    monkeypatch.setattr(central_system, "EXPECTED_CHARGE_POINTS", ["cp1", "cp2"])
+    monkeypatch.setattr(central_system, "_active_sessions", {"cp1": object()})
+    monkeypatch.setattr(charge_point, "MQTT_BASEPATH", "ocpp/")
+    monkeypatch.setattr(charge_point, "MQTT_USESTATIONNAME", "true")
+    monkeypatch.setattr(charge_point, "MQTT_STATE_FORMAT", "topics")
+
+    await central_system._publish_initial_disconnected_state()
+
+    assert all(topic.startswith("ocpp/cp2/") for topic, _ in gateway.published)
+    assert len(gateway.published) == 2
+
+
+@pytest.mark.asyncio
+async def test_initial_state_waits_for_connection(monkeypatch):
+    gateway = FakeGateway(connected=False)
+    monkeypatch.setattr(central_system, "get_mqtt_gateway", lambda: gateway)
+    monkeypatch.setattr(central_system, "EXPECTED_CHARGE_POINTS", ["cp1"])
+
+    await central_system._publish_initial_disconnected_state()
+
+    assert gateway.published == []
+
+
+@pytest.mark.asyncio
+async def test_main_stops_gateway_on_shutdown(monkeypatch):
+    gateway = FakeGateway()
+    monkeypatch.setattr(central_system, "get_mqtt_gateway", lambda: gateway)
+    monkeypatch.setattr(central_system, "EXPECTED_CHARGE_POINTS", [])
+
+    class FakeServer:
+        async def wait_closed(self):
+            await asyncio.Event().wait()
+
+    async def fake_serve(*args, **kwargs):
+        return FakeServer()
+
+    monkeypatch.setattr(central_system.websockets, "serve", fake_serve)
+
+    task = asyncio.create_task(central_system.main())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert gateway.stopped
@@ -1,11 +1,14 @@
+import asyncio
+import json
 import types
 from unittest.mock import AsyncMock, patch
 
 import pytest
 
 import charge_point as cp_module
-from charge_point import ChargePoint, OCPP_COMMAND_RETRY_ATTEMPTS, OCPP_COMMAND_RETRY_BASE_DELAY
+from charge_point import ChargePoint
 import mqtt_2_charge_point
+from ocpp.v16 import call_result
 from ocpp.v16.enums import AuthorizationStatus, RegistrationStatus
 
 
@@ -16,18 +19,17 @@ class DummyConnection:
 
 @pytest.mark.asyncio
 async def test_mqtt_identifier_truncation(monkeypatch):
-    cp = ChargePoint("station-1234567890-abcdef", DummyConnection())
-
     # Force environment defaults.
-    monkeypatch.delenv("MQTT_CLIENT_ID", raising=False)
+    monkeypatch.setattr(cp_module, "MQTT_CLIENT_ID", None)
 
-    identifier = cp._mqtt_identifier()
+    identifier = cp_module._mqtt_identifier("station-1234567890-abcdef")
     assert len(identifier) <= 23
     assert identifier.startswith("ocpp2mqtt-")
 
 
 @pytest.mark.asyncio
 async def test_handle_mqtt_action_no_connection(monkeypatch):
+    monkeypatch.setattr(cp_module, "OCPP_COMMAND_READY_TIMEOUT", 0.05)
     cp = ChargePoint("station-x", DummyConnection())
     cp._connection.closed = True
 
@@ -75,15 +77,15 @@ def test_get_args_default_none():
 
 
 def test_mqtt_client_options_websocket(monkeypatch):
-    cp = ChargePoint("station", DummyConnection())
     monkeypatch.setattr(cp_module, "MQTT_TRANSPORT", "websockets")
     monkeypatch.setattr(cp_module, "MQTT_KEEPALIVE", 15)
     monkeypatch.setattr(cp_module, "MQTT_TIMEOUT", 5.0)
     monkeypatch.setattr(cp_module, "MQTT_WEBSOCKET_PATH", "/mqtt")
     monkeypatch.setattr(cp_module, "MQTT_WEBSOCKET_HEADERS", {"Sec-WebSocket-Protocol": "mqtt"})
 
-    options = cp._mqtt_client_options()
+    options = cp_module._mqtt_client_options("ocpp2mqtt-gateway")
 
+    assert options["identifier"] == "ocpp2mqtt-gateway"
     assert options["transport"] == "websockets"
     assert options["keepalive"] == 15
     assert options["timeout"] == 5.0
@@ -99,7 +101,7 @@ async def test_mqtt_publish_with_client():
         def __init__(self):
             self.calls = []
 
-        async def publish(self, topic, payload, retain=False):
+        async def publish(self, topic, payload, retain=False, **kwargs):
             self.calls.append((topic, payload, retain))
 
     fake_client = FakeClient()
@@ -252,7 +254,7 @@ async def test_on_status_notification_not_charging_resets_power(charge_point_wit
     sample_status_notification['status'] = 'Available'
     published_topics = []
     
-    async def track_publish(topic, payload, retain=True):
+    async def track_publish(topic, payload, retain=True, **kwargs):
         published_topics.append((topic, payload))
     
     charge_point_with_mqtt.client.publish = track_publish
@@ -293,6 +295,19 @@ async def test_on_boot_notification_publishes_vendor_model(charge_point_with_mqt
     assert charge_point_with_mqtt.client.publish.call_count >= 2
 
 
+@pytest.mark.asyncio
+async def test_on_boot_notification_uses_station_interval(monkeypatch, mock_websocket, mock_mqtt_client):
+    """Test the heartbeat interval can be configured per station."""
+    monkeypatch.setattr(cp_module, "OCPP_HEARTBEAT_INTERVALS", {"site1-*": 120})
+    cp = ChargePoint("site1-cp1", mock_websocket)
+    cp.client = mock_mqtt_client
+
+    result = await cp.on_boot_notification(charge_point_vendor="V", charge_point_model="M")
+
+    assert result.interval == 120
+    assert _published(cp.client, f"{cp.get_mqttpath()}/state/heartbeat_interval") == [120]
+
+
 # =============================================================================
 # Tests for on_heartbeat
 # =============================================================================
@@ -314,6 +329,154 @@ async def test_on_heartbeat_publishes_mqtt(charge_point_with_mqtt):
     assert charge_point_with_mqtt.client.publish.call_count >= 2
 
 
+@pytest.mark.asyncio
+async def test_on_heartbeat_pushes_interval_without_boot(monkeypatch, charge_point_with_mqtt):
+    """Test a station that did not boot in this session gets its interval pushed."""
+    cp = charge_point_with_mqtt
+    monkeypatch.setattr(cp, "is_websocket_connected", lambda: True)
+    sent = []
+
+    async def fake_call(payload, *args, **kwargs):
+        sent.append(payload)
+        return call_result.ChangeConfiguration(status="Accepted")
+
+    monkeypatch.setattr(cp, "call", fake_call)
+
+    await cp.on_heartbeat()
+    await asyncio.sleep(0)
+    await cp.on_heartbeat()
+    await asyncio.sleep(0)
+
+    assert [(p.key, p.value) for p in sent] == [("HeartbeatInterval", "10")]
+    assert cp._heartbeat.interval == 10
+    assert _published(cp.client, f"{cp.get_mqttpath()}/state/heartbeat_interval") == [10]
+
+
+@pytest.mark.asyncio
+async def test_adaptive_heartbeat_follows_traffic(monkeypatch, charge_point_with_mqtt):
+    """Test the interval grows while other messages arrive and drops back without them."""
+    cp = charge_point_with_mqtt
+    cp._heartbeat.max_interval = 40
+    cp._heartbeat.booted()
+    monkeypatch.setattr(cp, "is_websocket_connected", lambda: True)
+    sent = []
+
+    async def fake_call(payload, *args, **kwargs):
+        sent.append(int(payload.value))
+        return call_result.ChangeConfiguration(status="Accepted")
+
+    monkeypatch.setattr(cp, "call", fake_call)
+
+    for traffic in (2, 2, 2, 0):
+        for _ in range(traffic):
+            cp._heartbeat.observe()
+        await cp.on_heartbeat()
+        await asyncio.sleep(0)
+
+    assert sent == [20, 40, 10]
+
+
+@pytest.mark.asyncio
+async def test_adaptive_heartbeat_ignores_call_results(monkeypatch, charge_point_with_mqtt):
+    """Test the answer to our ChangeConfiguration does not count as traffic of the station."""
+    cp = charge_point_with_mqtt
+    cp._heartbeat.max_interval = 40
+    cp._heartbeat.booted()
+    monkeypatch.setattr(cp, "is_websocket_connected", lambda: True)
+    sent = []
+
+    async def fake_call(payload, *args, **kwargs):
+        sent.append(int(payload.value))
+        return call_result.ChangeConfiguration(status="Accepted")
+
+    monkeypatch.setattr(cp, "call", fake_call)
+    cp._connection.send = AsyncMock()
+
+    await cp.route_message('[3, "change-configuration", {"status": "Accepted"}]')
+    await cp.route_message('[2, "heartbeat", "Heartbeat", {}]')
+    await asyncio.sleep(0)
+    assert sent == []
+
+    await cp.route_message('[2, "status", "StatusNotification", '
+                           '{"connectorId": 1, "errorCode": "NoError", "status": "Available"}]')
+    await cp.route_message('[2, "heartbeat", "Heartbeat", {}]')
+    await asyncio.sleep(0)
+    assert sent == [20]
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_push_stops_when_rejected(monkeypatch, charge_point_with_mqtt):
+    """Test a station rejecting HeartbeatInterval is not asked again."""
+    cp = charge_point_with_mqtt
+    monkeypatch.setattr(cp, "is_websocket_connected", lambda: True)
+    fake_call = AsyncMock(return_value=call_result.ChangeConfiguration(status="Rejected"))
+    monkeypatch.setattr(cp, "call", fake_call)
+
+    await cp.on_heartbeat()
+    await asyncio.sleep(0)
+    await cp.on_heartbeat()
+    await asyncio.sleep(0)
+
+    assert fake_call.await_count == 1
+    assert cp._heartbeat.interval is None
+
+
+# =============================================================================
+# Tests for respond-first mode
+# =============================================================================
+
+def _track_send_and_publish(cp, mock_websocket):
+    events = []
+    release = asyncio.Event()
+
+    async def send(message):
+        events.append(("send", message))
+
+    async def slow_publish(topic, payload, **kwargs):
+        await release.wait()
+        events.append(("publish", topic))
+
+    mock_websocket.send = send
+    cp.client.publish = slow_publish
+    return events, release
+
+
+@pytest.mark.asyncio
+async def test_respond_first_sends_response_before_publishing(monkeypatch, charge_point_with_mqtt, mock_websocket):
+    """Test the OCPP response does not wait for the MQTT publishes of its request."""
+    monkeypatch.setattr(cp_module, "OCPP_RESPOND_FIRST", True)
+    cp = charge_point_with_mqtt
+    events, release = _track_send_and_publish(cp, mock_websocket)
+
+    await asyncio.wait_for(cp.route_message('[2, "1", "Heartbeat", {}]'), 1)
+    await asyncio.wait_for(cp.route_message('[2, "2", "StatusNotification", '
+                                            '{"connectorId": 1, "errorCode": "NoError", "status": "Charging"}]'), 1)
+    assert [kind for kind, _ in events] == ["send", "send"]
+
+    release.set()
+    await cp._drain_side_effects()
+    published = [topic.rsplit("/", 1)[-1] for kind, topic in events if kind == "publish"]
+    # Deferred publishes keep the order of the requests
+    assert published.index("last_seen") < published.index("status")
+    assert set(cp._handler_latency.stats()) == {"Heartbeat", "StatusNotification"}
+
+
+@pytest.mark.asyncio
+async def test_inline_mode_publishes_before_responding(monkeypatch, charge_point_with_mqtt, mock_websocket):
+    """Test handlers await their publishes by default and latency is still recorded."""
+    cp = charge_point_with_mqtt
+    events, release = _track_send_and_publish(cp, mock_websocket)
+    release.set()
+
+    await cp.route_message('[2, "1", "Heartbeat", {}]')
+
+    assert events[-1][0] == "send"
+    assert "publish" in [kind for kind, _ in events[:-1]]
+    stats = cp._handler_latency.stats()["Heartbeat"]
+    assert stats["count"] == 1
+    assert stats["mqtt_avg_ms"] == stats["response_avg_ms"]
+
+
 # =============================================================================
 # Tests for on_meter_values
 # =============================================================================
@@ -332,7 +495,7 @@ async def test_on_meter_values_formats_measurand(charge_point_with_mqtt, sample_
     """Test meter values formats measurand names correctly."""
     published_topics = []
     
-    async def track_publish(topic, payload, retain=True):
+    async def track_publish(topic, payload, retain=True, **kwargs):
         published_topics.append((topic, payload))
     
     charge_point_with_mqtt.client.publish = track_publish
@@ -345,6 +508,74 @@ async def test_on_meter_values_formats_measurand(charge_point_with_mqtt, sample_
     assert any('power_active_import' in t for t in topic_names)
 
 
+
+@pytest.mark.asyncio
+async def test_on_meter_values_publishes_all_entries(charge_point_with_mqtt, sample_meter_values):
+    """Test later entries, phases and kilo units are all published."""
+    sample_meter_values["meter_value"].append({
+        "timestamp": "2026-01-27T10:01:00Z",
+        "sampled_value": [
+            {"measurand": "Power.Active.Import", "value": "3.6", "unit": "kW"},
+            {"measurand": "Voltage", "phase": "L1-N", "value": "231.0", "unit": "V"},
+        ],
+    })
+
+    await charge_point_with_mqtt.on_meter_values(**sample_meter_values)
+
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    assert _published(charge_point_with_mqtt.client, f"{mqtt_path}/state/power_active_import") == ["3600"]
+    assert _published(charge_point_with_mqtt.client, f"{mqtt_path}/state/voltage_l1_n") == ["231.0"]
+    assert _published(charge_point_with_mqtt.client, f"{mqtt_path}/state/energy_active_import_register") == ["1000"]
+
+
+@pytest.mark.asyncio
+async def test_on_meter_values_aggregates_over_window(charge_point_with_mqtt, sample_meter_values):
+    """Test readings are held for the telemetry window and flushed as min/max/mean."""
+    from telemetry_aggregator import TelemetryAggregator
+    cp = charge_point_with_mqtt
+    cp._telemetry = TelemetryAggregator(window=0.05)
+    mqtt_path = cp.get_mqttpath()
+
+    await cp.on_meter_values(**sample_meter_values)
+    sample_meter_values["meter_value"][0]["sampled_value"][1]["value"] = "3700"
+    await cp.on_meter_values(**sample_meter_values)
+    assert _published(cp.client, f"{mqtt_path}/state/power_active_import") == []
+    assert _published(cp.client, f"{mqtt_path}/state/transaction_id") == [123]
+
+    await asyncio.sleep(0.1)
+    assert _published(cp.client, f"{mqtt_path}/state/power_active_import") == ["3700"]
+    assert _published(cp.client, f"{mqtt_path}/state/power_active_import_min") == ["3500"]
+    assert _published(cp.client, f"{mqtt_path}/state/power_active_import_mean") == ["3600"]
+
+
+@pytest.mark.asyncio
+async def test_disconnect_flushes_telemetry_window(charge_point_with_mqtt, sample_meter_values):
+    """Test pending readings are published when the charger disconnects."""
+    from telemetry_aggregator import TelemetryAggregator
+    cp = charge_point_with_mqtt
+    cp._telemetry = TelemetryAggregator(window=60)
+
+    await cp.on_meter_values(**sample_meter_values)
+    await cp.on_websocket_disconnected()
+
+    assert _published(cp.client, f"{cp.get_mqttpath()}/state/power_active_import_max") == ["3500"]
+    assert cp._telemetry_flush is None
+    assert not cp._telemetry.pending
+
+
+@pytest.mark.asyncio
+async def test_status_zeros_become_telemetry_baseline(charge_point_with_mqtt, sample_meter_values):
+    """Test power zeroed by a status change does not suppress the same reading afterwards."""
+    from telemetry_aggregator import TelemetryAggregator
+    cp = charge_point_with_mqtt
+    cp._telemetry = TelemetryAggregator(deadbands={"default": 100})
+
+    await cp.on_meter_values(**sample_meter_values)
+    await cp.on_status_notification(connector_id=1, error_code="NoError", status="SuspendedEV")
+    await cp.on_meter_values(**sample_meter_values)
+
+    assert _published(cp.client, f"{cp.get_mqttpath()}/state/power_active_import") == ["3500", 0, "3500"]
+
 # =============================================================================
 # Tests for _has_active_websocket
 # =============================================================================
@@ -403,35 +634,137 @@ async def test_wait_for_websocket_immediate_success(charge_point):
     assert result is True
 
 
+def _gateway_with_client(monkeypatch):
+    from mqtt_gateway import MqttGateway
+
+    gateway = MqttGateway(AsyncMock)
+    gateway.client = AsyncMock()
+    monkeypatch.setattr(gateway, "start", lambda: None)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    return gateway
+
+
+async def _close_session_with_waiting_command(session, payload):
+    listen = asyncio.create_task(session.mqtt_listen())
+    await asyncio.sleep(0)
+    session._mqtt_route.deliver(types.SimpleNamespace(topic=f"{session.get_mqttpath()}/cmd", payload=payload))
+    await asyncio.sleep(0.01)
+    session.shutdown()
+    await asyncio.wait_for(listen, timeout=1)
+
+
 @pytest.mark.asyncio
-async def test_wait_for_websocket_success_after_retry(charge_point, monkeypatch):
-    """Test _wait_for_websocket_connection succeeds after a retry."""
-    call_count = 0
-    
-    def mock_has_active():
-        nonlocal call_count
-        call_count += 1
-        return call_count >= 2  # Succeed on second call
-    
-    monkeypatch.setattr(charge_point, "_has_active_websocket", mock_has_active)
-    monkeypatch.setattr(cp_module, "OCPP_COMMAND_RETRY_BASE_DELAY", 0.01)  # Fast for tests
-    
-    result = await charge_point._wait_for_websocket_connection("test_action")
-    
-    assert result is True
-    assert call_count == 2
+async def test_waiting_command_resumes_on_the_next_session(monkeypatch, mock_websocket):
+    """Test a command waiting for readiness when its session closes runs on the station's next session."""
+    gateway = _gateway_with_client(monkeypatch)
+    monkeypatch.setattr(cp_module, "OCPP_COMMAND_READY_TIMEOUT", 5)
+    old = ChargePoint("test-station", mock_websocket)
+    monkeypatch.setattr(old, "_has_active_websocket", lambda: False)
+
+    await _close_session_with_waiting_command(old, command_payload("reset"))
+
+    new = ChargePoint("test-station", mock_websocket)
+    handled = []
+
+    async def fake_handle(msg):
+        handled.append(msg["action"])
+
+    monkeypatch.setattr(new, "_handle_mqtt_action", fake_handle)
+    listen = asyncio.create_task(new.mqtt_listen())
+    await asyncio.sleep(0.01)
+    new.shutdown()
+    await asyncio.wait_for(listen, timeout=1)
+
+    assert handled == ["reset"]
+
+
+@pytest.mark.asyncio
+async def test_handed_over_command_fails_without_reconnect(monkeypatch, mock_websocket):
+    """Test a handed-over command is answered once the station stays away past the ready timeout."""
+    gateway = _gateway_with_client(monkeypatch)
+    monkeypatch.setattr(cp_module, "OCPP_COMMAND_READY_TIMEOUT", 0.05)
+    old = ChargePoint("test-station", mock_websocket)
+    monkeypatch.setattr(old, "_has_active_websocket", lambda: False)
+
+    await _close_session_with_waiting_command(old, command_payload("reset"))
+    assert len(gateway._unrouted[old.get_mqttpath()]) == 1
+
+    await asyncio.sleep(0.1)
+
+    assert _published(gateway.client, f"{old.get_mqttpath()}/cmd_result/status") == ["error"]
+    assert not gateway._unrouted[old.get_mqttpath()]
+
+
+@pytest.mark.asyncio
+async def test_waiting_queueable_command_is_queued_at_teardown(monkeypatch, tmp_path, mock_websocket):
+    """Test a queueable command waiting when its session closes goes to the durable queue."""
+    from command_queue import CommandQueue
+
+    gateway = _gateway_with_client(monkeypatch)
+    gateway.command_queue = CommandQueue(str(tmp_path / "commands.json"))
+    monkeypatch.setattr(cp_module, "OCPP_COMMAND_READY_TIMEOUT", 5)
+    session = ChargePoint("test-station", mock_websocket)
+    monkeypatch.setattr(session, "_has_active_websocket", lambda: False)
+
+    await _close_session_with_waiting_command(
+        session, b'{"action": "change_configuration", "args": {"key": "A", "value": "1"}}')
+    await asyncio.sleep(0)
+
+    assert len(gateway.command_queue) == 1
+    assert not gateway._unrouted.get(session.get_mqttpath())
+    assert _published(gateway.client, f"{session.get_mqttpath()}/cmd_result/status") == ["queued"]
 
 
 @pytest.mark.asyncio
-async def test_wait_for_websocket_failure_after_max_retries(charge_point, monkeypatch):
-    """Test _wait_for_websocket_connection fails after max retries."""
+async def test_sent_command_is_answered_cancelled_at_teardown(monkeypatch, mock_websocket):
+    """Test a command already sent when its session closes is answered as cancelled."""
+    gateway = _gateway_with_client(monkeypatch)
+    session = ChargePoint("test-station", mock_websocket)
+    started = asyncio.Event()
+
+    async def fake_reset(cp, args):
+        started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(session, "_has_active_websocket", lambda: True)
+    monkeypatch.setattr(mqtt_2_charge_point, "reset", fake_reset)
+    session._ready.set()
+
+    listen = asyncio.create_task(session.mqtt_listen())
+    await asyncio.sleep(0)
+    session._mqtt_route.deliver(types.SimpleNamespace(topic=f"{session.get_mqttpath()}/cmd",
+                                                      payload=command_payload("reset")))
+    await asyncio.wait_for(started.wait(), timeout=1)
+    session.shutdown()
+    await asyncio.wait_for(listen, timeout=1)
+    await asyncio.sleep(0)
+
+    assert _published(gateway.client, f"{session.get_mqttpath()}/cmd_result/status") == ["cancelled"]
+
+
+@pytest.mark.asyncio
+async def test_wait_for_websocket_failure_after_deadline(charge_point, monkeypatch):
+    """Test _wait_for_websocket_connection gives up at the overall deadline."""
     monkeypatch.setattr(charge_point, "_has_active_websocket", lambda: False)
-    monkeypatch.setattr(cp_module, "OCPP_COMMAND_RETRY_ATTEMPTS", 3)
-    monkeypatch.setattr(cp_module, "OCPP_COMMAND_RETRY_BASE_DELAY", 0.01)
-    
+    monkeypatch.setattr(cp_module, "OCPP_COMMAND_READY_TIMEOUT", 0.05)
+    charge_point._ready.set()
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
     result = await charge_point._wait_for_websocket_connection("test_action")
-    
+
     assert result is False
+    assert 0.04 <= loop.time() - started < 0.5
+
+
+@pytest.mark.asyncio
+async def test_websocket_disconnect_clears_ready(charge_point):
+    """Test session setup and teardown set and clear the ready signal."""
+    await charge_point.on_websocket_connected()
+    assert charge_point._ready.is_set()
+
+    await charge_point.on_websocket_disconnected("test")
+    assert not charge_point._ready.is_set()
 
 
 # =============================================================================
@@ -511,3 +844,827 @@ async def test_publish_command_error(charge_point_with_mqtt):
     await charge_point_with_mqtt._publish_command_error(msg, error)
     
     assert charge_point_with_mqtt.client.publish.call_count >= 1
+
+
+# =============================================================================
+# Tests for mqtt_listen via the shared gateway
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_mqtt_listen_processes_routed_messages(monkeypatch, charge_point):
+    """Test mqtt_listen consumes commands routed by the shared gateway."""
+    from mqtt_gateway import MqttGateway
+    from aiomqtt.topic import Topic
+
+    gateway = MqttGateway(AsyncMock)
+    monkeypatch.setattr(gateway, "start", lambda: None)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    handled = []
+
+    async def fake_handle(msg):
+        handled.append(msg)
+        charge_point.shutdown()
+
+    monkeypatch.setattr(charge_point, "_handle_mqtt_action", fake_handle)
+
+    listen_task = asyncio.create_task(charge_point.mqtt_listen())
+    await asyncio.sleep(0)
+    mqtt_path = charge_point.get_mqttpath()
+    gateway.dispatch(types.SimpleNamespace(topic=Topic(f"{mqtt_path}/cmd"),
+                                           payload=b'{"action": "clear_cache"}'))
+    await asyncio.wait_for(listen_task, timeout=1)
+
+    assert handled == [{"action": "clear_cache"}]
+    assert gateway._stations == {}
+
+
+@pytest.mark.asyncio
+async def test_mqtt_listen_stops_on_shutdown(monkeypatch, charge_point):
+    """Test shutdown wakes an idle mqtt_listen loop."""
+    from mqtt_gateway import MqttGateway
+
+    gateway = MqttGateway(AsyncMock)
+    monkeypatch.setattr(gateway, "start", lambda: None)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+
+    listen_task = asyncio.create_task(charge_point.mqtt_listen())
+    await asyncio.sleep(0)
+    charge_point.shutdown()
+    await asyncio.wait_for(listen_task, timeout=1)
+
+    assert charge_point._mqtt_route is None
+
+
+# =============================================================================
+# Tests for the publish pipeline
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_mqtt_publish_uses_pipeline(monkeypatch, mock_websocket, mock_mqtt_client):
+    """Test handlers return before publishes complete when the pipeline is on."""
+    monkeypatch.setattr(cp_module, "MQTT_PUBLISH_PIPELINE", True)
+    cp = ChargePoint("pipelined", mock_websocket)
+    cp.client = mock_mqtt_client
+
+    await cp.on_heartbeat()
+    await cp.flush_mqtt()
+
+    assert mock_mqtt_client.publish.call_count == 2
+    cp.shutdown()
+
+
+# =============================================================================
+# Tests for the last-value cache
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_unchanged_state_is_not_republished(charge_point_with_mqtt):
+    """Test repeated heartbeats only republish values that changed."""
+    published_topics = []
+
+    async def track_publish(topic, payload, retain=True, **kwargs):
+        published_topics.append(topic)
+
+    charge_point_with_mqtt.client.publish = track_publish
+
+    await charge_point_with_mqtt.push_state_value_mqtt('heartbeat', 'ON')
+    await charge_point_with_mqtt.push_state_value_mqtt('heartbeat', 'ON')
+    await charge_point_with_mqtt.push_state_value_mqtt('heartbeat', 'OFF')
+
+    assert len([t for t in published_topics if t.endswith('/heartbeat')]) == 2
+
+
+@pytest.mark.asyncio
+async def test_new_mqtt_client_clears_state_cache(charge_point, mock_mqtt_client):
+    """Test values are republished after the broker connection changes."""
+    charge_point.client = mock_mqtt_client
+    await charge_point.push_state_value_mqtt('status', 'Available')
+
+    new_client = AsyncMock()
+    charge_point.client = new_client
+    await charge_point.push_state_value_mqtt('status', 'Available')
+
+    assert new_client.publish.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_queued_state_is_compared_with_latest_value(monkeypatch, mock_websocket):
+    """Test a value changed back while the previous one is still queued is published again."""
+    monkeypatch.setattr(cp_module, "MQTT_PUBLISH_PIPELINE", True)
+    cp = ChargePoint("pipelined", mock_websocket)
+    cp.client = AsyncMock()
+    release = asyncio.Event()
+
+    async def publish(topic, payload=None, **kwargs):
+        if payload == 'SuspendedEV':
+            await release.wait()
+
+    await cp.push_state_value_mqtt('status', 'Charging')
+    await cp.flush_mqtt()
+    cp.client.publish.side_effect = publish
+    await cp.push_state_value_mqtt('status', 'SuspendedEV')
+    await asyncio.sleep(0)
+    await cp.push_state_value_mqtt('status', 'Charging')
+    release.set()
+    await cp.flush_mqtt()
+
+    assert _published(cp.client, f"{cp.get_mqttpath()}/state/status")[-1] == 'Charging'
+    cp.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_only_state_topics_are_cached(charge_point_with_mqtt):
+    """Test one-off result topics do not take entries of the state cache."""
+    await charge_point_with_mqtt.push_call_return_mqtt({'status': 'Accepted'})
+    await charge_point_with_mqtt.push_state_value_mqtt('status', 'Available')
+
+    assert len(charge_point_with_mqtt._state_cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_publish_is_not_cached(charge_point):
+    """Test a value skipped while offline is published once a client is back."""
+    charge_point.client = None
+    await charge_point.push_state_value_mqtt('status', 'Available')
+
+    client = AsyncMock()
+    charge_point.client = client
+    await charge_point.push_state_value_mqtt('status', 'Available')
+
+    assert client.publish.call_count == 1
+
+
+# =============================================================================
+# Tests for the aggregated JSON state document
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_state_json_mode_publishes_one_document(monkeypatch, charge_point_with_mqtt, sample_status_notification):
+    """Test json mode publishes a single document per event."""
+    monkeypatch.setattr(cp_module, "MQTT_STATE_FORMAT", "json")
+    published = []
+
+    async def track_publish(topic, payload, retain=True, **kwargs):
+        published.append((topic, payload))
+
+    charge_point_with_mqtt.client.publish = track_publish
+
+    await charge_point_with_mqtt.on_status_notification(**sample_status_notification)
+
+    assert len(published) == 1
+    topic, payload = published[0]
+    assert topic == f"{charge_point_with_mqtt.get_mqttpath()}/state_json"
+    document = cp_module.JSON.loads(payload)
+    assert document['status'] == 'Available'
+    assert document['power_active_import'] == 0
+
+
+@pytest.mark.asyncio
+async def test_state_json_mode_merges_events(monkeypatch, charge_point_with_mqtt, sample_boot_notification):
+    """Test the document keeps values from earlier events."""
+    monkeypatch.setattr(cp_module, "MQTT_STATE_FORMAT", "json")
+    published = []
+
+    async def track_publish(topic, payload, retain=True, **kwargs):
+        published.append(payload)
+
+    charge_point_with_mqtt.client.publish = track_publish
+
+    await charge_point_with_mqtt.on_boot_notification(
+        charge_point_vendor=sample_boot_notification['charge_point_vendor'],
+        charge_point_model=sample_boot_notification['charge_point_model'],
+    )
+    await charge_point_with_mqtt.on_heartbeat()
+
+    document = cp_module.JSON.loads(published[-1])
+    assert document['charge_point_vendor'] == 'TestVendor'
+    assert document['heartbeat'] == 'ON'
+
+
+@pytest.mark.asyncio
+async def test_state_both_mode_publishes_document_and_topics(monkeypatch, charge_point_with_mqtt):
+    """Test both mode keeps the per-key topics alongside the document."""
+    monkeypatch.setattr(cp_module, "MQTT_STATE_FORMAT", "both")
+
+    await charge_point_with_mqtt.on_heartbeat()
+
+    topics = [c.args[0] for c in charge_point_with_mqtt.client.publish.call_args_list]
+    assert any(t.endswith('/state_json') for t in topics)
+    assert any(t.endswith('/state/heartbeat') for t in topics)
+
+
+# =============================================================================
+# Tests for the publish policy
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_mqtt_publish_applies_topic_class_policy(monkeypatch, charge_point_with_mqtt):
+    """Test telemetry and connection topics use their own QoS/retain policy."""
+    import publish_policy
+    monkeypatch.setattr(publish_policy, "MQTT_PUBLISH_POLICY", publish_policy.load_policies(
+        '{"telemetry": {"qos": 0, "retain": false}, "connection": {"qos": 1, "retain": true}}'
+    ))
+
+    await charge_point_with_mqtt.push_state_values_mqtt(power_active_import=3500, connection_state='CONNECTED')
+
+    calls = {c.args[0].rsplit('/', 1)[1]: c.kwargs for c in charge_point_with_mqtt.client.publish.call_args_list}
+    assert calls['power_active_import']['qos'] == 0
+    assert calls['power_active_import']['retain'] is False
+    assert calls['connection_state']['qos'] == 1
+    assert calls['connection_state']['retain'] is True
+
+
+# =============================================================================
+# Tests for the offline spool
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_mqtt_publish_spools_without_client(monkeypatch, tmp_path, charge_point, caplog):
+    """Test publishes are spooled to disk while the broker is unavailable."""
+    from mqtt_gateway import MqttGateway
+    from offline_spool import OfflineSpool
+
+    spool = OfflineSpool(str(tmp_path / "spool.jsonl"))
+    gateway = MqttGateway(AsyncMock, spool=spool)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    charge_point.client = None
+
+    await charge_point.on_stop_transaction(transaction_id=1, meter_stop=1000,
+                                           timestamp='2026-01-27T11:00:00Z', reason='Local')
+
+    assert len(spool) == 3
+    assert "MQTT publish skipped" not in caplog.text
+    spool.close()
+
+
+@pytest.mark.asyncio
+async def test_unrouted_session_publishes_over_shared_connection(monkeypatch, tmp_path, charge_point):
+    """Test a session not routed yet publishes live while the gateway is connected."""
+    from mqtt_gateway import MqttGateway
+    from offline_spool import OfflineSpool
+
+    spool = OfflineSpool(str(tmp_path / "spool.jsonl"))
+    gateway = MqttGateway(AsyncMock, spool=spool)
+    gateway.client = AsyncMock()
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    charge_point.client = None
+
+    await charge_point.on_websocket_connected()
+    await charge_point.flush_mqtt()
+
+    assert len(spool) == 0
+    assert _published(gateway.client, f"{charge_point.get_mqttpath()}/state/connection_state") == ["CONNECTED"]
+    spool.close()
+
+
+@pytest.mark.asyncio
+async def test_mqtt_publish_spools_on_publish_error(monkeypatch, tmp_path, charge_point_with_mqtt):
+    """Test a publish that fails on the wire is spooled as well."""
+    from aiomqtt import MqttError
+    from mqtt_gateway import MqttGateway
+    from offline_spool import OfflineSpool
+
+    spool = OfflineSpool(str(tmp_path / "spool.jsonl"))
+    gateway = MqttGateway(AsyncMock, spool=spool)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    charge_point_with_mqtt.client.publish.side_effect = MqttError("connection lost")
+
+    await charge_point_with_mqtt.push_state_value_mqtt('meter_stop', 1000)
+
+    assert len(spool) == 1
+    spool.close()
+
+
+def test_command_wildcard(monkeypatch):
+    """Test a single wildcard is only used when stations have their own level."""
+    monkeypatch.setattr(cp_module, "MQTT_USESTATIONNAME", "true")
+    monkeypatch.setattr(cp_module, "MQTT_BASEPATH", "ocpp/")
+    assert cp_module.command_wildcard() == "ocpp/+/cmd/#"
+
+    monkeypatch.setattr(cp_module, "MQTT_BASEPATH", "ocpp/site-")
+    assert cp_module.command_wildcard() is None
+
+    monkeypatch.setattr(cp_module, "MQTT_USESTATIONNAME", None)
+    assert cp_module.command_wildcard() is None
+
+
+# =============================================================================
+# Tests for MQTT v5 support
+# =============================================================================
+
+def test_mqtt_client_options_protocol(monkeypatch):
+    """Test the MQTT protocol version is passed to the client."""
+    from aiomqtt import ProtocolVersion
+
+    assert cp_module._mqtt_client_options("gw")["protocol"] == ProtocolVersion.V311
+    monkeypatch.setattr(cp_module, "MQTT_PROTOCOL", "5")
+    assert cp_module._mqtt_client_options("gw")["protocol"] == ProtocolVersion.V5
+
+
+@pytest.mark.asyncio
+async def test_command_result_answers_response_topic(monkeypatch, charge_point_with_mqtt):
+    """Test an MQTT v5 request gets its result on the response topic."""
+    from aiomqtt.topic import Topic
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+
+    async def fake_handle(msg):
+        return call_result.ClearCache(status="Accepted")
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.ResponseTopic = "app/replies"
+    properties.CorrelationData = b"req-1"
+    message = types.SimpleNamespace(topic=Topic("ocpp/test/cmd"), payload=b'{"action": "clear_cache"}',
+                                    properties=properties)
+
+    await _submit(charge_point_with_mqtt, message)
+
+    calls = [c for c in charge_point_with_mqtt.client.publish.call_args_list if c.args[0] == "app/replies"]
+    assert len(calls) == 1
+    assert json.loads(calls[0].kwargs["payload"]) == {"action": "clear_cache", "status": "Accepted"}
+    assert calls[0].kwargs["retain"] is False
+    assert calls[0].kwargs["properties"].CorrelationData == b"req-1"
+
+
+# =============================================================================
+# Tests for concurrent command execution
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_mqtt_listen_runs_commands_concurrently(monkeypatch, charge_point):
+    """Test a slow command does not hold up a later command of another action."""
+    from mqtt_gateway import MqttGateway
+    from aiomqtt.topic import Topic
+
+    gateway = MqttGateway(AsyncMock)
+    monkeypatch.setattr(gateway, "start", lambda: None)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    release = asyncio.Event()
+    handled = []
+
+    async def fake_handle(msg):
+        if msg["action"] == "get_diagnostics":
+            await release.wait()
+        handled.append(msg["action"])
+
+    monkeypatch.setattr(charge_point, "_handle_mqtt_action", fake_handle)
+
+    listen_task = asyncio.create_task(charge_point.mqtt_listen())
+    await asyncio.sleep(0)
+    topic = Topic(f"{charge_point.get_mqttpath()}/cmd")
+    for action in ("get_diagnostics", "remote_stop_transaction"):
+        gateway.dispatch(types.SimpleNamespace(topic=topic, payload=command_payload(action)))
+    await asyncio.sleep(0.01)
+
+    assert handled == ["remote_stop_transaction"]
+    release.set()
+    await asyncio.sleep(0.01)
+    assert handled == ["remote_stop_transaction", "get_diagnostics"]
+
+    charge_point.shutdown()
+    await asyncio.wait_for(listen_task, timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_mqtt_listen_cancels_commands_on_shutdown(monkeypatch, charge_point):
+    """Test commands still running are cancelled when the session ends."""
+    from mqtt_gateway import MqttGateway
+    from aiomqtt.topic import Topic
+
+    gateway = MqttGateway(AsyncMock)
+    monkeypatch.setattr(gateway, "start", lambda: None)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    started = asyncio.Event()
+
+    async def fake_handle(msg):
+        started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(charge_point, "_handle_mqtt_action", fake_handle)
+
+    listen_task = asyncio.create_task(charge_point.mqtt_listen())
+    await asyncio.sleep(0)
+    gateway.dispatch(types.SimpleNamespace(topic=Topic(f"{charge_point.get_mqttpath()}/cmd"),
+                                           payload=command_payload("get_diagnostics")))
+    await asyncio.wait_for(started.wait(), timeout=1)
+    charge_point.shutdown()
+    await asyncio.wait_for(listen_task, timeout=1)
+
+    assert charge_point._commands.in_flight == 0
+
+
+# Arguments accepted by the OCPP 1.6 schemas
+VALID_ARGS = {
+    "get_diagnostics": {"location": "ftp://diagnostics.example.com/"},
+    "remote_stop_transaction": {"transaction_id": 1},
+    "reset": {"type": "Soft"},
+}
+
+
+def command_payload(action):
+    return json.dumps({"action": action, "args": VALID_ARGS.get(action, {})}).encode()
+
+
+# =============================================================================
+# Tests for request IDs
+# =============================================================================
+
+async def _submit(session, message):
+    """Hand an inbound command to the session like mqtt_listen does, and wait for it to finish."""
+    msg = session._decode_mqtt_message(message)
+    if msg is not None:
+        session._submit_command(message, msg)
+    await session._commands.join()
+
+
+def _published(client, topic):
+    return [c.kwargs["payload"] for c in client.publish.call_args_list if c.args[0] == topic]
+
+
+@pytest.mark.asyncio
+async def test_request_id_result_is_published_as_document(monkeypatch, charge_point_with_mqtt):
+    """Test a command with a request_id gets one JSON result on its own topic."""
+    async def fake_handle(msg):
+        return call_result.Reset(status="Accepted")
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+    message = types.SimpleNamespace(payload=b'{"action": "reset", "request_id": "r-1", "args": {"type": "Soft"}}')
+
+    await _submit(charge_point_with_mqtt, message)
+
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    documents = _published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/r-1")
+    assert [json.loads(d) for d in documents] == [{"action": "reset", "request_id": "r-1", "status": "Accepted"}]
+    # Legacy per-field topics are still published
+    assert _published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_result/status") == ["Accepted"]
+
+
+@pytest.mark.asyncio
+async def test_structured_result_fields_are_json_encoded(monkeypatch, charge_point_with_mqtt):
+    """Test list and dict result fields are published as JSON and the document still goes out."""
+    async def fake_handle(msg):
+        return call_result.GetConfiguration(configuration_key=[{"key": "A", "readonly": False, "value": "1"}])
+
+    async def publish(topic, payload=None, **kwargs):
+        if not isinstance(payload, (str, bytes, int, float)):
+            raise TypeError("payload must be a string, bytearray, int, float or None.")
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+    charge_point_with_mqtt.client.publish.side_effect = publish
+    charge_point_with_mqtt._submit_command(None, {"action": "get_configuration", "request_id": "g1"})
+    await charge_point_with_mqtt._commands.join()
+
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    keys = _published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_result/configuration_key")
+    assert json.loads(keys[0]) == [{"key": "A", "readonly": False, "value": "1"}]
+    document = json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/g1")[0])
+    assert document["configuration_key"][0]["key"] == "A"
+
+
+@pytest.mark.asyncio
+async def test_request_id_result_is_not_retained(monkeypatch, charge_point_with_mqtt):
+    """Test per-request results are not retained by default."""
+    async def fake_handle(msg):
+        return call_result.Reset(status="Accepted")
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(payload=b'{"action": "reset", "request_id": 7}'))
+
+    topic = f"{charge_point_with_mqtt.get_mqttpath()}/cmd_response/7"
+    calls = [c for c in charge_point_with_mqtt.client.publish.call_args_list if c.args[0] == topic]
+    assert calls[0].kwargs["retain"] is False
+
+
+@pytest.mark.asyncio
+async def test_request_id_error_is_published_as_document(monkeypatch, charge_point_with_mqtt):
+    """Test a failing command reports the error on its request topic."""
+    async def fake_handle(msg):
+        raise RuntimeError("Charge point websocket is not connected")
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(
+        payload=b'{"action": "reset", "args": {"type": "Soft"}, "request_id": "r-2"}'))
+
+    documents = _published(charge_point_with_mqtt.client, f"{charge_point_with_mqtt.get_mqttpath()}/cmd_response/r-2")
+    assert json.loads(documents[0]) == {"action": "reset", "request_id": "r-2", "status": "error",
+                                        "error": "Charge point websocket is not connected"}
+
+
+@pytest.mark.asyncio
+async def test_invalid_arguments_are_rejected_locally(monkeypatch, charge_point_with_mqtt):
+    """Test a malformed command gets a structured error without reaching the charge point."""
+    handle = AsyncMock()
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", handle)
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(
+        payload=b'{"action": "change_availability", "args": {"connector_id": 1, "type": "Off"}, "request_id": "v1"}'))
+
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    handle.assert_not_awaited()
+    document = json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/v1")[0])
+    assert document["error"] == "Invalid arguments"
+    assert document["errors"][0]["path"] == "type"
+    assert json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_result/errors")[0]) == document["errors"]
+
+@pytest.mark.asyncio
+async def test_request_id_without_ocpp_result_still_answers(charge_point_with_mqtt):
+    """Test commands handled locally still answer their request topic."""
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(
+        payload=b'{"action": "charging_enabled", "args": "ON", "request_id": "r-3"}'))
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(
+        payload=b'{"action": "does_not_exist", "request_id": "r-4"}'))
+
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    enabled = json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/r-3")[0])
+    unknown = json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/r-4")[0])
+    assert enabled["status"] == "completed"
+    assert enabled["charging_enabled"] == "ON"
+    assert unknown["status"] == "error"
+
+
+@pytest.mark.asyncio
+async def test_invalid_request_id_is_rejected(monkeypatch, charge_point_with_mqtt):
+    """Test a request_id that cannot be used in a topic rejects the command."""
+    handled = []
+
+    async def fake_handle(msg):
+        handled.append(msg)
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(payload=b'{"action": "reset", "request_id": "a/#"}'))
+
+    assert handled == []
+    status = _published(charge_point_with_mqtt.client, f"{charge_point_with_mqtt.get_mqttpath()}/cmd_result/status")
+    assert status == ["error"]
+
+
+@pytest.mark.asyncio
+async def test_superseded_command_reports_result(monkeypatch, charge_point_with_mqtt):
+    """Test a waiting command replaced by a newer one for the same connector is reported."""
+    release = asyncio.Event()
+    handled = []
+
+    async def fake_handle(msg):
+        handled.append(msg["args"]["type"])
+        if len(handled) == 1:
+            await release.wait()
+        return call_result.ChangeAvailability(status="Accepted")
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+    for request_id, availability in (("r1", "Inoperative"), ("r2", "Operative"), ("r3", "Inoperative")):
+        charge_point_with_mqtt._submit_command(None, {
+            "action": "change_availability", "request_id": request_id,
+            "args": {"connector_id": 1, "type": availability}})
+        await asyncio.sleep(0)
+    release.set()
+    await charge_point_with_mqtt._commands.join()
+
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    assert handled == ["Inoperative", "Inoperative"]
+    superseded = json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/r2")[0])
+    assert superseded == {"action": "change_availability", "request_id": "r2", "status": "superseded"}
+
+
+@pytest.mark.asyncio
+async def test_malformed_command_is_rejected_before_coalescing(monkeypatch, charge_point_with_mqtt):
+    """Test a malformed command is answered at once and does not replace a valid waiting one."""
+    release = asyncio.Event()
+    handled = []
+
+    async def fake_handle(msg):
+        handled.append(msg["request_id"])
+        if len(handled) == 1:
+            await release.wait()
+        return call_result.SetChargingProfile(status="Accepted")
+
+    def profile(period):
+        return {"charging_profile_id": 1, "stack_level": 0, "charging_profile_purpose": "TxDefaultProfile",
+                "charging_profile_kind": "Absolute",
+                "charging_schedule": {"charging_rate_unit": "A", "charging_schedule_period": [period]}}
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+    for request_id, period in (("p1", {"start_period": 0, "limit": 16}), ("p2", {"start_period": 0, "limit": 10}),
+                               ("p3", {"start_period": 0})):
+        charge_point_with_mqtt._submit_command(None, {
+            "action": "set_charging_profile", "request_id": request_id,
+            "args": {"connector_id": 1, "cs_charging_profiles": profile(period)}})
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    assert _published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_result/status") == ["error"]
+    assert handled == ["p1"]
+
+    release.set()
+    await charge_point_with_mqtt._commands.join()
+
+    assert handled == ["p1", "p2"]
+    assert "superseded" not in _published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_result/status")
+
+@pytest.mark.asyncio
+async def test_execute_command_returns_outcome(monkeypatch, charge_point_with_mqtt):
+    """Test broadcast commands return their result instead of publishing it."""
+    async def fake_handle(msg):
+        if msg["action"] == "reset":
+            raise cp_module.ChargePointNotConnected("offline")
+        return call_result.ClearCache(status="Accepted")
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+
+    assert await charge_point_with_mqtt.execute_command({"action": "clear_cache"}) == {"status": "Accepted"}
+    assert await charge_point_with_mqtt.execute_command(
+        {"action": "reset", "args": {"type": "Hard"}}) == {"status": "not_connected"}
+    assert charge_point_with_mqtt.client.publish.await_count == 0
+
+
+# =============================================================================
+# Tests for command deadlines and cancellation
+# =============================================================================
+
+async def _ready(action):
+    return True
+
+
+@pytest.mark.asyncio
+async def test_action_timeout_frees_the_call(monkeypatch, charge_point_with_mqtt):
+    """Test a call without an answer fails after the timeout of its action."""
+    async def hang(cp, payload):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(mqtt_2_charge_point, "reset", hang)
+    monkeypatch.setattr(charge_point_with_mqtt, "_wait_for_websocket_connection", _ready)
+    monkeypatch.setitem(charge_point_with_mqtt._action_timeouts, "reset", 0.01)
+
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(
+        payload=b'{"action": "reset", "args": {"type": "Soft"}, "request_id": "t1"}'))
+
+    document = json.loads(_published(charge_point_with_mqtt.client, f"{charge_point_with_mqtt.get_mqttpath()}/cmd_response/t1")[0])
+    assert document["status"] == "error"
+    assert document["error"].startswith("No response to reset within")
+
+
+def test_library_timeout_covers_every_action_timeout(monkeypatch, mock_websocket):
+    monkeypatch.setattr(cp_module, "OCPP_ACTION_TIMEOUTS", {"get_diagnostics": 120.0})
+    cp = ChargePoint("station-t", mock_websocket)
+
+    assert cp._response_timeout == 120.0
+    assert cp._action_timeouts == {"default": 30, "get_diagnostics": 120.0}
+
+
+@pytest.mark.asyncio
+async def test_expired_deadline_is_not_sent(monkeypatch, charge_point_with_mqtt):
+    """Test a command whose deadline has passed is reported as expired."""
+    handler = AsyncMock()
+    monkeypatch.setattr(mqtt_2_charge_point, "clear_cache", handler)
+    monkeypatch.setattr(charge_point_with_mqtt, "_wait_for_websocket_connection", _ready)
+
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(
+        payload=b'{"action": "clear_cache", "deadline": "2020-01-01T00:00:00Z", "request_id": "d1"}'))
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(
+        payload=b'{"action": "clear_cache", "deadline": "later", "request_id": "d2"}'))
+
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    handler.assert_not_awaited()
+    assert json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/d1")[0])["status"] == "expired"
+    invalid = json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/d2")[0])
+    assert invalid["error"] == "deadline must be a Unix timestamp or an ISO 8601 date"
+
+
+@pytest.mark.asyncio
+async def test_cancel_topic_aborts_in_flight_command(monkeypatch, charge_point_with_mqtt):
+    """Test cmd/cancel stops a running command and reports it as cancelled."""
+    from mqtt_gateway import MqttGateway
+    from aiomqtt.topic import Topic
+
+    gateway = MqttGateway(AsyncMock)
+    monkeypatch.setattr(gateway, "start", lambda: None)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    started = asyncio.Event()
+
+    async def hang(msg):
+        started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", hang)
+    listen_task = asyncio.create_task(charge_point_with_mqtt.mqtt_listen())
+    await asyncio.sleep(0)
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    client = charge_point_with_mqtt.client = AsyncMock()
+    gateway.dispatch(types.SimpleNamespace(topic=Topic(f"{mqtt_path}/cmd"), payload=json.dumps(
+        {"action": "get_diagnostics", "args": VALID_ARGS["get_diagnostics"], "request_id": "c1"}).encode()))
+    await asyncio.wait_for(started.wait(), timeout=1)
+    gateway.dispatch(types.SimpleNamespace(topic=Topic(f"{mqtt_path}/cmd/cancel"), payload=b'{"request_id": "c1"}'))
+    await asyncio.sleep(0.01)
+
+    assert charge_point_with_mqtt._commands.cancelled == 1
+    assert json.loads(_published(client, f"{mqtt_path}/cmd_response/c1")[0])["status"] == "cancelled"
+    charge_point_with_mqtt.shutdown()
+    await asyncio.wait_for(listen_task, timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_calls_are_scheduled_by_priority(monkeypatch, charge_point_with_mqtt):
+    """Test an urgent call overtakes a waiting low-priority call and stats are published."""
+    from ocpp.v16 import call
+
+    release = asyncio.Event()
+    sent = []
+
+    async def fake_call(self, payload, *args, **kwargs):
+        sent.append(type(payload).__name__)
+        if len(sent) == 1:
+            await release.wait()
+
+    monkeypatch.setattr(cp_module.cp, "call", fake_call)
+    first = asyncio.create_task(charge_point_with_mqtt.call(call.ClearCache()))
+    await asyncio.sleep(0)
+    diagnostics = asyncio.create_task(charge_point_with_mqtt.call(call.GetDiagnostics(location="ftp://x/")))
+    await asyncio.sleep(0)
+    unlock = asyncio.create_task(charge_point_with_mqtt.call(call.UnlockConnector(connector_id=1)))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(first, diagnostics, unlock)
+    await charge_point_with_mqtt._commands.join()
+
+    assert sent == ["ClearCache", "UnlockConnector", "GetDiagnostics"]
+    stats = json.loads(_published(charge_point_with_mqtt.client, f"{charge_point_with_mqtt.get_mqttpath()}/call_queue")[0])
+    assert stats["configuration"]["calls"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_publishes_one_aggregated_result(monkeypatch, charge_point_with_mqtt):
+    """Test a batch runs its steps in order and publishes a single result document."""
+    sent = []
+
+    async def fake_handle(msg):
+        sent.append(msg["action"])
+        if msg["action"] == "send_local_list":
+            return call_result.SendLocalList(status="Failed")
+        return call_result.ChangeConfiguration(status="Accepted")
+
+    monkeypatch.setattr(charge_point_with_mqtt, "_handle_mqtt_action", fake_handle)
+    charge_point_with_mqtt._submit_command(None, {"request_id": "p1", "batch": [
+        {"action": "change_configuration", "args": {"key": "A", "value": "1"}},
+        {"action": "send_local_list", "args": {"list_version": 1, "update_type": "Full"}},
+        {"action": "reset", "args": {"type": "Soft"}},
+    ]})
+    await charge_point_with_mqtt._commands.join()
+
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    assert sent == ["change_configuration", "send_local_list"]
+    document = json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/p1")[0])
+    assert document["action"] == "batch"
+    assert [step["status"] for step in document["results"]] == ["Accepted", "Failed", "skipped"]
+    assert json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_result/json")[0]) == document
+    assert _published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_result/status") == ["failed"]
+
+# =============================================================================
+# Tests for the durable command queue
+# =============================================================================
+
+@pytest.mark.asyncio
+async def test_command_for_disconnected_station_is_queued(monkeypatch, tmp_path, charge_point_with_mqtt):
+    """Test a queueable command is kept when the WebSocket does not come back in time."""
+    from command_queue import CommandQueue
+    from mqtt_gateway import MqttGateway
+
+    queue = CommandQueue(str(tmp_path / "commands.json"))
+    gateway = MqttGateway(AsyncMock, command_queue=queue)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    monkeypatch.setattr(cp_module, "OCPP_COMMAND_READY_TIMEOUT", 0.01)
+    monkeypatch.setattr(charge_point_with_mqtt, "_has_active_websocket", lambda: False)
+
+    await _submit(charge_point_with_mqtt, types.SimpleNamespace(
+        payload=b'{"action": "change_configuration", "args": {"key": "A", "value": "1"}, "request_id": "q1"}'))
+
+    assert len(queue) == 1
+    mqtt_path = charge_point_with_mqtt.get_mqttpath()
+    assert _published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_result/status") == ["queued"]
+    assert json.loads(_published(charge_point_with_mqtt.client, f"{mqtt_path}/cmd_response/q1")[0])["status"] == "queued"
+
+
+@pytest.mark.asyncio
+async def test_queued_commands_run_on_reconnect(monkeypatch, tmp_path, charge_point):
+    """Test mqtt_listen delivers the commands queued while the station was offline."""
+    from command_queue import CommandQueue
+    from mqtt_gateway import MqttGateway
+
+    queue = CommandQueue(str(tmp_path / "commands.json"))
+    queue.put(charge_point.get_mqttpath(), {"action": "clear_cache"})
+    gateway = MqttGateway(AsyncMock, command_queue=queue)
+    monkeypatch.setattr(gateway, "start", lambda: None)
+    monkeypatch.setattr(cp_module, "get_mqtt_gateway", lambda: gateway)
+    handled = []
+
+    async def fake_handle(msg):
+        handled.append(msg)
+
+    monkeypatch.setattr(charge_point, "_handle_mqtt_action", fake_handle)
+
+    listen_task = asyncio.create_task(charge_point.mqtt_listen())
+    await asyncio.sleep(0.01)
+    charge_point.shutdown()
+    await asyncio.wait_for(listen_task, timeout=1)
+
+    assert handled == [{"action": "clear_cache"}]
+    assert len(queue) == 0
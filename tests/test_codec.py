@@ -0,0 +1,56 @@
+"""Tests for codec module - pluggable JSON codec."""
+
+import enum
+
+import pytest
+
+import codec
+
+
+@pytest.fixture(autouse=True)
+def restore_codec():
+    previous = codec.name
+    yield
+    codec.select(previous)
+
+
+class Status(str, enum.Enum):
+    accepted = "Accepted"
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_round_trip(name):
+    if codec.select(name) != name:
+        pytest.skip(f"{name} is not installed")
+    document = {"action": "reset", "args": {"type": "Soft"}, "power": 3.5, "ok": True, "none": None}
+
+    encoded = codec.dumps(document)
+
+    assert isinstance(encoded, str)
+    assert " " not in encoded
+    assert codec.loads(encoded) == document
+    assert codec.loads(encoded.encode("utf-8")) == document
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_invalid_payload_raises_value_error(name):
+    if codec.select(name) != name:
+        pytest.skip(f"{name} is not installed")
+    with pytest.raises(ValueError):
+        codec.loads(b"{not json")
+    with pytest.raises(ValueError):
+        codec.loads(b"\xff\xfe")
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_unknown_values_are_encoded_as_str(name):
+    if codec.select(name) != name:
+        pytest.skip(f"{name} is not installed")
+    assert codec.loads(codec.dumps({"status": Status.accepted, "payload": b"ON"})) == {
+        "status": "Accepted", "payload": "b'ON'"}
+
+
+def test_select_falls_back_to_stdlib():
+    assert codec.select("unknown") == "json"
+    assert codec.select("msgspec") in ("msgspec", "json")
+    assert codec.select("auto") in codec.CODECS
@@ -0,0 +1,74 @@
+"""Tests for command_batch module - batched multi-step commands."""
+
+import pytest
+
+from command_batch import MAX_BATCH_STEPS, parse_batch, run_batch, summarize
+from command_validation import CommandValidationError
+
+
+def test_parse_batch_defaults_and_deadline():
+    steps, on_error = parse_batch({"batch": [
+        {"action": "change_configuration", "args": {"key": "A", "value": "1"}},
+        {"action": "reset", "args": {"type": "Soft"}, "deadline": 5},
+    ], "deadline": 10})
+
+    assert on_error == "stop"
+    assert [step["deadline"] for step in steps] == [10, 5]
+
+
+def test_parse_batch_reports_every_invalid_step():
+    with pytest.raises(CommandValidationError) as excinfo:
+        parse_batch({"batch": [
+            {"action": "reset", "args": {"type": "Gentle"}},
+            {"args": {}},
+            {"action": "clear_cache"},
+            {"batch": [], "action": "x"},
+        ]})
+
+    assert [error["path"] for error in excinfo.value.errors] == ["batch.0.type", "batch.1", "batch.3"]
+
+
+@pytest.mark.parametrize("msg", [
+    {"batch": []},
+    {"batch": {"action": "reset"}},
+    {"batch": [{"action": "clear_cache"}] * (MAX_BATCH_STEPS + 1)},
+    {"batch": [{"action": "clear_cache"}], "on_error": "ignore"},
+])
+def test_parse_batch_rejects_invalid_shapes(msg):
+    with pytest.raises(CommandValidationError):
+        parse_batch(msg)
+
+
+def _executor(outcomes):
+    executed = []
+
+    async def execute(step):
+        executed.append(step["action"])
+        return dict(outcomes.get(step["action"], {"status": "Accepted"}))
+
+    return executed, execute
+
+
+@pytest.mark.asyncio
+async def test_stop_on_error_skips_remaining_steps():
+    executed, execute = _executor({"send_local_list": {"status": "Failed"}})
+    steps = [{"action": "change_configuration"}, {"action": "send_local_list"}, {"action": "reset"}]
+
+    results = await run_batch(steps, "stop", execute)
+    summary = summarize(results, 0.1)
+
+    assert executed == ["change_configuration", "send_local_list"]
+    assert results[2] == {"action": "reset", "status": "skipped"}
+    assert (summary["status"], summary["succeeded"], summary["failed"], summary["skipped"]) == ("failed", 1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_continue_runs_every_step():
+    executed, execute = _executor({"send_local_list": {"status": "error", "error": "boom"}})
+    steps = [{"action": "send_local_list"}, {"action": "reset"}]
+
+    summary = summarize(await run_batch(steps, "continue", execute), 0.1)
+
+    assert executed == ["send_local_list", "reset"]
+    assert (summary["succeeded"], summary["failed"], summary["skipped"]) == (1, 1, 0)
+    assert summary["results"][0]["error"] == "boom"
@@ -0,0 +1,164 @@
+"""Tests for command_queue module - durable queue for offline charge points."""
+
+import json
+
+import pytest
+
+from command_queue import CommandQueue, DEFAULT_QUEUED_ACTIONS, load_actions
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_queue(tmp_path, clock=None, **kwargs):
+    return CommandQueue(str(tmp_path / "queue" / "commands.json"), clock=clock or FakeClock(), **kwargs)
+
+
+def test_put_and_take_in_order(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.put("ocpp/cp1", {"action": "change_configuration", "args": {"key": "A", "value": "1"}})
+    queue.put("ocpp/cp1", {"action": "change_configuration", "args": {"key": "B", "value": "2"}})
+
+    entries = queue.take("ocpp/cp1")
+
+    assert [entry["command"]["args"]["key"] for entry in entries] == ["A", "B"]
+    assert len(queue) == 0
+    assert queue.take("ocpp/cp1") == []
+
+
+def test_only_configured_actions_are_accepted(tmp_path):
+    queue = make_queue(tmp_path)
+
+    assert queue.put("ocpp/cp1", {"action": "remote_start_transaction"}) is False
+    assert queue.put("ocpp/cp1", "not a command") is False
+    assert len(queue) == 0
+
+
+def test_queue_survives_restart(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.put("ocpp/cp1", {"action": "set_charging_profile", "args": {}})
+
+    reloaded = make_queue(tmp_path)
+
+    assert len(reloaded) == 1
+    assert reloaded.take("ocpp/cp1")[0]["command"]["action"] == "set_charging_profile"
+
+
+@pytest.mark.asyncio
+async def test_writes_inside_event_loop_are_coalesced_off_the_loop(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path)
+    writes = []
+    write = queue._write
+    monkeypatch.setattr(queue, "_write", lambda data: (writes.append(data), write(data)))
+
+    queue.put("ocpp/cp1", {"action": "clear_cache"})
+    queue.put("ocpp/cp1", {"action": "set_charging_profile", "args": {}})
+    assert writes == []
+
+    await queue.flush()
+
+    assert len(writes) == 1
+    assert len(make_queue(tmp_path)) == 2
+
+
+def test_expired_commands_are_discarded(tmp_path):
+    clock = FakeClock()
+    queue = make_queue(tmp_path, clock=clock, default_ttl=60)
+    queue.put("ocpp/cp1", {"action": "clear_cache"})
+    queue.put("ocpp/cp1", {"action": "clear_cache", "ttl": 600})
+    clock.now += 120
+
+    entries = queue.take("ocpp/cp1")
+
+    assert [entry["command"].get("ttl") for entry in entries] == [600]
+    assert queue.expired == 1
+
+
+def test_requeue_keeps_original_deadline(tmp_path):
+    clock = FakeClock()
+    queue = make_queue(tmp_path, clock=clock)
+
+    assert queue.put("ocpp/cp1", {"action": "clear_cache"}, expires=clock.now - 1) is False
+    queue.put("ocpp/cp1", {"action": "clear_cache"}, expires=clock.now + 5)
+    assert queue.take("ocpp/cp1")[0]["expires"] == clock.now + 5
+
+
+def test_oldest_command_dropped_when_full(tmp_path):
+    queue = make_queue(tmp_path, max_per_station=2)
+    for key in ("A", "B", "C"):
+        queue.put("ocpp/cp1", {"action": "change_configuration", "args": {"key": key}})
+
+    assert [entry["command"]["args"]["key"] for entry in queue.take("ocpp/cp1")] == ["B", "C"]
+    assert queue.dropped == 1
+
+
+def test_stats_report_depth_and_age(tmp_path):
+    clock = FakeClock()
+    queue = make_queue(tmp_path, clock=clock, default_ttl=100)
+    queue.put("ocpp/cp1", {"action": "clear_cache"})
+    clock.now += 30
+    queue.put("ocpp/cp1", {"action": "clear_cache"})
+
+    stats = queue.stats("ocpp/cp1")
+
+    assert stats == {"depth": 2, "oldest_queued_at": 1000.0, "oldest_age": 30.0, "next_expiry": 1100.0}
+    assert queue.stats("ocpp/other")["depth"] == 0
+
+
+def test_corrupt_file_starts_empty(tmp_path, caplog):
+    path = tmp_path / "commands.json"
+    path.write_text("{not json")
+
+    queue = CommandQueue(str(path))
+
+    assert len(queue) == 0
+    assert "Could not read command queue" in caplog.text
+
+
+def test_newer_command_supersedes_queued_one(tmp_path):
+    from command_runner import DEFAULT_COALESCE_RULES
+
+    queue = make_queue(tmp_path, coalesce_rules=DEFAULT_COALESCE_RULES)
+    superseded = []
+    queue.put("ocpp/cp1", {"action": "change_availability", "args": {"connector_id": 1, "type": "Inoperative"}})
+    queue.put("ocpp/cp1", {"action": "change_availability", "args": {"connector_id": 2, "type": "Inoperative"}})
+    queue.put("ocpp/cp1", {"action": "change_availability", "args": {"connector_id": 1, "type": "Operative"}},
+              on_superseded=superseded.append)
+
+    entries = queue.take("ocpp/cp1")
+
+    assert [(e["command"]["args"]["connector_id"], e["command"]["args"]["type"]) for e in entries] == [
+        (2, "Inoperative"), (1, "Operative")]
+    assert [command["args"]["type"] for command in superseded] == ["Inoperative"]
+    assert queue.superseded == 1
+
+
+def test_deadline_shortens_expiry(tmp_path):
+    clock = FakeClock()
+    queue = make_queue(tmp_path, clock=clock)
+
+    assert queue.put("ocpp/cp1", {"action": "clear_cache", "deadline": clock.now + 10}) is True
+    assert queue.put("ocpp/cp1", {"action": "clear_cache", "deadline": clock.now - 1}) is False
+    assert queue.put("ocpp/cp1", {"action": "clear_cache", "deadline": "soon"}) is False
+    assert queue.stats("ocpp/cp1")["next_expiry"] == clock.now + 10
+
+
+def test_remove_by_request_id(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.put("ocpp/cp1", {"action": "clear_cache", "request_id": "a"})
+    queue.put("ocpp/cp1", {"action": "clear_cache", "request_id": "b"})
+
+    assert queue.remove("ocpp/cp1", "a")["request_id"] == "a"
+    assert queue.remove("ocpp/cp1", "a") is None
+    assert [entry["command"]["request_id"] for entry in queue.take("ocpp/cp1")] == ["b"]
+
+
+def test_load_actions():
+    assert load_actions(None) == DEFAULT_QUEUED_ACTIONS
+    assert load_actions(json.dumps(["reset"])) == frozenset({"reset"})
+    assert load_actions("{}") == DEFAULT_QUEUED_ACTIONS
@@ -0,0 +1,231 @@
+"""Tests for command_runner module - concurrent MQTT command execution."""
+
+import asyncio
+
+import pytest
+
+from command_runner import (CommandRunner, coalesce_key, command_deadline, load_coalesce_rules, load_limits,
+                            load_timeouts, DEFAULT_COALESCE_RULES)
+
+
+def test_load_limits_defaults():
+    assert load_limits(None) == {"default": 1}
+
+
+def test_load_limits_overrides_and_ignores_invalid(caplog):
+    limits = load_limits('{"default": 4, "get_diagnostics": 1, "reset": 0, "clear_cache": "x"}')
+
+    assert limits == {"default": 4, "get_diagnostics": 1}
+    assert "MQTT_COMMAND_CONCURRENCY" in caplog.text
+
+
+def test_load_limits_invalid_json(caplog):
+    assert load_limits("not json") == {"default": 1}
+    assert "Invalid MQTT_COMMAND_CONCURRENCY" in caplog.text
+
+
+def test_load_timeouts(caplog):
+    assert load_timeouts(None) == {}
+    assert load_timeouts('{"default": 20, "get_diagnostics": 120, "reset": 0, "x": true}') == {
+        "default": 20.0, "get_diagnostics": 120.0}
+    assert "OCPP_ACTION_TIMEOUTS timeout for 'reset'" in caplog.text
+
+
+def test_command_deadline_formats():
+    assert command_deadline({}) is None
+    assert command_deadline({"deadline": 1767225600}) == 1767225600.0
+    assert command_deadline({"deadline": "2026-01-01T00:00:00Z"}) == 1767225600.0
+    assert command_deadline({"deadline": "2026-01-01T01:00:00+01:00"}) == 1767225600.0
+    assert command_deadline({"deadline": "2026-01-01T00:00:00"}) == 1767225600.0
+    for invalid in ("tomorrow", True, [1]):
+        with pytest.raises(ValueError):
+            command_deadline({"deadline": invalid})
+
+
+def test_load_coalesce_rules_overrides_and_removals(caplog):
+    rules = load_coalesce_rules('{"change_availability": null, "reset": [], "clear_cache": "x"}')
+
+    assert "change_availability" not in rules
+    assert rules["reset"] == ()
+    assert rules["change_configuration"] == DEFAULT_COALESCE_RULES["change_configuration"]
+    assert "clear_cache" not in rules
+    assert "MQTT_COMMAND_COALESCE rule for 'clear_cache'" in caplog.text
+
+
+def test_coalesce_key_uses_nested_arguments():
+    profile = {"charging_profile_purpose": "TxDefaultProfile", "stack_level": 0, "charging_schedule": {}}
+    first = {"action": "set_charging_profile", "args": {"connector_id": 1, "cs_charging_profiles": profile}}
+    second = {"action": "set_charging_profile", "args": {"connector_id": 1, "cs_charging_profiles": dict(profile, stack_level=1)}}
+
+    assert coalesce_key(first, DEFAULT_COALESCE_RULES) == coalesce_key(dict(first), DEFAULT_COALESCE_RULES)
+    assert coalesce_key(first, DEFAULT_COALESCE_RULES) != coalesce_key(second, DEFAULT_COALESCE_RULES)
+    assert coalesce_key({"action": "clear_cache"}, DEFAULT_COALESCE_RULES) is None
+
+
+@pytest.mark.asyncio
+async def test_slow_action_does_not_block_other_actions():
+    runner = CommandRunner()
+    release = asyncio.Event()
+    finished = []
+
+    async def slow():
+        await release.wait()
+        finished.append("get_diagnostics")
+
+    async def fast():
+        finished.append("remote_stop_transaction")
+
+    runner.submit("get_diagnostics", slow())
+    await runner.submit("remote_stop_transaction", fast())
+
+    assert finished == ["remote_stop_transaction"]
+    release.set()
+    await runner.join()
+    assert finished == ["remote_stop_transaction", "get_diagnostics"]
+
+
+@pytest.mark.asyncio
+async def test_same_action_runs_in_order_with_limit_one():
+    runner = CommandRunner()
+    events = []
+
+    async def command(name):
+        events.append(f"start {name}")
+        await asyncio.sleep(0)
+        events.append(f"end {name}")
+
+    for name in ("a", "b", "c"):
+        runner.submit("reset", command(name))
+    await runner.join()
+
+    assert events == ["start a", "end a", "start b", "end b", "start c", "end c"]
+
+
+@pytest.mark.asyncio
+async def test_action_limit_allows_parallel_commands():
+    runner = CommandRunner({"default": 1, "get_configuration": 2})
+    running = []
+    release = asyncio.Event()
+
+    async def command(name):
+        running.append(name)
+        await release.wait()
+
+    for name in ("a", "b", "c"):
+        runner.submit("get_configuration", command(name))
+    await asyncio.sleep(0.01)
+
+    assert running == ["a", "b"]
+    release.set()
+    await runner.join()
+    assert runner.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_failures_are_logged_not_raised(caplog):
+    runner = CommandRunner()
+
+    async def broken():
+        raise ValueError("boom")
+
+    runner.submit("reset", broken())
+    await runner.join()
+
+    assert "MQTT command task failed (ValueError): boom" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_running_commands():
+    runner = CommandRunner()
+    started = asyncio.Event()
+
+    async def hang():
+        started.set()
+        await asyncio.Event().wait()
+
+    task = runner.submit("get_diagnostics", hang())
+    runner.submit("get_diagnostics", hang())
+    await started.wait()
+    await runner.close()
+
+    assert task.cancelled()
+    assert runner.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_newer_command_supersedes_waiting_one():
+    runner = CommandRunner()
+    release = asyncio.Event()
+    ran = []
+    superseded = []
+
+    async def command(name):
+        if name == "first":
+            await release.wait()
+        ran.append(name)
+
+    runner.submit("change_availability", command("first"), key="k")
+    await asyncio.sleep(0)
+    # "first" is running and can no longer be replaced; "second" waits behind it
+    runner.submit("change_availability", command("second"), key="k", on_superseded=lambda: superseded.append("second"))
+    runner.submit("change_availability", command("third"), key="k")
+    release.set()
+    await runner.join()
+
+    assert ran == ["first", "third"]
+    assert superseded == ["second"]
+    assert runner.superseded == 1
+
+
+@pytest.mark.asyncio
+async def test_commands_with_other_keys_are_not_superseded():
+    runner = CommandRunner()
+    ran = []
+
+    async def command(name):
+        ran.append(name)
+
+    runner.submit("change_configuration", command("a"), key="a")
+    runner.submit("change_configuration", command("b"), key="b")
+    await runner.join()
+
+    assert ran == ["a", "b"]
+    assert runner.superseded == 0
+
+
+@pytest.mark.asyncio
+async def test_cancel_by_request_id():
+    runner = CommandRunner()
+    started = asyncio.Event()
+    cancelled = []
+
+    async def hang():
+        started.set()
+        await asyncio.Event().wait()
+
+    running = runner.submit("reset", hang(), request_id="r1", on_cancelled=lambda: cancelled.append("r1"))
+    waiting = runner.submit("reset", hang(), request_id="r2", on_cancelled=lambda: cancelled.append("r2"))
+    await started.wait()
+
+    assert runner.cancel("r2") is True
+    assert runner.cancel("r1") is True
+    assert runner.cancel("r1") is False
+    assert runner.cancel("unknown") is False
+    await runner.join()
+
+    assert running.cancelled() and waiting.cancelled()
+    assert cancelled == ["r2", "r1"]
+    assert runner.cancelled == 2
+
+
+@pytest.mark.asyncio
+async def test_finished_command_can_no_longer_be_cancelled():
+    runner = CommandRunner()
+
+    async def quick():
+        return "done"
+
+    runner.submit("reset", quick(), request_id="r1")
+    await runner.join()
+
+    assert runner.cancel("r1") is False
@@ -0,0 +1,43 @@
+"""Tests for command_validation module - local OCPP schema checks."""
+
+import pytest
+
+import mqtt_2_charge_point
+from command_validation import CommandValidationError, validate_command, validator_for
+
+
+def test_valid_commands_pass():
+    validate_command("clear_cache", None)
+    validate_command("change_availability", {"connector_id": 1, "type": "Inoperative"})
+    validate_command("set_charging_profile", {"connector_id": 1, "cs_charging_profiles": {
+        "charging_profile_id": 1, "stack_level": 0, "charging_profile_purpose": "TxDefaultProfile",
+        "charging_profile_kind": "Absolute",
+        "charging_schedule": {"charging_rate_unit": "A", "charging_schedule_period": [{"start_period": 0, "limit": 16}]}}})
+
+
+def test_actions_without_request_are_not_checked():
+    validate_command("charging_enabled", "ON")
+    validate_command("does_not_exist", {"anything": 1})
+
+
+def test_schema_errors_are_structured():
+    with pytest.raises(CommandValidationError) as excinfo:
+        validate_command("change_availability", {"connector_id": "one", "type": "Sideways"})
+
+    assert [error["path"] for error in excinfo.value.errors] == ["connectorId", "type"]
+    assert "Sideways" in excinfo.value.errors[1]["message"]
+
+
+def test_unknown_and_missing_arguments():
+    with pytest.raises(CommandValidationError) as excinfo:
+        validate_command("reset", {"kind": "Soft"})
+    assert "unexpected keyword argument 'kind'" in excinfo.value.errors[0]["message"]
+
+    with pytest.raises(CommandValidationError) as excinfo:
+        validate_command("reset", [])
+    assert excinfo.value.errors == [{"path": "", "message": "args must be a JSON object"}]
+
+
+def test_validators_are_cached_for_every_request():
+    for action in mqtt_2_charge_point.REQUESTS:
+        assert validator_for(action) is validator_for(action)
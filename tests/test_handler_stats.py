@@ -0,0 +1,21 @@
+"""Tests for handler_stats module - OCPP handler latencies."""
+
+from handler_stats import HandlerLatency
+
+
+def test_handler_latency_stats():
+    latency = HandlerLatency()
+    latency.record("Authorize", 0.002, 0.050)
+    latency.record("Authorize", 0.004, 0.010)
+    latency.record("Heartbeat", 0.001, 0.001)
+
+    assert latency.stats() == {
+        "Authorize": {"count": 2, "response_avg_ms": 3.0, "response_max_ms": 4.0,
+                      "mqtt_avg_ms": 30.0, "mqtt_max_ms": 50.0},
+        "Heartbeat": {"count": 1, "response_avg_ms": 1.0, "response_max_ms": 1.0,
+                      "mqtt_avg_ms": 1.0, "mqtt_max_ms": 1.0},
+    }
+
+
+def test_handler_latency_empty():
+    assert HandlerLatency().stats() == {}
@@ -0,0 +1,66 @@
+"""Tests for heartbeat_policy module - configured and adaptive heartbeat intervals."""
+
+from heartbeat_policy import HeartbeatPolicy, interval_for, load_intervals
+
+
+def test_load_intervals():
+    assert load_intervals(None) == {}
+    assert load_intervals('{"cp1": 60, "site1-*": 300}') == {'cp1': 60, 'site1-*': 300}
+
+
+def test_load_intervals_invalid():
+    assert load_intervals('not json') == {}
+    assert load_intervals('[60]') == {}
+    assert load_intervals('{"cp1": 0, "cp2": "60", "cp3": true, "cp4": 30}') == {'cp4': 30}
+
+
+def test_interval_for():
+    intervals = {'site1-*': 300, 'site1-cp7': 60, '*': 120}
+    assert interval_for('site1-cp7', 10, intervals) == 60
+    assert interval_for('site1-cp1', 10, intervals) == 300
+    assert interval_for('other', 10, intervals) == 120
+    assert interval_for('other', 10, {}) == 10
+
+
+def _heartbeat(policy, messages=0):
+    for _ in range(messages):
+        policy.observe()
+    return policy.on_heartbeat()
+
+
+def test_push_base_interval_when_not_booted():
+    policy = HeartbeatPolicy(30)
+    assert _heartbeat(policy) == 30
+    # Nothing else is pushed while waiting for the answer
+    assert _heartbeat(policy) is None
+    policy.settle(30, 'Accepted')
+    assert _heartbeat(policy, messages=5) is None
+
+
+def test_booted_station_is_not_pushed():
+    policy = HeartbeatPolicy(30)
+    assert policy.booted() == 30
+    assert _heartbeat(policy, messages=3) is None
+
+
+def test_adaptive_interval_doubles_with_traffic_and_resets():
+    policy = HeartbeatPolicy(10, max_interval=60)
+    policy.booted()
+    assert _heartbeat(policy, messages=1) == 20
+    policy.settle(20, 'Accepted')
+    assert _heartbeat(policy, messages=1) == 40
+    policy.settle(40, 'Accepted')
+    assert _heartbeat(policy, messages=1) == 60
+    policy.settle(60, 'Accepted')
+    assert _heartbeat(policy, messages=1) is None
+    assert _heartbeat(policy) == 10
+
+
+def test_failed_push_is_retried_and_rejection_stops_pushes():
+    policy = HeartbeatPolicy(10)
+    assert _heartbeat(policy) == 10
+    policy.settle(10, None)
+    assert _heartbeat(policy) == 10
+    policy.settle(10, 'NotSupported')
+    assert _heartbeat(policy) is None
+    assert policy.interval is None
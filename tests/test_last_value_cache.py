@@ -0,0 +1,90 @@
+"""Tests for last_value_cache module - redundant publish suppression."""
+
+from last_value_cache import LastValueCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_unknown_topic_is_not_current():
+    cache = LastValueCache()
+    assert cache.is_current("state/heartbeat", "ON") is False
+
+
+def test_same_payload_is_current():
+    cache = LastValueCache()
+    cache.remember("state/heartbeat", "ON")
+
+    assert cache.is_current("state/heartbeat", "ON") is True
+    assert cache.suppressed == 1
+
+
+def test_changed_payload_is_not_current():
+    cache = LastValueCache()
+    cache.remember("state/status", "Available")
+
+    assert cache.is_current("state/status", "Charging") is False
+
+
+def test_payload_type_is_compared():
+    cache = LastValueCache()
+    cache.remember("state/power_active_import", 0)
+
+    assert cache.is_current("state/power_active_import", "0") is False
+    assert cache.is_current("state/power_active_import", 0) is True
+
+
+def test_forced_refresh_after_interval():
+    clock = FakeClock()
+    cache = LastValueCache(refresh_interval=60, clock=clock)
+    cache.remember("state/heartbeat", "ON")
+
+    clock.now = 59
+    assert cache.is_current("state/heartbeat", "ON") is True
+    clock.now = 60
+    assert cache.is_current("state/heartbeat", "ON") is False
+
+
+def test_zero_refresh_interval_never_expires():
+    clock = FakeClock()
+    cache = LastValueCache(refresh_interval=0, clock=clock)
+    cache.remember("state/heartbeat", "ON")
+
+    clock.now = 10 ** 6
+    assert cache.is_current("state/heartbeat", "ON") is True
+
+
+def test_memory_cap_evicts_least_recently_used():
+    cache = LastValueCache(max_entries=2)
+    cache.remember("a", 1)
+    cache.remember("b", 2)
+    assert cache.is_current("a", 1)  # touch a, b becomes oldest
+    cache.remember("c", 3)
+
+    assert len(cache) == 2
+    assert cache.is_current("a", 1) is True
+    assert cache.is_current("b", 2) is False
+    assert cache.is_current("c", 3) is True
+
+
+def test_clear():
+    cache = LastValueCache()
+    cache.remember("a", 1)
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.is_current("a", 1) is False
+
+
+def test_forget_drops_entry():
+    cache = LastValueCache()
+    cache.remember("state/status", "Available")
+    cache.forget("state/status")
+    cache.forget("state/unknown")
+
+    assert cache.is_current("state/status", "Available") is False
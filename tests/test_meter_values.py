@@ -0,0 +1,59 @@
+"""Tests for meter_values module - MeterValues to MQTT state values."""
+
+from meter_values import TELEMETRY_KEYS, normalize_value, state_key, state_values
+
+
+def test_state_key_table():
+    assert state_key("Power.Active.Import") == "power_active_import"
+    assert state_key("Voltage", "L1-N") == "voltage_l1_n"
+    assert state_key("Current.Import", "L2") == "current_import_l2"
+    assert state_key("Vendor.Specific", "L3") == "vendor_specific_l3"
+    assert "voltage_l1_n" in TELEMETRY_KEYS
+
+
+def test_normalize_value():
+    assert normalize_value("3.5", "kW") == "3500"
+    assert normalize_value("12.3456", "kWh") == "12345.6"
+    assert normalize_value("230.1", "V") == "230.1"
+    assert normalize_value("1000", None) == "1000"
+    assert normalize_value("n/a", "kW") == "n/a"
+
+
+def test_state_values_processes_every_entry_and_phase():
+    values = state_values([
+        {"timestamp": "2026-01-27T10:00:00Z", "sampled_value": [
+            {"measurand": "Energy.Active.Import.Register", "value": "1.5", "unit": "kWh"},
+            {"measurand": "Current.Import", "phase": "L1", "value": "16.1", "unit": "A"},
+            {"measurand": "Current.Import", "phase": "L2", "value": "15.9", "unit": "A"},
+        ]},
+        {"timestamp": "2026-01-27T10:01:00Z", "sampled_value": [
+            {"value": "1600", "context": "Sample.Periodic"},
+            {"measurand": "Power.Active.Import", "value": "7.4", "unit": "kW"},
+            {"measurand": "Power.Active.Import", "value": "abc", "format": "SignedData"},
+        ]},
+    ])
+
+    assert values == {
+        "energy_active_import_register": "1600",
+        "current_import": "15.9",
+        "current_import_l1": "16.1",
+        "current_import_l2": "15.9",
+        "power_active_import": "7400",
+        "meter_timestamp": "2026-01-27T10:01:00Z",
+        "meter_context": "Sample.Periodic",
+    }
+
+
+def test_unphased_reading_wins_over_phases():
+    values = state_values([{"sampled_value": [
+        {"measurand": "Voltage", "phase": "L1-N", "value": "231"},
+        {"measurand": "Voltage", "value": "230"},
+        {"measurand": "Voltage", "phase": "L2-N", "value": "229"},
+    ]}])
+
+    assert values == {"voltage": "230", "voltage_l1_n": "231", "voltage_l2_n": "229"}
+
+
+def test_state_values_empty():
+    assert state_values(None) == {}
+    assert state_values([{"sampled_value": []}]) == {}
@@ -0,0 +1,603 @@
+"""Tests for mqtt_gateway module - shared MQTT connection and routing."""
+
+import asyncio
+import json
+import types
+
+import pytest
+from aiomqtt import MqttError
+from aiomqtt.topic import Topic
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from mqtt_gateway import MqttGateway, request_id_error, response_target, station_path
+
+
+class FakeSession:
+    def __init__(self, id):
+        self.id = id
+        self.client = None
+
+
+class FakeClient:
+    """Async context manager mimicking aiomqtt.Client."""
+
+    def __init__(self, incoming=None):
+        self.subscribed = []
+        self.unsubscribed = []
+        self.published = []
+        self._incoming = incoming or []
+        self.released = asyncio.Event()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def subscribe(self, topic):
+        if isinstance(topic, list):
+            self.subscribed.extend(topic_filter for topic_filter, qos in topic)
+        else:
+            self.subscribed.append(topic)
+
+    async def unsubscribe(self, topic):
+        self.unsubscribed.append(topic)
+
+    async def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.published.append((topic, payload, retain))
+
+    @property
+    def messages(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for message in self._incoming:
+            yield message
+        await self.released.wait()
+        raise MqttError("connection closed")
+
+
+def make_message(topic, payload=b"{}"):
+    return types.SimpleNamespace(topic=Topic(topic), payload=payload)
+
+
+def test_station_path():
+    assert station_path("ocpp/cp1/cmd") == "ocpp/cp1"
+    assert station_path("ocpp/cp1/cmd/sub") == "ocpp/cp1"
+    assert station_path("ocpp/cmdx/cmd") == "ocpp/cmdx"
+    assert station_path("ocpp/cp1/state") is None
+
+
+def test_dispatch_routes_matching_topics():
+    gateway = MqttGateway(FakeClient)
+    session_a = FakeSession("a")
+    session_b = FakeSession("b")
+    route_a = gateway.register(session_a, "ocpp/a")
+    route_b = gateway.register(session_b, "ocpp/b")
+
+    assert gateway.dispatch(make_message("ocpp/a/cmd")) is True
+
+    assert route_a.messages.qsize() == 1
+    assert route_b.messages.qsize() == 0
+
+
+def test_dispatch_shared_filter_reaches_all_sessions():
+    """Without station names every session shares the same command topic."""
+    gateway = MqttGateway(FakeClient)
+    routes = [gateway.register(FakeSession(i), "ocpp/test") for i in range(3)]
+
+    gateway.dispatch(make_message("ocpp/test/cmd"))
+
+    assert all(route.messages.qsize() == 1 for route in routes)
+    assert gateway._subscriptions == {"ocpp/test/cmd/#": 3}
+
+
+def test_dispatch_without_route():
+    gateway = MqttGateway(FakeClient)
+    assert gateway.dispatch(make_message("ocpp/unknown/cmd")) is False
+
+
+@pytest.mark.asyncio
+async def test_run_subscribes_and_attaches_client():
+    client = FakeClient(incoming=[make_message("ocpp/a/cmd")])
+    gateway = MqttGateway(lambda: client, reconnect_base_delay=0.01)
+    session = FakeSession("a")
+    route = gateway.register(session, "ocpp/a")
+
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+    message = await asyncio.wait_for(route.messages.get(), timeout=1)
+
+    assert str(message.topic) == "ocpp/a/cmd"
+    assert client.subscribed == ["ocpp/a/cmd/#"]
+    assert session.client is client
+    assert gateway.is_connected()
+
+    await gateway.stop()
+    assert session.client is None
+
+
+@pytest.mark.asyncio
+async def test_register_while_connected_subscribes_once():
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client)
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    session = FakeSession("late")
+    route = gateway.register(session, "ocpp/late")
+    await asyncio.sleep(0)
+
+    assert session.client is client
+    assert client.subscribed == ["ocpp/late/cmd/#"]
+
+    gateway.unregister(route)
+    await asyncio.sleep(0)
+
+    assert session.client is None
+    assert client.unsubscribed == ["ocpp/late/cmd/#"]
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_publish_requires_connection():
+    gateway = MqttGateway(FakeClient)
+    with pytest.raises(MqttError):
+        await gateway.publish("topic", "payload")
+
+
+@pytest.mark.asyncio
+async def test_reconnects_after_connection_loss():
+    clients = []
+
+    def factory():
+        client = FakeClient()
+        clients.append(client)
+        return client
+
+    gateway = MqttGateway(factory, reconnect_base_delay=0.01)
+    gateway.register(FakeSession("a"), "ocpp/a")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    clients[0].released.set()
+    for _ in range(100):
+        if len(clients) > 1 and gateway.client is clients[1]:
+            break
+        await asyncio.sleep(0.01)
+
+    assert gateway.client is clients[1]
+    assert clients[1].subscribed == ["ocpp/a/cmd/#"]
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_route_close_wakes_consumer():
+    gateway = MqttGateway(FakeClient)
+    route = gateway.register(FakeSession("a"), "ocpp/a")
+    route.close()
+    assert await route.messages.get() is None
+
+
+@pytest.mark.asyncio
+async def test_spool_is_replayed_before_sessions_attach(tmp_path):
+    from offline_spool import OfflineSpool
+
+    spool = OfflineSpool(str(tmp_path / "spool.jsonl"))
+    spool.append("ocpp/a/state/meter_stop", 1000)
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, spool=spool)
+    session = FakeSession("a")
+    gateway.register(session, "ocpp/a")
+
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    assert client.published == [("ocpp/a/state/meter_stop", 1000, True)]
+    assert len(spool) == 0
+    assert session.client is client
+    await gateway.stop()
+    assert spool._file.closed
+
+
+@pytest.mark.asyncio
+async def test_wildcard_subscription_covers_stations():
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#")
+    gateway.register(FakeSession("a"), "ocpp/a")
+    gateway.register(FakeSession("b"), "ocpp/b")
+
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    assert client.subscribed == ["ocpp/+/cmd/#"]
+    assert gateway._subscriptions == {}
+    await gateway.stop()
+
+
+def test_paths_outside_wildcard_get_own_subscription():
+    gateway = MqttGateway(FakeClient, command_wildcard="ocpp/+/cmd/#")
+    gateway.register(FakeSession("a"), "other/a")
+
+    assert gateway._subscriptions == {"other/a/cmd/#": 1}
+
+
+def test_unrouted_reject_drops_command(caplog):
+    gateway = MqttGateway(FakeClient, command_wildcard="ocpp/+/cmd/#")
+
+    assert gateway.dispatch(make_message("ocpp/offline/cmd")) is False
+    assert "charge point not connected" in caplog.text
+    assert gateway._unrouted == {}
+
+
+def test_unrouted_queue_delivers_on_register():
+    gateway = MqttGateway(FakeClient, command_wildcard="ocpp/+/cmd/#",
+                          unrouted_policy="queue", unrouted_queue_size=2)
+    for i in range(3):
+        gateway.dispatch(make_message("ocpp/late/cmd", payload=str(i).encode()))
+
+    route = gateway.register(FakeSession("late"), "ocpp/late")
+
+    assert [route.messages.get_nowait().payload for _ in range(route.messages.qsize())] == [b"1", b"2"]
+
+
+def test_unrouted_queue_drops_expired_commands(monkeypatch):
+    import mqtt_gateway
+    now = [100.0]
+    monkeypatch.setattr(mqtt_gateway.time, "monotonic", lambda: now[0])
+    gateway = MqttGateway(FakeClient, command_wildcard="ocpp/+/cmd/#",
+                          unrouted_policy="queue", unrouted_queue_ttl=10)
+    gateway.dispatch(make_message("ocpp/late/cmd"))
+    now[0] += 11
+
+    route = gateway.register(FakeSession("late"), "ocpp/late")
+
+    assert route.messages.qsize() == 0
+
+
+@pytest.mark.asyncio
+async def test_unrouted_error_publishes_result():
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#", unrouted_policy="error")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    gateway.dispatch(make_message("ocpp/offline/cmd", payload=b'{"action": "reset"}'))
+    await asyncio.sleep(0.01)
+
+    assert ("ocpp/offline/cmd_result/status", "error", True) in client.published
+    assert ("ocpp/offline/cmd_result/action", "reset", True) in client.published
+    await gateway.stop()
+
+
+def make_v5_message(topic, payload=b"{}", **values):
+    properties = Properties(PacketTypes.PUBLISH)
+    for name, value in values.items():
+        setattr(properties, name, value)
+    return types.SimpleNamespace(topic=Topic(topic), payload=payload, properties=properties)
+
+
+def test_unrouted_queue_honours_message_expiry(monkeypatch):
+    import mqtt_gateway
+    now = [100.0]
+    monkeypatch.setattr(mqtt_gateway.time, "monotonic", lambda: now[0])
+    gateway = MqttGateway(FakeClient, command_wildcard="ocpp/+/cmd/#",
+                          unrouted_policy="queue", unrouted_queue_ttl=300)
+    gateway.dispatch(make_v5_message("ocpp/late/cmd", MessageExpiryInterval=5))
+    gateway.dispatch(make_message("ocpp/late/cmd"))
+    now[0] += 6
+
+    route = gateway.register(FakeSession("late"), "ocpp/late")
+
+    assert route.messages.qsize() == 1
+
+
+@pytest.mark.asyncio
+async def test_unrouted_error_answers_response_topic():
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#", unrouted_policy="error")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    gateway.dispatch(make_v5_message("ocpp/offline/cmd", payload=b'{"action": "reset"}',
+                                     ResponseTopic="app/replies", CorrelationData=b"42"))
+    await asyncio.sleep(0.01)
+
+    replies = [payload for topic, payload, retain in client.published if topic == "app/replies"]
+    assert json.loads(replies[0]) == {"status": "error", "action": "reset", "error": "Charge point not connected"}
+    await gateway.stop()
+
+
+def test_response_target_echoes_correlation_data():
+    message = make_v5_message("ocpp/a/cmd", ResponseTopic="app/replies", CorrelationData=b"42")
+
+    topic, properties = response_target(message)
+
+    assert topic == "app/replies"
+    assert properties.CorrelationData == b"42"
+    assert response_target(make_message("ocpp/a/cmd")) is None
+
+
+@pytest.mark.asyncio
+async def test_topic_aliases_are_per_connection():
+    clients = []
+
+    def factory():
+        client = FakeClient()
+        clients.append(client)
+        return client
+
+    gateway = MqttGateway(factory, reconnect_base_delay=0.01, topic_alias_maximum=4)
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+    first = gateway.topic_aliases
+    for _ in range(3):
+        await gateway.publish("ocpp/a/state/voltage", "230")
+    assert [topic for topic, _, _ in clients[0].published] == ["ocpp/a/state/voltage", "ocpp/a/state/voltage", ""]
+
+    clients[0].released.set()
+    for _ in range(100):
+        if len(clients) > 1 and gateway.client is clients[1]:
+            break
+        await asyncio.sleep(0.01)
+
+    assert gateway.topic_aliases is not first
+    assert len(gateway.topic_aliases) == 0
+    assert gateway.publish_arguments(clients[0], "ocpp/a/state/voltage") == ("ocpp/a/state/voltage", None)
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_subscribes_all_filters_in_one_request():
+    client = FakeClient()
+    calls = []
+    original = client.subscribe
+
+    async def subscribe(topic):
+        calls.append(topic)
+        await original(topic)
+
+    client.subscribe = subscribe
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#")
+    gateway.register(FakeSession("x"), "other/x")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    assert calls == [[("ocpp/+/cmd/#", 0), ("other/x/cmd/#", 0)]]
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_state_reports_failures():
+    attempts = []
+
+    class FailingClient(FakeClient):
+        async def __aenter__(self):
+            if len(attempts) < 3:
+                raise MqttError("connection refused")
+            return self
+
+    def factory():
+        attempts.append(1)
+        return FailingClient()
+
+    gateway = MqttGateway(factory, reconnect_base_delay=0.001, reconnect_max_delay=0.002)
+    gateway.register(FakeSession("a"), "ocpp/a")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    state = gateway.reconnect_state()
+    assert state['state'] == 'connected'
+    assert state['failures'] == 2
+    assert state['stations'] == 1
+    assert state['last_error'] == "MqttError: connection refused"
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_state_is_published_on_connect():
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, status_topic="ocpp/gateway_status")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+    await asyncio.sleep(0)
+
+    published = [(payload, retain) for topic, payload, retain in client.published if topic == "ocpp/gateway_status"]
+    assert len(published) == 1
+    assert published[0][1] is True
+    assert json.loads(published[0][0])["state"] == "connected"
+    await gateway.stop()
+
+
+@pytest.mark.parametrize("request_id,valid", [
+    ("abc-1", True),
+    (42, True),
+    ("", False),
+    ("a/b", False),
+    ("a+", False),
+    (True, False),
+    ({"id": 1}, False),
+    ("x" * 129, False),
+])
+def test_request_id_error(request_id, valid):
+    assert (request_id_error(request_id) is None) is valid
+
+
+@pytest.mark.asyncio
+async def test_unrouted_error_answers_request_topic():
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#", unrouted_policy="error")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    gateway.dispatch(make_message("ocpp/offline/cmd", payload=b'{"action": "reset", "request_id": "r-9"}'))
+    await asyncio.sleep(0.01)
+
+    replies = [(payload, retain) for topic, payload, retain in client.published if topic == "ocpp/offline/cmd_response/r-9"]
+    assert len(replies) == 1
+    assert json.loads(replies[0][0])["request_id"] == "r-9"
+    assert replies[0][1] is False
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_unrouted_command_goes_to_durable_queue(tmp_path):
+    from command_queue import CommandQueue
+
+    queue = CommandQueue(str(tmp_path / "commands.json"))
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#", command_queue=queue)
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    gateway.dispatch(make_message("ocpp/offline/cmd", payload=b'{"action": "clear_cache"}'))
+    gateway.dispatch(make_message("ocpp/offline/cmd", payload=b'{"action": "remote_start_transaction"}'))
+    await asyncio.sleep(0.01)
+
+    assert len(queue) == 1
+    assert ("ocpp/offline/cmd_result/status", "queued", True) in client.published
+    states = [json.loads(payload) for topic, payload, _ in client.published if topic == "ocpp/offline/cmd_queue"]
+    assert states[-1]["depth"] == 1
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_unrouted_command_supersedes_queued_one(tmp_path):
+    from command_queue import CommandQueue
+    from command_runner import DEFAULT_COALESCE_RULES
+
+    queue = CommandQueue(str(tmp_path / "commands.json"), coalesce_rules=DEFAULT_COALESCE_RULES)
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#", command_queue=queue)
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    for request_id, value in (("c1", "60"), ("c2", "30")):
+        gateway.dispatch(make_message("ocpp/offline/cmd", payload=json.dumps({
+            "action": "change_configuration", "request_id": request_id,
+            "args": {"key": "HeartbeatInterval", "value": value}}).encode()))
+    await asyncio.sleep(0.01)
+
+    assert [entry["command"]["request_id"] for entry in queue.take("ocpp/offline")] == ["c2"]
+    results = [json.loads(payload) for topic, payload, _ in client.published if topic == "ocpp/offline/cmd_response/c1"]
+    assert results[-1]["status"] == "superseded"
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_invalid_unrouted_command_is_rejected_before_queueing(tmp_path):
+    from command_queue import CommandQueue
+    from command_runner import DEFAULT_COALESCE_RULES
+
+    queue = CommandQueue(str(tmp_path / "commands.json"), coalesce_rules=DEFAULT_COALESCE_RULES)
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#", command_queue=queue)
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    for request_id, args in (("a1", {"connector_id": 1, "type": "Inoperative"}),
+                             ("a2", {"connector_id": 1, "type": "Bogus", "unknown": 1})):
+        gateway.dispatch(make_message("ocpp/offline/cmd", payload=json.dumps({
+            "action": "change_availability", "request_id": request_id, "args": args}).encode()))
+    await asyncio.sleep(0.01)
+
+    assert [entry["command"]["request_id"] for entry in queue.take("ocpp/offline")] == ["a1"]
+    rejected = [json.loads(payload) for topic, payload, _ in client.published if topic == "ocpp/offline/cmd_response/a2"]
+    assert rejected[-1]["status"] == "error"
+    assert rejected[-1]["error"] == "Invalid arguments"
+    errors = [payload for topic, payload, _ in client.published if topic == "ocpp/offline/cmd_result/errors"]
+    assert json.loads(errors[-1]) == rejected[-1]["errors"]
+    await gateway.stop()
+
+
+class BroadcastSession(FakeSession):
+    async def execute_command(self, msg):
+        return {"status": "Accepted"}
+
+
+@pytest.mark.asyncio
+async def test_broadcast_runs_on_selected_stations():
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, broadcast_path="ocpp/_broadcast")
+    gateway.register(BroadcastSession("site1-a"), "ocpp/site1-a")
+    gateway.register(BroadcastSession("site2-a"), "ocpp/site2-a")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+    assert "ocpp/_broadcast/cmd" in client.subscribed
+
+    assert gateway.dispatch(make_message("ocpp/_broadcast/cmd", payload=json.dumps({
+        "action": "clear_cache", "stations": ["site1-a", "site1-b"], "request_id": "b1"}).encode())) is True
+    await asyncio.sleep(0.01)
+
+    documents = [json.loads(payload) for topic, payload, _ in client.published
+                 if topic == "ocpp/_broadcast/cmd_result/json"]
+    assert documents[-1]["request_id"] == "b1"
+    assert documents[-1]["statuses"] == {"Accepted": 1, "not_connected": 1}
+    assert set(documents[-1]["results"]) == {"site1-a", "site1-b"}
+    assert any(topic == "ocpp/_broadcast/cmd_response/b1" for topic, _, _ in client.published)
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_rejects_invalid_selector():
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#", broadcast_path="ocpp/_broadcast")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+    # Covered by the wildcard, no separate subscription
+    assert client.subscribed == ["ocpp/+/cmd/#"]
+
+    gateway.dispatch(make_message("ocpp/_broadcast/cmd", payload=b'{"action": "reset", "stations": 5}'))
+    await asyncio.sleep(0.01)
+
+    document = json.loads(client.published[-1][1])
+    assert document["status"] == "error"
+    assert "stations" in document["error"]
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_cancel_removes_durably_queued_command(tmp_path):
+    from command_queue import CommandQueue
+
+    queue = CommandQueue(str(tmp_path / "commands.json"))
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, command_wildcard="ocpp/+/cmd/#", command_queue=queue)
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    gateway.dispatch(make_message("ocpp/offline/cmd", payload=b'{"action": "clear_cache", "request_id": "q1"}'))
+    gateway.dispatch(make_message("ocpp/offline/cmd/cancel", payload=b'{"request_id": "q1"}'))
+    await asyncio.sleep(0.01)
+
+    assert len(queue) == 0
+    results = [json.loads(payload) for topic, payload, _ in client.published if topic == "ocpp/offline/cmd_response/q1"]
+    assert [result["status"] for result in results] == ["queued", "cancelled"]
+    await gateway.stop()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_accepts_batches():
+    client = FakeClient()
+    gateway = MqttGateway(lambda: client, broadcast_path="ocpp/_broadcast")
+    session = BroadcastSession("cp1")
+    commands = []
+
+    async def execute_command(msg):
+        commands.append(msg)
+        return {"action": "batch", "status": "completed"}
+
+    session.execute_command = execute_command
+    gateway.register(session, "ocpp/cp1")
+    gateway.start()
+    assert await gateway.wait_connected(timeout=1)
+
+    gateway.dispatch(make_message("ocpp/_broadcast/cmd", payload=b'{"batch": [{"action": "clear_cache"}]}'))
+    await asyncio.sleep(0.01)
+
+    assert commands == [{"action": "batch", "batch": [{"action": "clear_cache"}]}]
+    document = json.loads(client.published[-1][1])
+    assert document["action"] == "batch"
+    assert document["statuses"] == {"completed": 1}
+    await gateway.stop()
@@ -0,0 +1,129 @@
+"""Tests for offline_spool module - disk-backed MQTT publish spool."""
+
+import os
+
+import pytest
+from aiomqtt import MqttError
+
+from offline_spool import OfflineSpool
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingClient:
+    def __init__(self, fail_after=None):
+        self.published = []
+        self.fail_after = fail_after
+
+    async def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        if self.fail_after is not None and len(self.published) >= self.fail_after:
+            raise MqttError("broker gone")
+        self.published.append((topic, payload, qos, retain, properties))
+
+
+@pytest.fixture
+def spool_path(tmp_path):
+    return str(tmp_path / "spool" / "mqtt.jsonl")
+
+
+@pytest.mark.asyncio
+async def test_replays_in_order(spool_path):
+    spool = OfflineSpool(spool_path)
+    spool.append("ocpp/cp1/state/meter_stop", 1000)
+    spool.append("ocpp/cp1/state/meter_stop_reason", "Local", qos=1, retain=False)
+    assert len(spool) == 2
+
+    client = RecordingClient()
+    replayed = await spool.replay(client, batch_size=1)
+
+    assert replayed == 2
+    assert [(p[0], p[1], p[2], p[3]) for p in client.published] == [
+        ("ocpp/cp1/state/meter_stop", 1000, 0, True),
+        ("ocpp/cp1/state/meter_stop_reason", "Local", 1, False),
+    ]
+    assert len(spool) == 0
+    spool.close()
+
+
+@pytest.mark.asyncio
+async def test_survives_restart(spool_path):
+    spool = OfflineSpool(spool_path)
+    spool.append("topic/a", "1")
+    spool.close()
+
+    reopened = OfflineSpool(spool_path)
+    assert len(reopened) == 1
+    client = RecordingClient()
+    await reopened.replay(client)
+
+    assert client.published[0][:2] == ("topic/a", "1")
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_size_bound_drops_new_publishes(spool_path, caplog):
+    spool = OfflineSpool(spool_path, max_bytes=150)
+    accepted = [spool.append(f"topic/{i}", "x" * 20) for i in range(5)]
+
+    assert accepted[0] is True
+    assert accepted[-1] is False
+    assert spool.size <= 150
+    assert spool.dropped == accepted.count(False)
+    assert "is full" in caplog.text
+    spool.close()
+
+
+@pytest.mark.asyncio
+async def test_age_bound_discards_old_records(spool_path):
+    clock = FakeClock()
+    spool = OfflineSpool(spool_path, max_age=60, clock=clock)
+    spool.append("topic/old", "1")
+    clock.now += 30
+    spool.append("topic/new", "2")
+    clock.now += 40
+
+    client = RecordingClient()
+    await spool.replay(client)
+
+    assert [p[0] for p in client.published] == ["topic/new"]
+    spool.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_messages_are_not_replayed(spool_path):
+    clock = FakeClock()
+    spool = OfflineSpool(spool_path, clock=clock)
+    spool.append("topic/short", "1", expiry=10)
+    spool.append("topic/long", "2", expiry=100)
+    clock.now += 20
+
+    client = RecordingClient()
+    await spool.replay(client)
+
+    assert [p[0] for p in client.published] == ["topic/long"]
+    assert client.published[0][4].MessageExpiryInterval == 80
+    spool.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_replay_keeps_remaining_records(spool_path):
+    spool = OfflineSpool(spool_path)
+    for i in range(4):
+        spool.append(f"topic/{i}", i)
+
+    with pytest.raises(MqttError):
+        await spool.replay(RecordingClient(fail_after=2), batch_size=2)
+
+    spool.append("topic/4", 4)
+    client = RecordingClient()
+    await spool.replay(client, batch_size=2)
+
+    assert [p[0] for p in client.published] == ["topic/2", "topic/3", "topic/4"]
+    assert not os.path.exists(spool_path + ".replay")
+    spool.close()
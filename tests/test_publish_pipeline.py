@@ -0,0 +1,114 @@
+"""Tests for publish_pipeline module - concurrent MQTT publish queue."""
+
+import asyncio
+
+import pytest
+
+from publish_pipeline import PublishPipeline
+
+
+class RecordingSender:
+    def __init__(self, delay=0.0):
+        self.sent = []
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    async def __call__(self, topic, payload):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            self.sent.append((topic, payload))
+        finally:
+            self.active -= 1
+
+
+@pytest.mark.asyncio
+async def test_publishes_in_order_and_flushes():
+    sender = RecordingSender()
+    pipeline = PublishPipeline(sender, concurrency=1)
+
+    for i in range(5):
+        await pipeline.put(f"topic/{i}", i)
+    await pipeline.flush()
+
+    assert sender.sent == [(f"topic/{i}", i) for i in range(5)]
+    pipeline.close()
+
+
+@pytest.mark.asyncio
+async def test_coalesces_pending_topic():
+    sender = RecordingSender()
+    pipeline = PublishPipeline(sender, concurrency=1)
+
+    # No await between puts, so nothing is sent before the burst is queued
+    await pipeline.put("state/power", 1)
+    await pipeline.put("state/status", "Charging")
+    await pipeline.put("state/power", 2)
+    await pipeline.put("state/power", 3)
+    await pipeline.flush()
+
+    assert sender.sent == [("state/power", 3), ("state/status", "Charging")]
+    assert pipeline.coalesced == 2
+    pipeline.close()
+
+
+@pytest.mark.asyncio
+async def test_non_coalescing_publishes_are_all_sent():
+    sender = RecordingSender()
+    pipeline = PublishPipeline(sender, concurrency=1)
+
+    await pipeline.put("cmd_result/status", "Accepted", coalesce=False)
+    await pipeline.put("cmd_result/status", "Rejected", coalesce=False)
+    await pipeline.flush()
+
+    assert sender.sent == [("cmd_result/status", "Accepted"), ("cmd_result/status", "Rejected")]
+    pipeline.close()
+
+
+@pytest.mark.asyncio
+async def test_limits_in_flight_publishes():
+    sender = RecordingSender(delay=0.01)
+    pipeline = PublishPipeline(sender, concurrency=3)
+
+    for i in range(10):
+        await pipeline.put(f"topic/{i}", i)
+    await pipeline.flush()
+
+    assert len(sender.sent) == 10
+    assert sender.max_active == 3
+    pipeline.close()
+
+
+@pytest.mark.asyncio
+async def test_put_waits_when_queue_full():
+    sender = RecordingSender(delay=0.01)
+    pipeline = PublishPipeline(sender, max_size=2, concurrency=1)
+
+    for i in range(6):
+        await pipeline.put(f"topic/{i}", i)
+        assert len(pipeline) <= 2
+    await pipeline.flush()
+
+    assert [topic for topic, _ in sender.sent] == [f"topic/{i}" for i in range(6)]
+    pipeline.close()
+
+
+@pytest.mark.asyncio
+async def test_send_errors_do_not_stop_workers():
+    sent = []
+
+    async def flaky(topic, payload):
+        if payload == "boom":
+            raise RuntimeError("broker hiccup")
+        sent.append(topic)
+
+    pipeline = PublishPipeline(flaky, concurrency=1)
+    await pipeline.put("a", "boom")
+    await pipeline.put("b", "ok")
+    await pipeline.flush()
+
+    assert sent == ["b"]
+    pipeline.close()
@@ -0,0 +1,67 @@
+"""Tests for publish_policy module - per topic class QoS/retain policy."""
+
+import pytest
+
+import publish_policy
+from publish_policy import DEFAULT_POLICY, PublishPolicy, load_policies, message_properties, topic_class
+
+
+@pytest.mark.parametrize("topic,expected", [
+    ("ocpp/cp1/state/status", "state"),
+    ("ocpp/cp1/state/heartbeat", "state"),
+    ("ocpp/cp1/state/power_active_import", "telemetry"),
+    ("ocpp/cp1/state/energy_active_import_register", "telemetry"),
+    ("ocpp/cp1/state/current_import_l1", "telemetry"),
+    ("ocpp/cp1/state/connection_state", "connection"),
+    ("ocpp/cp1/state/disconnect_reason", "connection"),
+    ("ocpp/cp1/cmd_result/status", "cmd_result"),
+    ("ocpp/cp1/cmd_response/req-1", "cmd_response"),
+    ("ocpp/cp1/state_json", "state"),
+])
+def test_topic_class(topic, expected):
+    assert topic_class(topic) == expected
+
+
+def test_load_policies_defaults():
+    policies = load_policies(None)
+    assert set(policies) == set(publish_policy.TOPIC_CLASSES)
+    assert all(policies[name] == DEFAULT_POLICY for name in ("state", "telemetry", "cmd_result", "connection"))
+    assert policies["cmd_response"] == PublishPolicy(qos=0, retain=False, expiry=None)
+
+
+def test_load_policies_override_keeps_class_default():
+    policies = load_policies('{"cmd_response": {"qos": 1}}')
+    assert policies["cmd_response"] == PublishPolicy(qos=1, retain=False, expiry=None)
+
+
+def test_load_policies_overrides():
+    policies = load_policies(
+        '{"telemetry": {"qos": 0, "retain": false}, "connection": {"qos": 1}, "cmd_result": {"retain": false, "expiry": 60}}'
+    )
+
+    assert policies["telemetry"] == PublishPolicy(qos=0, retain=False, expiry=None)
+    assert policies["connection"] == PublishPolicy(qos=1, retain=True, expiry=None)
+    assert policies["cmd_result"] == PublishPolicy(qos=0, retain=False, expiry=60)
+    assert policies["state"] == DEFAULT_POLICY
+
+
+@pytest.mark.parametrize("raw", [
+    'not json',
+    '[1, 2]',
+    '{"telemetry": {"qos": 3}}',
+    '{"telemetry": {"retain": "yes"}}',
+    '{"telemetry": {"expiry": -5}}',
+    '{"unknown": {"qos": 1}}',
+])
+def test_load_policies_invalid_values_fall_back(raw, caplog):
+    policies = load_policies(raw)
+
+    assert policies["telemetry"] == DEFAULT_POLICY
+    assert "MQTT_PUBLISH_POLICY" in caplog.text
+
+
+def test_message_properties():
+    assert message_properties(DEFAULT_POLICY) is None
+
+    properties = message_properties(PublishPolicy(qos=1, retain=False, expiry=30))
+    assert properties.MessageExpiryInterval == 30
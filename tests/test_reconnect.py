@@ -0,0 +1,79 @@
+"""Tests for reconnect module - jittered backoff and reconnect statistics."""
+
+import asyncio
+
+import pytest
+
+from reconnect import ReconnectCoordinator
+
+
+def test_delays_use_decorrelated_jitter():
+    bounds = []
+
+    def rng(low, high):
+        bounds.append((low, high))
+        return high
+
+    coordinator = ReconnectCoordinator(base_delay=1, max_delay=20, rng=rng)
+
+    assert [coordinator.next_delay() for _ in range(4)] == [3, 9, 20, 20]
+    assert bounds[:3] == [(1, 3), (1, 9), (1, 27)]
+
+
+def test_delays_are_spread_between_gateways():
+    delays = {ReconnectCoordinator(base_delay=5, max_delay=60).next_delay() for _ in range(20)}
+    assert len(delays) > 1
+    assert all(5 <= delay <= 15 for delay in delays)
+
+
+@pytest.mark.asyncio
+async def test_success_resets_backoff():
+    coordinator = ReconnectCoordinator(base_delay=1, max_delay=20, rng=lambda low, high: high)
+    coordinator.next_delay()
+    coordinator.next_delay()
+
+    async with coordinator.attempt():
+        pass
+
+    assert coordinator.next_delay() == 3
+    assert coordinator.snapshot()['state'] == 'connected'
+
+
+@pytest.mark.asyncio
+async def test_failed_attempts_are_counted():
+    coordinator = ReconnectCoordinator(base_delay=1, clock=lambda: 50.0)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            async with coordinator.attempt():
+                raise OSError("connection refused")
+    async with coordinator.attempt():
+        pass
+    coordinator.disconnected(OSError("broker restart"))
+    async with coordinator.attempt():
+        pass
+
+    snapshot = coordinator.snapshot()
+    assert snapshot['attempts'] == 4
+    assert snapshot['failures'] == 2
+    assert snapshot['consecutive_failures'] == 0
+    assert snapshot['reconnects'] == 1
+    assert snapshot['last_error'] == "OSError: broker restart"
+    assert snapshot['connected_since'] == 50.0
+
+
+@pytest.mark.asyncio
+async def test_attempt_in_progress_is_reported_as_connecting():
+    coordinator = ReconnectCoordinator()
+    release = asyncio.Event()
+
+    async def connect():
+        async with coordinator.attempt():
+            await release.wait()
+
+    task = asyncio.create_task(connect())
+    await asyncio.sleep(0.01)
+
+    assert coordinator.snapshot()['state'] == 'connecting'
+    release.set()
+    await task
+    assert coordinator.snapshot()['state'] == 'connected'
@@ -0,0 +1,108 @@
+"""Tests for telemetry_aggregator module - windowed aggregation and deadbands."""
+
+from telemetry_aggregator import TelemetryAggregator, is_raw_station, load_deadbands
+
+
+def test_load_deadbands():
+    assert load_deadbands(None) == {}
+    assert load_deadbands('{"voltage": 2, "power_active_import": 50}') == {'voltage': 2.0, 'power_active_import': 50.0}
+    assert load_deadbands('5') == {'default': 5.0}
+
+
+def test_load_deadbands_invalid():
+    assert load_deadbands('not json') == {}
+    assert load_deadbands('[1, 2]') == {}
+    assert load_deadbands('{"voltage": -1, "current_import": "x", "power_active_import": 10}') == {
+        'power_active_import': 10.0}
+
+
+def test_is_raw_station():
+    assert is_raw_station('site1-cp1', ['site1-*'])
+    assert is_raw_station('cp2', ['cp1', 'cp2'])
+    assert not is_raw_station('site2-cp1', ['site1-*'])
+    assert not is_raw_station('cp1', [])
+
+
+def test_window_aggregates_min_max_mean_last():
+    aggregator = TelemetryAggregator(window=60)
+    for power in ('3000', '3600', '3300'):
+        assert aggregator.add({'transaction_id': 7, 'power_active_import': power,
+                               'meter_timestamp': '2026-01-27T10:00:00Z'}) == {'transaction_id': 7}
+
+    assert aggregator.pending
+    assert aggregator.flush() == {
+        'power_active_import': '3300',
+        'power_active_import_min': '3000',
+        'power_active_import_max': '3600',
+        'power_active_import_mean': '3300',
+        'meter_timestamp': '2026-01-27T10:00:00Z',
+    }
+    assert not aggregator.pending
+    assert aggregator.flush() == {}
+    assert aggregator.samples == 3
+
+
+def test_window_deadband_applies_to_last_value():
+    aggregator = TelemetryAggregator(window=60, deadbands={'voltage': 2})
+    aggregator.add({'voltage_l1_n': '230.0', 'meter_context': 'Sample.Periodic'})
+    assert aggregator.flush()['voltage_l1_n'] == '230.0'
+
+    aggregator.add({'voltage_l1_n': '231.5'})
+    assert aggregator.flush() == {}
+    assert aggregator.suppressed == 1
+
+
+def test_raw_mode_deadband():
+    aggregator = TelemetryAggregator(deadbands={'default': 1, 'power_active_import': 100})
+    assert aggregator.add({'power_active_import': '3500', 'current_import': '16'}) == {
+        'power_active_import': '3500', 'current_import': '16'}
+    assert aggregator.add({'power_active_import': '3550', 'current_import': '16.5'}) == {}
+    assert aggregator.add({'power_active_import': '3700', 'current_import': '16.5'}) == {'power_active_import': '3700'}
+    assert aggregator.suppressed == 3
+
+
+def test_raw_mode_metadata_only_with_a_reading():
+    aggregator = TelemetryAggregator(deadbands={'default': 1})
+    first = {'current_import': '16', 'meter_timestamp': 't1'}
+    assert aggregator.add(first) == first
+    assert aggregator.add({'current_import': '16', 'meter_timestamp': 't2'}) == {}
+    # Samples without any numeric reading keep their metadata
+    assert aggregator.add({'meter_timestamp': 't3'}) == {'meter_timestamp': 't3'}
+
+
+def test_non_numeric_values_pass_through():
+    aggregator = TelemetryAggregator(window=60)
+    assert aggregator.add({'current_import': 'n/a', 'status': 'Charging'}) == {
+        'current_import': 'n/a', 'status': 'Charging'}
+    assert not aggregator.pending
+
+
+def test_reset_forgets_published_values():
+    aggregator = TelemetryAggregator(deadbands={'default': 10})
+    aggregator.add({'power_active_import': '0'})
+    aggregator.reset()
+    assert aggregator.add({'power_active_import': '0'}) == {'power_active_import': '0'}
+
+
+def test_override_sets_baseline_and_drops_pending():
+    aggregator = TelemetryAggregator(deadbands={'default': 100})
+    aggregator.add({'power_active_import': '7000'})
+    aggregator.override({'power_active_import': 0})
+    assert aggregator.add({'power_active_import': '7000'}) == {'power_active_import': '7000'}
+    assert aggregator.add({'power_active_import': '7050'}) == {}
+
+    windowed = TelemetryAggregator(window=60)
+    windowed.add({'power_active_import': '7000', 'voltage': '230'})
+    windowed.override({'power_active_import': 0})
+    assert list(windowed.flush()) == ['voltage', 'voltage_min', 'voltage_max', 'voltage_mean']
+
+
+def test_window_excursion_is_published_although_last_is_unchanged():
+    aggregator = TelemetryAggregator(window=60)
+    aggregator.add({'power_active_import': '7000'})
+    aggregator.flush()
+    for value in ('7000', '0', '7000'):
+        aggregator.add({'power_active_import': value})
+
+    assert aggregator.flush() == {'power_active_import': '7000', 'power_active_import_min': '0',
+                                  'power_active_import_max': '7000', 'power_active_import_mean': '4666.666667'}
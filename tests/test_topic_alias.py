@@ -0,0 +1,60 @@
+"""Tests for topic_alias module - MQTT v5 topic alias assignment."""
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from topic_alias import TopicAliasMap
+
+
+def test_alias_assigned_on_second_publish():
+    aliases = TopicAliasMap(maximum=2)
+
+    topic, properties = aliases.apply("ocpp/cp1/state/voltage")
+    assert topic == "ocpp/cp1/state/voltage"
+    assert properties is None
+
+    topic, properties = aliases.apply("ocpp/cp1/state/voltage")
+    assert topic == "ocpp/cp1/state/voltage"
+    assert properties.TopicAlias == 1
+
+
+def test_aliased_topic_is_sent_empty():
+    aliases = TopicAliasMap(maximum=2, min_uses=1)
+    aliases.apply("ocpp/cp1/state/voltage")
+
+    topic, properties = aliases.apply("ocpp/cp1/state/voltage")
+
+    assert topic == ""
+    assert properties.TopicAlias == 1
+    assert aliases.saved_bytes == len("ocpp/cp1/state/voltage")
+
+
+def test_alias_keeps_message_expiry():
+    aliases = TopicAliasMap(maximum=1, min_uses=1)
+    expiry = Properties(PacketTypes.PUBLISH)
+    expiry.MessageExpiryInterval = 60
+
+    _, properties = aliases.apply("ocpp/cp1/cmd_result/status", expiry)
+
+    assert properties.TopicAlias == 1
+    assert properties.MessageExpiryInterval == 60
+
+
+def test_no_alias_once_table_is_full():
+    aliases = TopicAliasMap(maximum=1, min_uses=1)
+    aliases.apply("ocpp/cp1/state/voltage")
+
+    topic, properties = aliases.apply("ocpp/cp1/state/status")
+
+    assert topic == "ocpp/cp1/state/status"
+    assert properties is None
+    assert len(aliases) == 1
+
+
+def test_candidate_counts_are_bounded():
+    aliases = TopicAliasMap(maximum=4, max_candidates=3)
+    for i in range(10):
+        aliases.apply(f"ocpp/cp1/cmd_response/{i}")
+
+    assert len(aliases._uses) <= 3
+    assert len(aliases) == 0
@@ -0,0 +1,74 @@
+# MQTT v5 topic aliases for frequently published topics
+# After a topic has been sent once with an alias, later publishes only carry
+# the two-byte alias instead of the full topic string.
+
+import logging
+from functools import lru_cache
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+# Use logger from logging_config (configured by central_system.py)
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1024)
+def _alias_properties(alias, expiry):
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.TopicAlias = alias
+    if expiry is not None:
+        properties.MessageExpiryInterval = expiry
+    return properties
+
+
+class TopicAliasMap:
+    """Client-side topic alias table for one MQTT v5 connection.
+
+    Aliases are handed out to topics on their ``min_uses``-th publish, so
+    one-off topics do not use up the table, until ``maximum`` aliases are in
+    use; at most ``max_candidates`` not-yet-aliased topics are counted at a
+    time. ``maximum`` must not exceed the broker's Topic Alias Maximum. The
+    table is only valid for the connection it was built for.
+    """
+
+    def __init__(self, maximum, min_uses=2, max_candidates=1024):
+        self._maximum = maximum
+        self._min_uses = max(1, min_uses)
+        self._max_candidates = max_candidates
+        self._aliases = {}
+        self._uses = {}
+        self.saved_bytes = 0
+
+    def __len__(self):
+        return len(self._aliases)
+
+    def apply(self, topic, properties=None):
+        """Return the (topic, properties) pair to publish with.
+
+        Must be called right before the publish is handed to the client so
+        the broker sees the alias being set before it is used on its own.
+        """
+        expiry = getattr(properties, 'MessageExpiryInterval', None)
+        alias = self._aliases.get(topic)
+        if alias is not None:
+            self.saved_bytes += len(topic.encode('utf-8'))
+            return '', _alias_properties(alias, expiry)
+
+        if len(self._aliases) >= self._maximum:
+            return topic, properties
+        uses = self._uses.get(topic, 0) + 1
+        if uses < self._min_uses:
+            if len(self._uses) >= self._max_candidates:
+                # One-off topics (e.g. per-request results) must not pile up
+                self._uses.clear()
+            self._uses[topic] = uses
+            return topic, properties
+
+        self._uses.pop(topic, None)
+        alias = len(self._aliases) + 1
+        self._aliases[topic] = alias
+        if len(self._aliases) >= self._maximum:
+            # Table is full, no need to keep counting candidates
+            self._uses.clear()
+        logging.debug("MQTT topic alias %d assigned to %s", alias, topic)
+        return topic, _alias_properties(alias, expiry)